@@ -0,0 +1,93 @@
+import logging
+import secrets
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from starlette.responses import JSONResponse
+
+import cache
+from api.dependencies import get_app_context
+from api.dto.links import ModerateLinksRequest
+from context import AppContext
+
+logger = logging.getLogger(__name__)
+
+
+async def verify_admin_token(
+    x_admin_token: str | None = Header(default=None), context: AppContext = Depends(get_app_context)
+):
+    """
+    Проверяет токен административных методов из заголовка X-Admin-Token.
+    Если ADMIN_TOKEN не задан, административные методы отключены.
+    """
+    admin_token = context.api_config.admin_token
+    if admin_token is None:
+        raise HTTPException(status_code=403, detail="Admin API is disabled")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, admin_token.get_secret_value()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/api/v1/admin", dependencies=[Depends(verify_admin_token)])
+
+
+@router.get("/cache/stats", response_class=JSONResponse)
+async def cache_stats(context: AppContext = Depends(get_app_context)):
+    """
+    Возвращает счётчики кеша ссылок в памяти процесса: попадания, промахи и вытеснения,
+    а также счётчики кеша несуществующих кодов и долю ложноположительных ответов фильтра.
+    """
+    return JSONResponse(status_code=200, content={
+        "local": context.local_cache.stats(),
+        "negative": context.negative_cache.stats(),
+    })
+
+
+@router.get("/pool/stats", response_class=JSONResponse)
+async def pool_stats(context: AppContext = Depends(get_app_context)):
+    """
+    Возвращает заполненность пространства коротких кодов по длинам для планирования ёмкости.
+    """
+    return JSONResponse(status_code=200, content={"lengths": await context.async_database.get_short_url_pool_stats()})
+
+
+async def set_links_banned(context: AppContext, request: ModerateLinksRequest, banned: bool) -> int:
+    """
+    Меняет блокировку ссылок в базе одной транзакцией и сбрасывает их из Redis, обратного индекса
+    оригинальных URL и кешей в памяти всех процессов. Разблокированные ссылки сразу возвращаются в Redis,
+    иначе редиректы по ним шли бы в базу до следующего прогрева.
+
+    :param context: Контекст приложения
+    :param request: Короткие коды и хосты
+    :param banned: True для блокировки, False для разблокировки
+    :return: Количество найденных ссылок
+    """
+    try:
+        links = await context.async_database.set_links_banned(banned, request.short_urls, request.hosts)
+        await cache.delete_short_links(
+            [short_url_hash for short_url_hash, _ in links],
+            [original_url_hash for _, original_url_hash in links if original_url_hash is not None],
+        )
+        if not banned and links:
+            await cache.restore_short_links(
+                await context.async_database.get_active_links_by_hashes([short_url_hash for short_url_hash, _ in links])
+            )
+    except Exception:
+        logger.exception("Failed to change links ban")
+        raise HTTPException(status_code=503, detail="Technical troubles, please try again later")
+    return len(links)
+
+
+@router.post("/links/ban", response_class=JSONResponse)
+async def ban_links(request: ModerateLinksRequest, context: AppContext = Depends(get_app_context)):
+    """
+    Блокирует ссылки по коротким кодам и по хостам оригинальных URL (точное совпадение хоста).
+    Заблокированные ссылки перестают открываться сразу после ответа. Повторный запрос безопасен.
+    """
+    return JSONResponse(status_code=200, content={"links": await set_links_banned(context, request, True)})
+
+
+@router.post("/links/unban", response_class=JSONResponse)
+async def unban_links(request: ModerateLinksRequest, context: AppContext = Depends(get_app_context)):
+    """
+    Снимает блокировку ссылок по коротким кодам и по хостам оригинальных URL.
+    """
+    return JSONResponse(status_code=200, content={"links": await set_links_banned(context, request, False)})
@@ -0,0 +1,11 @@
+from starlette.requests import Request
+
+from context import AppContext
+
+
+def get_app_context(request: Request) -> AppContext:
+    """
+    Контекст приложения, открытый в FastAPI lifespan.
+    Обработчики получают ресурсы через Depends(get_app_context), а не через глобальные переменные модулей.
+    """
+    return request.app.state.context
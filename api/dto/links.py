@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from pydantic_core import Url
 
 
@@ -10,3 +10,20 @@ class CreateShortLinkRequest(BaseModel):
     url: Url
     length: int = Field(..., ge=5, le=15)
     expires_at: Optional[datetime] = None
+
+
+class CreateShortLinksBatchRequest(BaseModel):
+    """Тело запроса на пакетное создание коротких ссылок"""
+    items: list[CreateShortLinkRequest] = Field(..., min_length=1, max_length=1000)
+
+
+class ModerateLinksRequest(BaseModel):
+    """Тело запроса на блокировку или разблокировку ссылок по коротким кодам и/или хостам оригинальных URL"""
+    short_urls: list[str] = Field(default_factory=list, max_length=100000)
+    hosts: list[str] = Field(default_factory=list, max_length=1000)
+
+    @model_validator(mode="after")
+    def check_not_empty(self):
+        if not self.short_urls and not self.hosts:
+            raise ValueError("short_urls or hosts must be specified")
+        return self
@@ -1,48 +1,289 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import functools
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Literal
+
+from fastapi import Depends, FastAPI, HTTPException
 from starlette.requests import Request
-from starlette.responses import JSONResponse, RedirectResponse
+from starlette.responses import JSONResponse, RedirectResponse, Response
 
 import cache
-from database import database
-from api.dto.links import CreateShortLinkRequest
+import metrics
+from api import admin
+from api.dependencies import get_app_context
+from api.dto.links import CreateShortLinkRequest, CreateShortLinksBatchRequest
+from context import AppContext, app_context
 from database import ShortLinkWithThatUrlAlreadyExists, ThisLengthPoolFilled
+from utils import canonicalize_url, run_periodically
+
+logger = logging.getLogger(__name__)
+
+_shorten_total = metrics.stage_seconds.labels("shorten", "total")
+_shorten_db = metrics.stage_seconds.labels("shorten", "db")
+_shorten_cache = metrics.stage_seconds.labels("shorten", "cache")
+_shorten_lookup = metrics.stage_seconds.labels("shorten", "lookup")
+_shorten_batch_total = metrics.stage_seconds.labels("shorten_batch", "total")
+_redirect_total = metrics.stage_seconds.labels("redirect", "total")
+_redirect_cache = metrics.stage_seconds.labels("redirect", "cache")
+_redirect_db = metrics.stage_seconds.labels("redirect", "db")
+_redirect_click = metrics.stage_seconds.labels("redirect", "click")
+_redirect_response = metrics.stage_seconds.labels("redirect", "response")
+_db_fallback_found = metrics.redirect_db_fallbacks.labels("found")
+_db_fallback_missing = metrics.redirect_db_fallbacks.labels("missing")
+
+
+async def sweep_expired_links(context: AppContext):
+    """
+    Удаляет из базы ссылки с истёкшим сроком действия пачками по expired_links_sweep_batch_size,
+    каждая пачка в отдельной короткой транзакции, чтобы не блокировать запись надолго.
+    Удалённые ссылки сбрасываются из Redis и кешей в памяти всех процессов.
+
+    :param context: Контекст приложения
+    """
+    batch_size = context.db_config.expired_links_sweep_batch_size
+    while True:
+        lookup_keys = await context.async_database.delete_expired_links(batch_size)
+        await cache.delete_short_links(lookup_keys)
+        if len(lookup_keys) < batch_size:
+            return
+
+
+async def rollup_clicks(context: AppContext):
+    """
+    Агрегирует новые клики в часовую и суточную статистику пачками по click_rollup_batch_size,
+    пока не будут учтены все клики, записанные к этому моменту.
 
-app = FastAPI(lifespan=cache.cache_warmup)
+    :param context: Контекст приложения
+    """
+    config = context.clicks_config
+    while True:
+        rolled_up = await context.async_database.rollup_clicks(
+            config.click_rollup_batch_size, config.click_rollup_top_user_agents
+        )
+        if rolled_up < config.click_rollup_batch_size:
+            return
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Открывает контекст приложения, прогревает кеш и запускает фоновые задачи: запись кликов,
+    сброс кеша в памяти по сообщениям других процессов, пополнение пулов коротких кодов,
+    удаление ссылок с истёкшим сроком действия, агрегацию статистики кликов и удаление устаревших партиций кликов.
+    При остановке дописывает в базу все накопленные клики, закрывает соединения и удаляет файлы gauge метрик процесса.
+    """
+    context = app.state.context = app_context
+    db_config = context.db_config
+    async with cache.cache_warmup(app):
+        context.click_buffer.start()
+        tasks = [
+            asyncio.create_task(cache.listen_invalidations()),
+            asyncio.create_task(run_periodically(
+                context.async_database.refill_short_url_pools, db_config.short_url_pool_refill_interval_seconds
+            )),
+            asyncio.create_task(run_periodically(
+                functools.partial(sweep_expired_links, context), db_config.expired_links_sweep_interval_seconds
+            )),
+            asyncio.create_task(run_periodically(
+                functools.partial(rollup_clicks, context), context.clicks_config.click_rollup_interval_seconds
+            )),
+        ]
+        if db_config.click_partition_retention:
+            tasks.append(asyncio.create_task(run_periodically(
+                functools.partial(
+                    context.async_database.drop_expired_click_partitions,
+                    db_config.click_partition_retention, db_config.click_partition_archive_dir,
+                ),
+                db_config.click_partition_retention_interval_seconds
+            )))
+        yield
+        for task in tasks:
+            task.cancel()
+        await context.click_buffer.stop()
+    await context.aclose()
+    metrics.mark_process_dead()
+
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(admin.router)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(context: AppContext = Depends(get_app_context)):
+    """
+    Метрики в текстовом формате Prometheus: всех воркеров в режиме production, иначе текущего процесса.
+    Объявлен до редиректа, чтобы путь не был принят за короткий код.
+    """
+    if not context.api_config.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=metrics.generate_latest_metrics(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+
+async def find_existing_short_urls(context: AppContext, original_urls: list[str]) -> list[str | None]:
+    """
+    Ищет короткие ссылки, уже созданные для URL: сначала в обратном индексе Redis,
+    промахи - по индексу хеша канонического URL в базе. Найденные в базе ссылки записываются в Redis.
+
+    :param context: Контекст приложения
+    :param original_urls: Оригинальные URL
+    :return: Короткий URL или None для каждого URL в том же порядке
+    """
+    short_urls = await cache.get_short_urls_by_original_urls(original_urls)
+    missed = [original_url for original_url, short_url in zip(original_urls, short_urls) if short_url is None]
+    if not missed:
+        return short_urls
+
+    found = await context.async_database.get_links_by_original_urls(missed)
+    if found:
+        await cache.set_original_urls([
+            (original_url, short_url, expires_at) for original_url, (_, short_url, expires_at) in found.items()
+        ])
+    return [
+        short_url if short_url is not None else found.get(original_url, (None, None))[1]
+        for original_url, short_url in zip(original_urls, short_urls)
+    ]
 
 
 @app.post("/api/v1/shorten", response_class=JSONResponse)
-async def shorten(link: CreateShortLinkRequest):
+@metrics.timed(_shorten_total)
+async def shorten(link: CreateShortLinkRequest, context: AppContext = Depends(get_app_context)):
     """
     Создает короткую ссылку для указанного URL с указанной длиной.
+    Если для URL уже есть ссылка, в идемпотентном режиме (SHORTEN_IDEMPOTENT) возвращается она: поиск выполняется
+    чтением до шифрования и записи в базу. Иначе ошибку 400 даёт уникальность оригинального URL в базе без лишнего чтения.
     """
+    original_url = link.url.__str__()
+    idempotent = context.api_config.shorten_idempotent
     try:
-        link_id, short_url = database.create_link(link.url.__str__(), link.length)
-        cache.set_short_link(short_url, link.url.__str__(), link_id)
+        existing = None
+        if idempotent:
+            with _shorten_lookup.time():
+                existing = (await find_existing_short_urls(context, [original_url]))[0]
+        if existing is None:
+            with _shorten_db.time():
+                link_id, short_url = await context.async_database.create_link(original_url, link.length, link.expires_at)
+            with _shorten_cache.time():
+                await cache.set_short_link(short_url, original_url, link_id, link.expires_at)
+                await cache.set_original_urls([(original_url, short_url, link.expires_at)])
     except ShortLinkWithThatUrlAlreadyExists:
-        raise HTTPException(status_code=400, detail="Short link with that url already exists")
+        # Ссылка для URL уже есть в базе или её параллельно создал другой запрос
+        existing = None
+        if idempotent:
+            existing = (await find_existing_short_urls(context, [original_url]))[0]
+        if existing is None:
+            raise HTTPException(status_code=400, detail="Short link with that url already exists")
     except ThisLengthPoolFilled:
         raise HTTPException(status_code=400, detail="Pool of short links with that length is filled")
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception("Failed to create short link")
         raise HTTPException(status_code=503, detail="Technical troubles, please try again later")
 
-    return JSONResponse(status_code=200, content={"url": short_url})
+    return JSONResponse(status_code=200, content={"url": existing if existing is not None else short_url})
+
+
+@app.post("/api/v1/shorten/batch", response_class=JSONResponse)
+@metrics.timed(_shorten_batch_total)
+async def shorten_batch(batch: CreateShortLinksBatchRequest, context: AppContext = Depends(get_app_context)):
+    """
+    Создает короткие ссылки для списка URL одной транзакцией.
+    Возвращает результат для каждого элемента в том же порядке: короткую ссылку или ошибку.
+    В идемпотентном режиме для URL, у которых уже есть ссылка, возвращается она, в базу пишутся только новые URL,
+    а повторы одного URL в пачке получают одну ссылку.
+    """
+    items = [(item.url.__str__(), item.length, item.expires_at) for item in batch.items]
+    idempotent = context.api_config.shorten_idempotent
+    try:
+        if idempotent:
+            existing = await find_existing_short_urls(context, [item[0] for item in items])
+        else:
+            existing = [None] * len(items)
+        # В идемпотентном режиме повтор URL внутри пачки получает ссылку первого вхождения, а не ошибку
+        first_positions: dict[str, int] = {}
+        sources = [
+            first_positions.setdefault(canonicalize_url(item[0]), i) if idempotent and short_url is None else i
+            for i, (item, short_url) in enumerate(zip(items, existing))
+        ]
+        new_positions = [i for i, short_url in enumerate(existing) if short_url is None and sources[i] == i]
+        created = dict(zip(
+            new_positions,
+            await context.async_database.create_links([items[i] for i in new_positions]) if new_positions else []
+        ))
+        results = [(None, short_url) if short_url is not None else created[sources[i]]
+                   for i, short_url in enumerate(existing)]
+
+        created_links = [(items[i], created[i]) for i in new_positions if not isinstance(created[i], Exception)]
+        await cache.set_short_links([(result[1], result[2], result[0], item[2]) for item, result in created_links])
+        await cache.set_original_urls([(item[0], result[1], item[2]) for item, result in created_links])
+    except Exception:
+        logger.exception("Failed to create short links batch")
+        raise HTTPException(status_code=503, detail="Technical troubles, please try again later")
+
+    response = []
+    for result in results:
+        if isinstance(result, ShortLinkWithThatUrlAlreadyExists):
+            response.append({"error": "Short link with that url already exists"})
+        elif isinstance(result, ThisLengthPoolFilled):
+            response.append({"error": "Pool of short links with that length is filled"})
+        else:
+            response.append({"url": result[1]})
+    return JSONResponse(status_code=200, content={"results": response})
+
+
+@app.get("/api/v1/links/{short_url}/stats", response_class=JSONResponse)
+async def link_stats(short_url: str, granularity: Literal["hour", "day"] = "day",
+                     since: datetime | None = None, until: datetime | None = None,
+                     context: AppContext = Depends(get_app_context)):
+    """
+    Статистика переходов по короткой ссылке из часовых или суточных агрегатов:
+    количество кликов, оценка уникальных IP, самые частые User-Agent и разбивка по корзинам.
+    Клики учитываются фоновой агрегацией, поэтому статистика отстаёт на click_rollup_interval_seconds.
+    """
+    config = context.clicks_config
+    until = until or datetime.now(timezone.utc)
+    since = since or until - timedelta(days=config.click_stats_default_days)
+    try:
+        stats = await context.async_database.get_link_click_stats(
+            short_url, granularity, since, until, config.click_rollup_top_user_agents
+        )
+    except Exception:
+        logger.exception("Failed to get link stats")
+        raise HTTPException(status_code=503, detail="Technical troubles, please try again later")
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Short link with that url does not exist")
+    return JSONResponse(status_code=200, content=stats)
 
 
 @app.get("/{short_url}", response_class=JSONResponse)
-async def redirect_to_original_link(short_url: str, request: Request):
+@metrics.timed(_redirect_total)
+async def redirect_to_original_link(short_url: str, request: Request, context: AppContext = Depends(get_app_context)):
     """
     Перенаправляет по короткой ссылке на оригинальный URL.
     """
     try:
-        short_link = cache.get_short_link(short_url)
-        if not short_link:
-            short_link = database.get_link_by_short_url(short_url)
-    except Exception as e:
+        with _redirect_cache.time():
+            short_link = await cache.get_short_link(short_url)
+        if short_link is cache.LINK_MISSING:
+            short_link = None
+        elif not short_link:
+            with _redirect_db.time():
+                short_link = await context.async_database.get_redirect_target(short_url)
+            (_db_fallback_found if short_link else _db_fallback_missing).inc()
+            if not short_link:
+                await cache.set_short_link_missing(short_url)
+    except Exception:
+        logger.exception("Failed to resolve short link")
         raise HTTPException(status_code=503, detail="Technical troubles, please try again later")
     if not short_link:
         raise HTTPException(status_code=404, detail="Short link with that url does not exist")
 
-    metadata = "User-Agent: "+request.headers.get("User-Agent")+"\nIP: "+request.client.host
-    database.add_click_on_link(short_link.id, metadata)
-    return RedirectResponse(url=short_link.original_url)
+    with _redirect_click.time():
+        await context.click_buffer.push(
+            short_link.id,
+            request.headers.get("User-Agent"),
+            request.client.host if request.client else None,
+            request.headers.get("Referer"),
+        )
+    with _redirect_response.time():
+        return RedirectResponse(url=short_link.original_url)
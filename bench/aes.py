@@ -0,0 +1,70 @@
+"""
+Микробенчмарк шифрования AES-256.
+
+Сравнивает стоимость одного вызова до появления AESEngine (декодирование ключа/IV
+и создание Cipher на каждый вызов) с AESEngine и его пакетными вариантами.
+
+Запуск:
+    python -m bench.aes --count 20000
+"""
+import argparse
+import base64
+import timeit
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from config import AESConfig
+from context import app_context
+
+aes_config = AESConfig()
+
+
+def legacy_encrypt(plaintext: str) -> str:
+    key = base64.b64decode(aes_config.aes_key_b64.get_secret_value())
+    iv = base64.b64decode(aes_config.aes_iv_b64.get_secret_value())
+    if len(key) != 32 or len(iv) != 16:
+        raise ValueError
+    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+    padded_data = padder.update(plaintext.encode()) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend()).encryptor()
+    return base64.b64encode(encryptor.update(padded_data) + encryptor.finalize()).decode('utf-8')
+
+
+def legacy_decrypt(encrypted_base64: str) -> str:
+    key = base64.b64decode(aes_config.aes_key_b64.get_secret_value())
+    iv = base64.b64decode(aes_config.aes_iv_b64.get_secret_value())
+    if len(key) != 32 or len(iv) != 16:
+        raise ValueError
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend()).decryptor()
+    decrypted_padded = decryptor.update(base64.b64decode(encrypted_base64)) + decryptor.finalize()
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    return (unpadder.update(decrypted_padded) + unpadder.finalize()).decode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20000)
+    args = parser.parse_args()
+
+    aes_engine = app_context.aes_engine
+    urls = [f"https://example.com/some/long/path/{i}?utm_source=bench" for i in range(args.count)]
+    encrypted = aes_engine.encrypt_many(urls)
+
+    cases = {
+        "legacy encrypt": lambda: [legacy_encrypt(url) for url in urls],
+        "engine encrypt": lambda: [aes_engine.encrypt(url) for url in urls],
+        "engine encrypt_many": lambda: aes_engine.encrypt_many(urls),
+        "legacy decrypt": lambda: [legacy_decrypt(value) for value in encrypted],
+        "engine decrypt": lambda: [aes_engine.decrypt(value) for value in encrypted],
+        "engine decrypt_many": lambda: aes_engine.decrypt_many(encrypted),
+    }
+    print(f"{'case':<22} {'us/op':>8}")
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=1, repeat=3))
+        print(f"{name:<22} {seconds / args.count * 1e6:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
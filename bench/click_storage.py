@@ -0,0 +1,105 @@
+"""
+Бенчмарк места, занимаемого кликами в SQLite.
+
+Создаёт временную базу на схеме до миграции 7 (метаданные клика одной строкой
+"User-Agent: ...\\nIP: ..."), заполняет её --clicks кликами и печатает размер базы после VACUUM.
+Затем применяет миграцию 7 (User-Agent в словаре user_agents, IP в упакованном виде),
+печатает время переноса и размер базы после VACUUM. Ссылки в обеих версиях одни и те же,
+поэтому разница размеров - это разница хранения кликов.
+
+Запуск:
+    python -m bench.click_storage --clicks 1000000 --user-agents 500
+"""
+import argparse
+import ipaddress
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+BROWSERS = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{v}.0 Safari/605.1.15",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_{v} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:{v}.0) Gecko/20100101 Firefox/{v}.0",
+    "TelegramBot (like TwitterBot) v{v}",
+)
+
+
+def generate_clicks(count: int, links: int, user_agents: int, seed: int) -> list[tuple[int, str]]:
+    """
+    :param count: Количество кликов
+    :param links: Количество ссылок, по которым распределяются клики
+    :param user_agents: Количество различных User-Agent (частоты убывают по закону Ципфа)
+    :param seed: Seed генератора
+    :return: Клики в формате (id ссылки, метаданные в прежнем текстовом формате)
+    """
+    rng = random.Random(seed)
+    agents = [BROWSERS[i % len(BROWSERS)].format(v=100 + i // len(BROWSERS)) for i in range(user_agents)]
+    weights = [1 / (rank + 1) for rank in range(user_agents)]
+    clicks = []
+    for agent in rng.choices(agents, weights, k=count):
+        if rng.random() < 0.1:
+            ip = str(ipaddress.IPv6Address(rng.getrandbits(128)))
+        else:
+            ip = str(ipaddress.IPv4Address(rng.getrandbits(32)))
+        clicks.append((rng.randint(1, links), f"User-Agent: {agent}\nIP: {ip}"))
+    return clicks
+
+
+def database_size(db, filename: str) -> int:
+    """
+    Размер базы в байтах после VACUUM. Соединения базы закрываются, пул откроет их заново при следующем запросе.
+
+    :param db: Экземпляр database.Database
+    :param filename: Путь к файлу базы
+    """
+    db.pool.close()
+    connection = sqlite3.connect(filename)
+    connection.execute("VACUUM")
+    page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+    page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+    connection.close()
+    return page_count * page_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clicks", type=int, default=200000)
+    parser.add_argument("--links", type=int, default=1000)
+    parser.add_argument("--user-agents", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    from config import DbConfig
+    from database import Database, DatabaseMigrator
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "clicks.db")
+        db = Database(DbConfig(db_filename=filename))
+        migrator = DatabaseMigrator(db)
+        migrator.upgrade(6)
+        clicks = generate_clicks(args.clicks, args.links, args.user_agents, args.seed)
+        with db.pool.writer() as cursor:
+            # Ссылки в схеме версии 6: кликам нужны только их id
+            cursor.executemany(
+                "INSERT INTO links(short_url, original_url, short_url_length) VALUES(?,?,?)",
+                [(f"short/{i}", f"https://example.com/{i}", 8) for i in range(args.links)]
+            )
+            cursor.executemany("INSERT INTO clicks(link_id, metadata) VALUES(?,?)", clicks)
+        before = database_size(db, filename)
+
+        started = time.perf_counter()
+        migrator.upgrade(7)
+        migration_seconds = time.perf_counter() - started
+        after = database_size(db, filename)
+
+    print(f"{'schema':>10} {'size MiB':>10} {'bytes/click':>12}")
+    print(f"{'metadata':>10} {before / 2 ** 20:>10.1f} {before / args.clicks:>12.1f}")
+    print(f"{'columns':>10} {after / 2 ** 20:>10.1f} {after / args.clicks:>12.1f}")
+    print(f"migration 7: {migration_seconds:.1f} s ({args.clicks / migration_seconds:.0f} clicks/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Сравнение двух результатов bench.suite.
+
+Печатает каждую метрику обоих прогонов и изменение в процентах. Ухудшения больше --threshold помечаются.
+Для задержек и времени ухудшение - рост, для rps и links_per_s - падение.
+
+Запуск:
+    python -m bench.compare base.json new.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+HIGHER_IS_BETTER = ("rps", "links_per_s")
+KEY_FIELDS = ("hit_ratio", "length", "size")
+
+
+def flatten(results: dict) -> dict[str, float]:
+    """
+    Разворачивает результаты сценариев в плоский словарь "сценарий[параметр].метрика" -> значение.
+
+    :param results: Раздел results отчёта bench.suite
+    :return: Числовые метрики
+    """
+    metrics = {}
+    for scenario, value in results.items():
+        if isinstance(value, dict):
+            for case, case_metrics in value.items():
+                for name, number in case_metrics.items():
+                    metrics[f"{scenario}[{case}].{name}"] = number
+            continue
+        for row in value:
+            key = ",".join(f"{field}={row[field]}" for field in KEY_FIELDS if field in row)
+            for name, number in row.items():
+                if name not in KEY_FIELDS and name not in ("requests", "links", "concurrency"):
+                    metrics[f"{scenario}[{key}].{name}"] = number
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10, help="Допустимое ухудшение в процентах")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"base: {base['meta'].get('commit')}  new: {new['meta'].get('commit')}")
+
+    base_metrics, new_metrics = flatten(base["results"]), flatten(new["results"])
+    regressions = 0
+    print(f"{'metric':<52} {'base':>12} {'new':>12} {'change':>9}")
+    for name in sorted(base_metrics.keys() & new_metrics.keys()):
+        old_value, new_value = base_metrics[name], new_metrics[name]
+        change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        mark = ""
+        if worse > args.threshold:
+            mark = "  REGRESSION"
+            regressions += 1
+        print(f"{name:<52} {old_value:>12.3f} {new_value:>12.3f} {change:>+8.1f}%{mark}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Генератор тестовых данных для бенчмарков.
+
+Заполняет базу SQLite заданным количеством ссылок. Оригинальные URL, длины коротких кодов
+и порядок выборки ссылок для запросов определяются seed, поэтому при одинаковых --size и --seed
+бенчмарки разных коммитов работают с данными одной формы.
+Ссылки создаются через Database.create_links, поэтому генератор следует за схемой базы.
+
+Запуск:
+    python -m bench.data --size 1m --seed 42
+
+База сохраняется в bench/.data/links-<size>-<seed>.db и переиспользуется бенчмарками.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import time
+from typing import Iterator
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+LENGTHS = (5, 6, 7, 8)
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), ".data")
+
+
+def parse_size(size: str) -> int:
+    """
+    :param size: Имя размера из SIZES или число
+    :return: Количество ссылок
+    """
+    return SIZES.get(size.lower()) or int(size)
+
+
+def generate_links(count: int, seed: int) -> Iterator[tuple[str, int, None]]:
+    """
+    Детерминированно генерирует ссылки в формате Database.create_links.
+
+    :param count: Количество ссылок
+    :param seed: Seed генератора
+    :return: Итератор кортежей (оригинальный URL, длина короткого кода, дата истечения срока)
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        path = "/".join(f"{rng.getrandbits(32):08x}" for _ in range(rng.randint(1, 4)))
+        yield f"https://example{rng.randint(1, 1000)}.com/{path}?n={i}", rng.choice(LENGTHS), None
+
+
+def seed_database(database, count: int, seed: int, batch_size: int = 5000) -> int:
+    """
+    Заполняет пустую мигрированную базу ссылками из generate_links.
+
+    :param database: Экземпляр database.Database
+    :param count: Количество ссылок
+    :param seed: Seed генератора
+    :param batch_size: Количество ссылок в одной транзакции
+    :return: Количество созданных ссылок
+    """
+    created = 0
+    started = time.perf_counter()
+    batch = []
+    for link in generate_links(count, seed):
+        batch.append(link)
+        if len(batch) == batch_size:
+            created += sum(not isinstance(result, Exception) for result in database.create_links(batch))
+            batch = []
+            print(f"\rseeded {created}/{count} ({created / (time.perf_counter() - started):.0f} links/s)",
+                  end="", file=sys.stderr)
+    if batch:
+        created += sum(not isinstance(result, Exception) for result in database.create_links(batch))
+    print(file=sys.stderr)
+    return created
+
+
+def open_database(filename: str):
+    """
+    Открывает базу по пути filename и применяет к ней все миграции.
+
+    :param filename: Путь к файлу базы
+    :return: Экземпляр database.Database
+    """
+    from config import DbConfig
+    from database import Database, DatabaseMigrator
+
+    db = Database(DbConfig(db_filename=filename))
+    try:
+        DatabaseMigrator(db).upgrade()
+    except FileNotFoundError:
+        pass
+    return db
+
+
+def dataset_filename(size: str, seed: int, data_dir: str = DEFAULT_DATA_DIR) -> str:
+    """Путь к сохранённой базе заданного размера и seed."""
+    return os.path.join(data_dir, f"links-{size}-{seed}.db")
+
+
+def ensure_dataset(size: str, seed: int, data_dir: str = DEFAULT_DATA_DIR) -> str:
+    """
+    Возвращает путь к заполненной базе заданного размера, создавая её при первом обращении.
+    Заполнение 10m занимает минуты, поэтому базы сохраняются в data_dir и переиспользуются.
+
+    :param size: Имя размера из SIZES или число
+    :param seed: Seed генератора
+    :param data_dir: Каталог для сохранённых баз
+    :return: Путь к файлу базы
+    """
+    filename = dataset_filename(size, seed, data_dir)
+    if os.path.exists(filename):
+        return filename
+
+    os.makedirs(data_dir, exist_ok=True)
+    partial = filename + ".partial"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(partial + suffix):
+            os.remove(partial + suffix)
+    db = open_database(partial)
+    seed_database(db, parse_size(size), seed)
+    db.pool.close()
+    os.replace(partial, filename)
+    return filename
+
+
+def copy_dataset(filename: str, directory: str) -> str:
+    """
+    Копирует сохранённую базу во временный каталог, чтобы бенчмарки с записью не меняли её.
+
+    :param filename: Путь к сохранённой базе
+    :param directory: Каталог назначения
+    :return: Путь к копии
+    """
+    target = os.path.join(directory, os.path.basename(filename))
+    shutil.copyfile(filename, target)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="10k", help=f"Количество ссылок: {', '.join(SIZES)} или число")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    args = parser.parse_args()
+    print(ensure_dataset(args.size, args.seed, args.data_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Бенчмарк кеша ссылок в памяти процесса (L1) перед Redis.
+
+Измеряет задержку поиска ссылки на пути редиректа (cache.get_short_link)
+при разной доле попаданий в L1: от 0% до 99%.
+
+Запуск:
+    python -m bench.l1_cache --fakeredis --redis-delay-ms 0.3
+
+--redis-delay-ms добавляет задержку к каждому обращению к Redis (имитация сетевого round trip).
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from bench.redirect_latency import percentile
+
+
+async def run(args):
+    from cache import LocalCache, get_short_link, set_short_link
+    from context import app_context
+    from utils import generate_random_string, short_url_lookup_key
+
+    if args.fakeredis:
+        from fakeredis import aioredis as fake_aioredis
+        app_context.redis = fake_aioredis.FakeRedis()
+
+    if args.redis_delay_ms:
+        original_get = app_context.redis.get
+
+        async def slow_get(key):
+            await asyncio.sleep(args.redis_delay_ms / 1000)
+            return await original_get(key)
+
+        app_context.redis.get = slow_get
+
+    hot = [generate_random_string(8) for _ in range(args.hot)]
+    cold = [generate_random_string(8) for _ in range(args.requests)]
+    for i, short_url in enumerate(hot + cold):
+        await set_short_link(short_url, f"https://example.com/bench/{i}", i)
+
+    print(f"{'L1 hit rate':>12} {'mean us':>10} {'p50 us':>10} {'p99 us':>10} {'hits':>8} {'misses':>8}")
+    for hit_rate in args.hit_rates:
+        app_context.local_cache = LocalCache(args.hot, 600)
+        for short_url in hot:
+            await get_short_link(short_url)
+        app_context.local_cache.hits = app_context.local_cache.misses = 0
+
+        latencies = []
+        for i in range(args.requests):
+            short_url = random.choice(hot) if random.random() < hit_rate / 100 else cold[i]
+            started = time.perf_counter()
+            await get_short_link(short_url)
+            latencies.append((time.perf_counter() - started) * 1e6)
+            # Холодные ссылки не должны вытеснять горячие
+            app_context.local_cache.invalidate(short_url_lookup_key(cold[i]))
+
+        stats = app_context.local_cache.stats()
+        print(
+            f"{hit_rate:>11}% {statistics.mean(latencies):>10.1f} {statistics.median(latencies):>10.1f} "
+            f"{percentile(latencies, 99):>10.1f} {stats['hits']:>8} {stats['misses']:>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hot", type=int, default=100, help="Количество популярных ссылок")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--hit-rates", type=int, nargs="+", default=[0, 50, 90, 99])
+    parser.add_argument("--redis-delay-ms", type=float, default=0)
+    parser.add_argument("--fakeredis", action="store_true", help="Использовать fakeredis вместо REDIS_URL")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Бенчмарк представления строк таблицы links при массовой выборке.
+
+Читает --rows ссылок из базы bench.data и для каждого варианта печатает время построения объектов
+на строку и прирост памяти на строку (tracemalloc):
+    dataclass - прежний Link: dataclass с разбором дат и расшифровкой URL в конструкторе
+    slots     - Link со __slots__, даты и URL разбираются при первом обращении
+    target    - LinkTarget из узкой выборки SELECT id, original_url, как на пути редиректа
+Отдельно печатается время самой выборки: все колонки против id и original_url.
+
+Запуск:
+    python -m bench.link_rows --size 100k --rows 50000
+"""
+import argparse
+import dataclasses
+import datetime
+import gc
+import time
+import tracemalloc
+from typing import Optional, Union
+
+from bench import data
+
+
+@dataclasses.dataclass
+class DataclassLink:
+    """Link в том виде, в каком он был до перехода на __slots__."""
+    id: int
+    _short_url: str
+    _original_url: str
+    clicks: int
+    short_url_length: int
+    _banned: Union[str, bool] = "0"
+    _banned_at: Optional[Union[str, datetime.datetime]] = None
+    _created_at: Union[str, datetime.datetime] = dataclasses.field(
+        default_factory=lambda: datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    )
+    _expires_at: Optional[Union[str, datetime.datetime]] = None
+
+    def __post_init__(self):
+        self._banned = bool(int(self._banned))
+        for name in ("_banned_at", "_created_at", "_expires_at"):
+            value = getattr(self, name)
+            if value and isinstance(value, str):
+                setattr(self, name, datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S"))
+
+
+FULL_QUERY = "SELECT id, original_url, short_url_length, banned, banned_at, created_at, expires_at FROM links LIMIT ?"
+NARROW_QUERY = "SELECT id, original_url FROM links LIMIT ?"
+
+
+def fetch(db, query: str, rows: int) -> tuple[list[tuple], float]:
+    started = time.perf_counter()
+    with db.pool.reader() as cursor:
+        result = cursor.execute(query, (rows,)).fetchall()
+    return result, time.perf_counter() - started
+
+
+def measure(build, rows: list[tuple]) -> tuple[float, float]:
+    """
+    :param build: Функция, строящая объект по строке выборки
+    :param rows: Строки выборки
+    :return: Время построения в микросекундах и прирост памяти в байтах на строку
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    objects = [build(row) for row in rows]
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objects
+    return elapsed / len(rows) * 1e6, size / len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="10k", help=f"Размер базы: {', '.join(data.SIZES)} или число")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=data.DEFAULT_DATA_DIR)
+    args = parser.parse_args()
+
+    from database.models import Link, LinkTarget
+    from utils import decrypt_aes256_base64_bytes
+
+    db = data.open_database(data.ensure_dataset(args.size, args.seed, args.data_dir))
+    full, full_seconds = fetch(db, FULL_QUERY, args.rows)
+    narrow, narrow_seconds = fetch(db, NARROW_QUERY, args.rows)
+    db.pool.close()
+
+    variants = {
+        "dataclass": (full, lambda row: DataclassLink(row[0], None, decrypt_aes256_base64_bytes(row[1]), 0, *row[2:])),
+        "slots": (full, lambda row: Link.from_encrypted(row[0], None, row[1], 0, *row[2:])),
+        "target": (narrow, lambda row: LinkTarget(row[0], decrypt_aes256_base64_bytes(row[1]))),
+    }
+    print(f"fetch {len(full)} rows: full {full_seconds * 1000:.1f} ms, narrow {narrow_seconds * 1000:.1f} ms")
+    print(f"{'variant':>10} {'build us/row':>13} {'bytes/row':>10}")
+    for name, (rows, build) in variants.items():
+        us_per_row, bytes_per_row = measure(build, rows)
+        print(f"{name:>10} {us_per_row:>13.2f} {bytes_per_row:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
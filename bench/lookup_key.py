@@ -0,0 +1,33 @@
+"""
+Бенчмарк вычисления ключа поиска короткой ссылки.
+
+Сравнивает прежний ключ (AES-256-CBC + PKCS7 + base64 от короткого URL)
+с ключевым хешем BLAKE2b (short_url_lookup_key).
+
+Запуск:
+    python -m bench.lookup_key --count 100000
+"""
+import argparse
+import timeit
+
+from utils import encrypt_aes256_base64, generate_random_string, short_url_lookup_key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    short_urls = [generate_random_string(8) for _ in range(args.count)]
+    cases = {
+        "aes (encrypt_aes256_base64)": lambda: [encrypt_aes256_base64(short_url) for short_url in short_urls],
+        "blake2b (short_url_lookup_key)": lambda: [short_url_lookup_key(short_url) for short_url in short_urls],
+    }
+    print(f"{'case':<32} {'us/op':>8}")
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=1, repeat=3))
+        print(f"{name:<32} {seconds / args.count * 1e6:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
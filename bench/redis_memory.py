@@ -0,0 +1,103 @@
+"""
+Бенчмарк формата записи ссылок в Redis: строковый "<base64 шифротекста>_<id>" (legacy) против двоичного.
+
+Записывает --links ссылок в каждом формате и печатает прирост used_memory Redis в пересчёте на миллион ссылок,
+а также среднее время разбора одной записи на пути редиректа.
+
+Запуск:
+    python -m bench.redis_memory --links 100000
+    python -m bench.redis_memory --fakeredis
+
+fakeredis не поддерживает INFO, с ним вместо used_memory печатается суммарный размер ключей и значений.
+Ключи бенчмарка удаляются после замера.
+"""
+import argparse
+import asyncio
+import base64
+import random
+import time
+
+from redis.exceptions import ResponseError
+
+
+def decode_legacy_split(value: bytes):
+    """Разбор записи так, как это делал get_short_link до двоичного формата."""
+    result = value.decode()
+    return int(result.split("_")[-1]), base64.b64decode(result.split("_")[0])
+
+
+async def used_memory(r) -> int | None:
+    try:
+        return (await r.info("memory"))["used_memory"]
+    except ResponseError:
+        return None
+
+
+async def write_links(r, prefix: str, values: list[bytes], batch: int = 1000):
+    for start in range(0, len(values), batch):
+        pipe = r.pipeline(transaction=False)
+        for i, value in enumerate(values[start:start + batch], start):
+            pipe.set(f"{prefix}{i:032x}", value)
+        await pipe.execute()
+
+
+async def delete_links(r, prefix: str, count: int, batch: int = 1000):
+    for start in range(0, count, batch):
+        await r.delete(*(f"{prefix}{i:032x}" for i in range(start, min(count, start + batch))))
+
+
+async def run(args):
+    from cache.records import encode_link_record, encode_legacy_link_record, decode_link_record
+    from utils import encrypt_aes256_bytes
+
+    if args.fakeredis:
+        from fakeredis import aioredis as fake_aioredis
+        r = fake_aioredis.FakeRedis()
+    else:
+        from context import app_context
+        r = app_context.redis
+
+    ciphertexts = [
+        encrypt_aes256_bytes(f"https://example.com/bench/{i}/{'x' * random.randint(0, 60)}") for i in range(args.links)
+    ]
+    first_id = random.randint(1, 10_000_000)
+    formats = {
+        "legacy": [encode_legacy_link_record(first_id + i, c) for i, c in enumerate(ciphertexts)],
+        "binary": [encode_link_record(first_id + i, c) for i, c in enumerate(ciphertexts)],
+    }
+    decoders = {"legacy": decode_legacy_split, "binary": decode_link_record}
+
+    print(f"{'format':>8} {'MB per 1M links':>16} {'value bytes':>12} {'decode us':>10}")
+    for name, values in formats.items():
+        prefix = f"bench:{name}:"
+        before = await used_memory(r)
+        await write_links(r, prefix, values)
+        after = await used_memory(r)
+        if before is None:
+            # Без INFO: только полезная нагрузка, без накладных расходов Redis на ключ
+            total = sum(len(prefix) + 32 + len(value) for value in values)
+        else:
+            total = after - before
+        await delete_links(r, prefix, len(values))
+
+        decode = decoders[name]
+        started = time.perf_counter()
+        for value in values:
+            decode(value)
+        decode_us = (time.perf_counter() - started) / len(values) * 1e6
+
+        print(
+            f"{name:>8} {total / len(values) * 1_000_000 / 2 ** 20:>16.1f} "
+            f"{sum(map(len, values)) / len(values):>12.1f} {decode_us:>10.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=100000)
+    parser.add_argument("--fakeredis", action="store_true", help="Использовать fakeredis вместо REDIS_URL")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
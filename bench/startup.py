@@ -0,0 +1,75 @@
+"""
+Бенчмарк времени холодного импорта модулей приложения по python -X importtime.
+
+Каждый модуль импортируется --runs раз в новом интерпретаторе, печатается медиана суммарного
+времени импорта и модули с наибольшим собственным временем (в том числе чтение .env и создание ресурсов
+на уровне модуля). Для сравнения с другой ревизией запустите бенчмарк в её рабочей копии
+или используйте сценарий startup в bench.suite.
+
+Запуск:
+    python -m bench.startup
+    python -m bench.startup --modules api database --runs 20 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = ("api", "cache", "database", "utils")
+
+
+def import_times(module: str, cwd: str) -> dict[str, tuple[int, int]]:
+    """
+    Импортирует модуль в новом интерпретаторе с -X importtime.
+
+    :param module: Имя модуля
+    :param cwd: Корень репозитория
+    :return: Для каждого импортированного модуля собственное и суммарное время в микросекундах
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def measure(module: str, runs: int, cwd: str) -> dict:
+    """
+    :param module: Имя модуля
+    :param runs: Количество запусков интерпретатора
+    :param cwd: Корень репозитория
+    :return: Медиана суммарного времени импорта в миллисекундах и медианы собственного времени модулей
+    """
+    samples = [import_times(module, cwd) for _ in range(runs)]
+    names = set.intersection(*(set(sample) for sample in samples))
+    self_ms = {name: statistics.median(sample[name][0] for sample in samples) / 1000 for name in names}
+    return {
+        "import_ms": statistics.median(sample[module][1] for sample in samples) / 1000,
+        "self_ms": self_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=list(DEFAULT_MODULES))
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10, help="Сколько модулей с наибольшим собственным временем печатать")
+    args = parser.parse_args()
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+    for module in args.modules:
+        result = measure(module, args.runs, root)
+        print(f"import {module}: {result['import_ms']:.1f} ms (median of {args.runs})")
+        for name, self_ms in sorted(result["self_ms"].items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {self_ms:8.2f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
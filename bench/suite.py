@@ -0,0 +1,318 @@
+"""
+Набор бенчмарков сервиса с результатами в JSON для сравнения между коммитами.
+
+Приложение поднимается in-process (ASGI) поверх копии базы, заполненной bench.data,
+с Redis из REDIS_URL или fakeredis. Сценарии:
+    aes      - стоимость encrypt_aes256_base64 / decrypt_aes256_base64_bytes и их вариантов без base64
+    warmup   - время прогрева кеша в зависимости от размера таблицы (--warmup-sizes)
+    redirect - задержка и пропускная способность редиректа при разной доле попаданий в кеш (--hit-ratios)
+    shorten  - пропускная способность создания ссылок для каждой длины короткого кода
+    shorten_repeat - пропускная способность повторного сокращения уже сокращённых URL в идемпотентном режиме:
+               с обратным индексом в Redis и только по индексу хеша URL в базе
+    startup  - время холодного импорта модулей приложения (bench.startup)
+
+Запуск:
+    python -m bench.suite --fakeredis --size 10k --output bench-results.json
+    python -m bench.suite --fakeredis --size 1m --warmup-sizes 10k 1m --scenarios warmup redirect
+    python -m bench.compare old.json new.json
+
+Базы с тестовыми данными сохраняются в bench/.data и создаются при первом запуске.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime, timezone
+
+from bench import data
+from bench.redirect_latency import percentile
+
+SCENARIOS = ("aes", "warmup", "redirect", "shorten", "shorten_repeat", "startup")
+
+
+def latency_summary(latencies: list[float], elapsed: float) -> dict:
+    """
+    :param latencies: Задержки запросов в секундах
+    :param elapsed: Общее время прогона в секундах
+    :return: Количество запросов, запросов в секунду и перцентили задержки в миллисекундах
+    """
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def git_revision() -> dict:
+    """Текущий коммит и наличие незафиксированных изменений."""
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=root, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, text=True))
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+
+def bench_aes(count: int) -> dict:
+    from utils import encrypt_aes256_base64, decrypt_aes256_base64_bytes, encrypt_aes256_bytes, decrypt_aes256_bytes
+
+    urls = [url for url, _, _ in data.generate_links(count, 0)]
+    encrypted = [encrypt_aes256_base64(url) for url in urls]
+    ciphertexts = [encrypt_aes256_bytes(url) for url in urls]
+    cases = {
+        "encrypt_aes256_base64": lambda: [encrypt_aes256_base64(url) for url in urls],
+        "decrypt_aes256_base64_bytes": lambda: [decrypt_aes256_base64_bytes(value) for value in encrypted],
+        "encrypt_aes256_bytes": lambda: [encrypt_aes256_bytes(url) for url in urls],
+        "decrypt_aes256_bytes": lambda: [decrypt_aes256_bytes(value) for value in ciphertexts],
+    }
+    return {name: {"us_per_op": min(timeit.repeat(case, number=1, repeat=3)) / count * 1e6} for name, case in cases.items()}
+
+
+def bench_startup(runs: int) -> dict:
+    from bench.startup import DEFAULT_MODULES, measure
+
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    return {module: {"import_ms": measure(module, runs, root)["import_ms"]} for module in DEFAULT_MODULES}
+
+
+async def bench_warmup(sizes: list[str], seed: int, data_dir: str) -> list[dict]:
+    from cache import warmup_links
+    from context import app_context
+    from database import AsyncDatabase
+
+    results = []
+    original_database = app_context.async_database
+    try:
+        for size in sizes:
+            db = data.open_database(data.ensure_dataset(size, seed, data_dir))
+            app_context.async_database = AsyncDatabase(db)
+            await app_context.redis.flushdb()
+            started = time.perf_counter()
+            links = await warmup_links(app_context.redis_config.cache_warmup_chunk_size)
+            elapsed = time.perf_counter() - started
+            db.pool.close()
+            results.append({"size": size, "links": links, "seconds": elapsed, "links_per_s": links / elapsed})
+    finally:
+        app_context.async_database = original_database
+        await app_context.redis.flushdb()
+    return results
+
+
+def sample_links(count: int, seed: int) -> list[tuple[str, str, int]]:
+    """Выбирает из базы случайные по seed ссылки: (короткий URL, оригинальный URL, зашифрованный как в базе, id)."""
+    from context import app_context
+
+    aes_engine = app_context.aes_engine
+    with app_context.database.pool.reader() as cursor:
+        max_id = cursor.execute("SELECT max(id) FROM links").fetchone()[0]
+        ids = random.Random(seed).sample(range(1, max_id + 1), min(count, max_id))
+        rows = cursor.execute(
+            f"SELECT id, short_url, original_url FROM links WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+    return [(aes_engine.decrypt(short_url), original_url, link_id) for link_id, short_url, original_url in rows]
+
+
+async def bench_redirect(client, hit_ratios: list[float], requests: int, concurrency: int, seed: int) -> list[dict]:
+    from cache import LocalCache, set_short_links
+    from context import app_context
+
+    links = sample_links(2000, seed)
+    results = []
+    for hit_ratio in hit_ratios:
+        await app_context.redis.flushdb()
+        app_context.local_cache = LocalCache(app_context.redis_config.local_cache_size,
+                                             app_context.redis_config.local_cache_ttl_seconds)
+        rng = random.Random(seed)
+        cached = set(rng.sample(range(len(links)), int(len(links) * hit_ratio)))
+        await set_short_links([(short_url, url, link_id, None) for i, (short_url, url, link_id)
+                               in enumerate(links) if i in cached])
+        app_context.local_cache.clear()
+        # Промахи должны доходить до SQLite, а не отсекаться фильтром, построенным сценарием warmup
+        app_context.negative_cache.ready = False
+        plan = [links[rng.randrange(len(links))][0] for _ in range(requests)]
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(short_url: str):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(f"/{short_url}", headers={"User-Agent": "bench"}, follow_redirects=False)
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 307, response.text
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(short_url) for short_url in plan))
+        results.append({"hit_ratio": hit_ratio, "concurrency": concurrency,
+                        **latency_summary(latencies, time.perf_counter() - started)})
+    return results
+
+
+async def bench_shorten(client, lengths: list[int], requests: int, concurrency: int, seed: int) -> list[dict]:
+    results = []
+    for length in lengths:
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(i: int):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/api/v1/shorten", json={
+                    "url": f"https://bench.example.com/{seed}/{length}/{i}", "length": length
+                })
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.text
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        results.append({"length": length, "concurrency": concurrency,
+                        **latency_summary(latencies, time.perf_counter() - started)})
+    return results
+
+
+async def bench_shorten_repeat(client, requests: int, concurrency: int, seed: int) -> list[dict]:
+    from context import app_context
+
+    urls = [f"https://bench.example.com/repeat/{seed}/{i}" for i in range(requests)]
+    for i in range(0, len(urls), 500):
+        response = await client.post("/api/v1/shorten/batch", json={
+            "items": [{"url": url, "length": 8} for url in urls[i:i + 500]]
+        })
+        assert response.status_code == 200, response.text
+    rng = random.Random(seed)
+
+    shorten_idempotent = app_context.api_config.shorten_idempotent
+    app_context.api_config.shorten_idempotent = True
+    results = []
+    try:
+        for source in ("redis", "db"):
+            if source == "db":
+                # Каждый URL запрашивается один раз после очистки Redis, поэтому ищется по индексу хеша URL в базе
+                await app_context.redis.flushdb()
+                plan = rng.sample(urls, len(urls))
+            else:
+                plan = [rng.choice(urls) for _ in range(requests)]
+            semaphore = asyncio.Semaphore(concurrency)
+            latencies = []
+
+            async def one(url: str):
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post("/api/v1/shorten", json={"url": url, "length": 8})
+                    latencies.append(time.perf_counter() - started)
+                    assert response.status_code == 200, response.text
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one(url) for url in plan))
+            results.append({"source": source, "concurrency": concurrency,
+                            **latency_summary(latencies, time.perf_counter() - started)})
+    finally:
+        app_context.api_config.shorten_idempotent = shorten_idempotent
+    return results
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from api import app
+    from context import app_context
+
+    if args.fakeredis:
+        from fakeredis import aioredis as fake_aioredis
+        app_context.redis = fake_aioredis.FakeRedis()
+
+    results = {}
+    if "startup" in args.scenarios:
+        results["startup"] = bench_startup(args.startup_runs)
+    if "aes" in args.scenarios:
+        results["aes"] = bench_aes(args.aes_count)
+    if "warmup" in args.scenarios:
+        results["warmup"] = await bench_warmup(args.warmup_sizes or [args.size], args.seed, args.data_dir)
+
+    # Прогрев и фоновые задачи lifespan не нужны: кеш для каждого сценария заполняется отдельно
+    app.state.context = app_context
+    transport = httpx.ASGITransport(app=app)
+    click_buffer = app_context.click_buffer
+    click_buffer.start()
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            if "redirect" in args.scenarios:
+                results["redirect"] = await bench_redirect(
+                    client, args.hit_ratios, args.requests, args.concurrency, args.seed
+                )
+            if "shorten" in args.scenarios:
+                results["shorten"] = await bench_shorten(
+                    client, args.lengths, args.requests, args.concurrency, args.seed
+                )
+            if "shorten_repeat" in args.scenarios:
+                results["shorten_repeat"] = await bench_shorten_repeat(
+                    client, args.requests, args.concurrency, args.seed
+                )
+    finally:
+        await click_buffer.stop()
+        await app_context.redis.flushdb()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--size", default="10k", help=f"Размер базы: {', '.join(data.SIZES)} или число")
+    parser.add_argument("--warmup-sizes", nargs="+", help="Размеры базы для сценария warmup (по умолчанию --size)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--hit-ratios", type=float, nargs="+", default=[1.0, 0.9, 0.5, 0.0])
+    parser.add_argument("--lengths", type=int, nargs="+", default=list(data.LENGTHS))
+    parser.add_argument("--aes-count", type=int, default=20000)
+    parser.add_argument("--startup-runs", type=int, default=10)
+    parser.add_argument("--data-dir", default=data.DEFAULT_DATA_DIR)
+    parser.add_argument("--fakeredis", action="store_true", help="Использовать fakeredis вместо REDIS_URL")
+    parser.add_argument("--output", help="Файл для результатов в JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    dataset = data.ensure_dataset(args.size, args.seed, args.data_dir)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Конфигурация базы читается из окружения при первом обращении к app_context.database
+        os.environ["DB_FILENAME"] = data.copy_dataset(dataset, tmp)
+        # Сохранённая база могла быть создана до последних миграций
+        data.open_database(os.environ["DB_FILENAME"]).pool.close()
+        started = datetime.now(timezone.utc)
+        results = asyncio.run(run(args))
+
+    report = {
+        "meta": {
+            **git_revision(),
+            "started_at": started.isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "redis": "fakeredis" if args.fakeredis else "redis",
+            "size": args.size,
+            "seed": args.seed,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
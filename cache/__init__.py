@@ -1,3 +1,11 @@
-from .main import set_short_link, get_short_link, cache_warmup, LinkCached, r
+from .main import set_short_link, set_short_links, get_short_link, set_short_link_missing, delete_short_links, \
+    invalidate_short_links, listen_invalidations, cache_warmup, warmup_once, warmup_links, build_link_filter, LinkCached, \
+    LINK_MISSING, get_short_urls_by_original_urls, set_original_urls, restore_short_links
+from .local import LocalCache
+from .negative import BloomFilter, NegativeCache
+from .ring import HashRing, ShardedRedis
 
-__all__ = ["set_short_link", "get_short_link", "cache_warmup", "LinkCached", "r"]
\ No newline at end of file
+__all__ = ["set_short_link", "set_short_links", "get_short_link", "set_short_link_missing", "delete_short_links",
+           "invalidate_short_links", "listen_invalidations", "cache_warmup", "warmup_once", "warmup_links",
+           "build_link_filter", "LinkCached", "LINK_MISSING", "get_short_urls_by_original_urls", "set_original_urls",
+           "restore_short_links", "LocalCache", "BloomFilter", "NegativeCache", "HashRing", "ShardedRedis"]
\ No newline at end of file
@@ -0,0 +1,96 @@
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+class LocalCache:
+    """
+    Ограниченный по размеру LRU-кеш в памяти процесса с TTL записей.
+    Используется как L1 перед Redis для самых популярных ссылок.
+    Счётчик generation увеличивается при каждом сбросе записей: значение, прочитанное из Redis до сброса,
+    сохраняется в кеш, только если счётчик за время чтения не изменился.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        :param maxsize: Максимальное количество записей
+        :param ttl: Время жизни записи в секундах
+        """
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+
+    def get(self, key: str) -> Any | None:
+        """
+        Получает значение по ключу.
+
+        :param key: Ключ записи
+        :return: Значение или None, если записи нет или её TTL истёк
+        """
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: float | None = None):
+        """
+        Сохраняет значение, вытесняя самую давно использованную запись при переполнении.
+
+        :param key: Ключ записи
+        :param value: Значение
+        :param ttl: Время жизни записи в секундах, если оно меньше стандартного
+        """
+        if self._maxsize <= 0:
+            return
+        ttl = self._ttl if ttl is None else min(ttl, self._ttl)
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key: str) -> Any | None:
+        """
+        Получает значение по ключу, не учитывая обращение в счётчиках и порядке вытеснения.
+
+        :param key: Ключ записи
+        :return: Значение или None, если записи нет или её TTL истёк
+        """
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def invalidate(self, key: str):
+        """Удаляет запись по ключу, если она есть."""
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        """Удаляет все записи."""
+        self.generation += 1
+        self._data.clear()
+
+    def stats(self) -> dict:
+        """Счётчики попаданий, промахов и вытеснений."""
+        return {
+            "size": len(self._data),
+            "maxsize": self._maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -1,25 +1,220 @@
+import asyncio
+import base64
 import dataclasses
+import logging
+import os
+import time
 from contextlib import asynccontextmanager
+from datetime import datetime
 
-import redis
+from cache.records import encode_link_record, encode_legacy_link_record, decode_link_record
+from cache.ring import ShardedRedis
+from context import app_context
+from metrics import cache_lookups
+from utils import encrypt_aes256_bytes, decrypt_aes256_bytes, short_url_lookup_key, original_url_lookup_key, to_utc, \
+    from_db_timestamp
 
-from config import RedisConfig
-from database.core import database
-from utils import encrypt_aes256_base64, decrypt_aes256_base64_bytes
+logger = logging.getLogger(__name__)
 
-redis_config = RedisConfig()
-r = redis.from_url(redis_config.redis_url.get_secret_value())
+# Значение в Redis и в кеше в памяти для кода, которого нет в базе
+TOMBSTONE = b""
+LINK_MISSING = object()
 
+_local_hits = cache_lookups.labels("local")
+_redis_hits = cache_lookups.labels("redis")
+_negative_hits = cache_lookups.labels("negative")
+_misses = cache_lookups.labels("miss")
 
-def set_short_link(short_url: str, original_url: str, link_id: int):
+
+def _expire_at(expires_at: datetime | None) -> int | None:
+    """
+    Момент истечения срока действия ссылки для параметра EXAT команды SET.
+
+    :param expires_at: Дата истечения срока действия или None
+    :return: Unix-время в секундах или None, если срок не ограничен
+    """
+    if expires_at is None:
+        return None
+    return int(to_utc(expires_at).timestamp())
+
+
+def _encode_link(link_id: int, ciphertext: bytes, exat: int | None) -> bytes:
+    """
+    Кодирует ссылку для записи в Redis в формате cache_value_format.
+
+    :param link_id: ID ссылки в базе данных
+    :param ciphertext: Шифротекст оригинального URL
+    :param exat: Unix-время истечения срока действия ссылки
+    :return: Значение для записи в Redis
+    """
+    if app_context.redis_config.cache_value_format == "legacy":
+        return encode_legacy_link_record(link_id, ciphertext)
+    return encode_link_record(link_id, ciphertext, exat)
+
+
+async def set_short_link(short_url: str, original_url: str, link_id: int, expires_at: datetime | None = None):
     """
     Сохраняет короткую ссылку в Redis кэше.
+    Ссылка со сроком действия хранится в кеше не дольше этого срока, уже истёкшая ссылка не кешируется.
+    Ссылка уже записана в базу, поэтому ошибка Redis не прерывает запрос, а только логируется.
 
     :param short_url: Короткий URL
     :param original_url: Оригинальный URL
     :param link_id: ID ссылки в базе данных
+    :param expires_at: Дата истечения срока действия ссылки
     """
-    r.set(encrypt_aes256_base64(short_url), encrypt_aes256_base64(original_url) + "_" + str(link_id))
+    lookup_key = short_url_lookup_key(short_url)
+    _add_to_link_filter([lookup_key])
+    exat = _expire_at(expires_at)
+    ttl = None if exat is None else exat - time.time()
+    if ttl is not None and ttl <= 0:
+        return
+
+    app_context.local_cache.set(lookup_key, LinkCached(original_url, link_id), ttl)
+    try:
+        await app_context.redis.set(
+            lookup_key, _encode_link(link_id, encrypt_aes256_bytes(original_url), exat), exat=exat
+        )
+    except Exception as e:
+        logger.error(f"Failed to write short link to cache: {e}")
+    await _announce_links([lookup_key])
+
+
+async def set_short_links(links: list[tuple[str, str, int, datetime | None]]):
+    """
+    Сохраняет пачку коротких ссылок в Redis одним pipeline.
+    Оригинальные URL передаются уже зашифрованными при записи в базу (Database.create_links) и повторно не шифруются.
+    Ошибка Redis не прерывает запрос, а только логируется.
+
+    :param links: Список кортежей (короткий URL, оригинальный URL, зашифрованный как в базе (base64),
+        ID ссылки в базе данных, дата истечения срока)
+    """
+    lookup_keys = [short_url_lookup_key(short_url) for short_url, _, _, _ in links]
+    _add_to_link_filter(lookup_keys)
+    pipe = app_context.redis.pipeline(transaction=False)
+    for lookup_key, (_, original_url_encrypted, link_id, expires_at) in zip(lookup_keys, links):
+        exat = _expire_at(expires_at)
+        pipe.set(lookup_key, _encode_link(link_id, base64.b64decode(original_url_encrypted), exat), exat=exat)
+    try:
+        await pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to write short links to cache: {e}")
+    await _announce_links(lookup_keys)
+
+
+async def restore_short_links(links: list[tuple[int, str, str, str | None]]):
+    """
+    Возвращает в Redis ссылки, прочитанные из базы, например после разблокировки, одним pipeline
+    и оповещает все процессы, чтобы они добавили ссылки в фильтры существующих кодов.
+    Оригинальные URL записываются в том виде, в каком зашифрованы в базе. Ошибка Redis только логируется.
+
+    :param links: Ссылки в формате Database.get_active_links_chunk: (id, short_url_hash, original_url, expires_at)
+    """
+    lookup_keys = [short_url_hash for _, short_url_hash, _, _ in links]
+    _add_to_link_filter(lookup_keys)
+    pipe = app_context.redis.pipeline(transaction=False)
+    _set_link_records(pipe, links)
+    try:
+        await pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to restore short links to cache: {e}")
+    await _announce_links(lookup_keys)
+
+
+def _set_link_records(pipe, links: list[tuple[int, str, str, str | None]]):
+    """
+    Добавляет в pipeline запись ссылок, прочитанных из базы.
+
+    :param pipe: Pipeline Redis
+    :param links: Ссылки в формате (id, short_url_hash, original_url в base64, expires_at)
+    """
+    for link_id, short_url_hash, original_url, expires_at in links:
+        exat = _expire_at(from_db_timestamp(expires_at))
+        pipe.set(short_url_hash, _encode_link(link_id, base64.b64decode(original_url), exat), exat=exat)
+
+
+def _original_url_key(original_url: str) -> str:
+    return app_context.redis_config.original_url_key_prefix + original_url_lookup_key(original_url)
+
+
+async def get_short_urls_by_original_urls(original_urls: list[str]) -> list[str | None]:
+    """
+    Ищет в обратном индексе Redis короткие ссылки, уже созданные для URL, одной командой MGET.
+    Ошибка Redis не прерывает запрос: ссылки ищутся в базе.
+
+    :param original_urls: Оригинальные URL
+    :return: Короткий URL или None для каждого URL в том же порядке
+    """
+    try:
+        values = await app_context.redis.mget([_original_url_key(original_url) for original_url in original_urls])
+        return [decrypt_aes256_bytes(value) if value else None for value in values]
+    except Exception as e:
+        logger.error(f"Failed to read original url index from cache: {e}")
+        return [None] * len(original_urls)
+
+
+async def set_original_urls(links: list[tuple[str, str, datetime | None]]):
+    """
+    Записывает в обратный индекс Redis короткие ссылки для оригинальных URL одним pipeline.
+    Запись живёт не дольше самой ссылки.
+
+    :param links: Список кортежей (оригинальный URL, короткий URL, дата истечения срока)
+    """
+    pipe = app_context.redis.pipeline(transaction=False)
+    for original_url, short_url, expires_at in links:
+        exat = _expire_at(expires_at)
+        if exat is None or exat > time.time():
+            pipe.set(_original_url_key(original_url), encrypt_aes256_bytes(short_url), exat=exat)
+    try:
+        await pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to write original url index to cache: {e}")
+
+
+def _add_to_link_filter(lookup_keys: list[str]):
+    """
+    Добавляет созданные ссылки в фильтр существующих кодов этого процесса.
+    Вызывается до записи в Redis и независимо от неё: иначе при ошибке Redis созданная ссылка отвечала бы 404.
+
+    :param lookup_keys: Ключи поиска созданных ссылок
+    """
+    for lookup_key in lookup_keys:
+        app_context.negative_cache.add(lookup_key)
+
+
+async def _announce_links(lookup_keys: list[str]):
+    """
+    Оповещает остальные процессы о созданных ссылках, чтобы они добавили их в свои фильтры и сбросили надгробия.
+    Если оповещение не доставлено из-за ошибки Redis, процессы перестроят фильтры при переподключении к каналу.
+
+    :param lookup_keys: Ключи поиска созданных ссылок
+    """
+    if not lookup_keys:
+        return
+    try:
+        await app_context.redis.publish(app_context.redis_config.cache_link_added_channel, " ".join(lookup_keys))
+    except Exception as e:
+        logger.error(f"Failed to announce created short links: {e}")
+
+
+async def delete_short_links(lookup_keys: list[str], original_url_hashes: list[str] | None = None):
+    """
+    Удаляет ссылки из Redis и из кеша в памяти всех процессов.
+    Вызывается после удаления, блокировки или разблокировки ссылок в базе данных.
+
+    :param lookup_keys: Ключи поиска ссылок (short_url_lookup_key)
+    :param original_url_hashes: Ключи оригинальных URL (original_url_lookup_key) для удаления из обратного индекса
+    """
+    if not lookup_keys:
+        return
+    prefix = app_context.redis_config.original_url_key_prefix
+    pipe = app_context.redis.pipeline(transaction=False)
+    for lookup_key in lookup_keys:
+        pipe.delete(lookup_key)
+    for original_url_hash in original_url_hashes or []:
+        pipe.delete(prefix + original_url_hash)
+    await pipe.execute()
+    await invalidate_short_links(lookup_keys)
 
 
 @dataclasses.dataclass
@@ -28,30 +223,246 @@ class LinkCached:
     id: int
 
 
-def get_short_link(short_url) -> LinkCached | None:
+async def get_short_link(short_url) -> LinkCached | object | None:
     """
-    Получает кэшированную ссылку из Redis.
+    Получает кэшированную ссылку из кеша в памяти процесса, а при его промахе из Redis.
+    Если ссылки нет в Redis, проверяет фильтр существующих кодов.
+    Прочитанное из Redis не сохраняется в памяти, если во время чтения пришёл сброс кеша:
+    иначе заблокированная или изменённая ссылка оставалась бы в памяти до истечения TTL.
 
     :param short_url: Короткий URL для поиска в кэше
-    :return: Объект LinkCached с данными ссылки или None, если ссылка не найдена
+    :return: Объект LinkCached с данными ссылки, LINK_MISSING, если кода точно нет в базе,
+        или None, если ссылку нужно искать в базе
     """
+    local_cache, negative_cache = app_context.local_cache, app_context.negative_cache
+    lookup_key = short_url_lookup_key(short_url)
+    link = local_cache.get(lookup_key)
+    if link is not None:
+        (_negative_hits if link is LINK_MISSING else _local_hits).inc()
+        return link
+
+    generation = local_cache.generation
     try:
-        result = r.get(encrypt_aes256_base64(short_url)).decode()
-        link_id = int(result.split("_")[-1])
-        original_url = decrypt_aes256_base64_bytes(result.split("_")[0])
-        return LinkCached(original_url, link_id)
-    except:
+        result = await app_context.redis.get(lookup_key)
+        if result is None:
+            if negative_cache.rejects(lookup_key):
+                _negative_hits.inc()
+                return LINK_MISSING
+            _misses.inc()
+            return None
+        if result == TOMBSTONE:
+            negative_cache.tombstone_hits += 1
+            if local_cache.generation == generation:
+                local_cache.set(lookup_key, LINK_MISSING, app_context.redis_config.negative_cache_ttl_seconds)
+            _negative_hits.inc()
+            return LINK_MISSING
+        record = decode_link_record(result)
+        if record.banned:
+            _negative_hits.inc()
+            return LINK_MISSING
+        original_url = decrypt_aes256_bytes(record.ciphertext)
+    except Exception as e:
+        logger.error(f"Failed to read short link from cache: {e}")
+        _misses.inc()
         return None
 
+    _redis_hits.inc()
+    link = LinkCached(original_url, record.id)
+    if local_cache.generation == generation:
+        local_cache.set(lookup_key, link, None if record.expires_at is None else record.expires_at - time.time())
+    return link
+
+
+async def set_short_link_missing(short_url: str):
+    """
+    Запоминает, что короткого кода нет в базе, на negative_cache_ttl_seconds.
+    Надгробие записывается в Redis только если ключа ещё нет, чтобы не затереть ссылку, созданную параллельно.
+
+    :param short_url: Короткий URL
+    """
+    lookup_key = short_url_lookup_key(short_url)
+    app_context.negative_cache.record_db_miss(lookup_key)
+    ttl = app_context.redis_config.negative_cache_ttl_seconds
+    if ttl <= 0:
+        return
+    try:
+        if await app_context.redis.set(lookup_key, TOMBSTONE, ex=ttl, nx=True):
+            app_context.local_cache.set(lookup_key, LINK_MISSING, ttl)
+    except Exception as e:
+        logger.error(f"Failed to cache missing short link: {e}")
+
+
+async def invalidate_short_links(lookup_keys: list[str]):
+    """
+    Сбрасывает ссылки из кеша в памяти этого и всех остальных процессов.
+    Вызывается при блокировке, истечении срока или изменении ссылки.
+
+    :param lookup_keys: Ключи поиска ссылок (short_url_lookup_key)
+    """
+    for lookup_key in lookup_keys:
+        app_context.local_cache.invalidate(lookup_key)
+    if lookup_keys:
+        await app_context.redis.publish(app_context.redis_config.cache_invalidation_channel, " ".join(lookup_keys))
+
+
+async def listen_invalidations():
+    """
+    Слушает канал сброса кеша и удаляет из кеша в памяти указанные ссылки,
+    а также канал созданных ссылок и добавляет их в фильтр существующих кодов.
+    После переподключения кеш в памяти очищается целиком, а фильтр перестраивается,
+    так как сообщения за время обрыва потеряны.
+    Запускается фоновой задачей из FastAPI lifespan.
+    """
+    config = app_context.redis_config
+    connected = False
+    while True:
+        local_cache, negative_cache = app_context.local_cache, app_context.negative_cache
+        pubsub = app_context.redis.pubsub()
+        try:
+            await pubsub.subscribe(config.cache_invalidation_channel, config.cache_link_added_channel)
+            local_cache.clear()
+            if connected and negative_cache.filter is not None:
+                asyncio.ensure_future(build_link_filter(config.cache_warmup_chunk_size))
+            connected = True
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                added = message["channel"].decode() == config.cache_link_added_channel
+                for lookup_key in message["data"].decode().split():
+                    if not added:
+                        local_cache.invalidate(lookup_key)
+                        continue
+                    negative_cache.add(lookup_key)
+                    if local_cache.peek(lookup_key) is LINK_MISSING:
+                        local_cache.invalidate(lookup_key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Cache invalidation listener error: {e}")
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+
+async def warmup_links(chunk_size: int) -> int:
+    """
+    Переносит все активные ссылки из SQLite в Redis пачками и строит по ним фильтр существующих кодов.
+    Пачка читается из базы по id и записывается одним pipeline,
+    чтение следующей пачки идёт параллельно с записью текущей. Шарды базы обходятся параллельно.
+    Пачка, которую не удалось записать из-за недоступного узла Redis, пропускается: её ссылки читаются из базы.
+
+    :param chunk_size: Размер пачки
+    :return: Количество записанных в Redis ссылок
+    """
+    started = time.perf_counter()
+    total = 0
+    db, negative_cache = app_context.async_database, app_context.negative_cache
+
+    async def warmup_shard(shard: int):
+        nonlocal total
+        links = await db.get_active_links_chunk(0, chunk_size, shard)
+        while links:
+            next_links = asyncio.ensure_future(db.get_active_links_chunk(links[-1][0], chunk_size, shard))
+
+            pipe = app_context.redis.pipeline(transaction=False)
+            _set_link_records(pipe, links)
+            for _, short_url_hash, _, _ in links:
+                negative_cache.add(short_url_hash)
+            try:
+                await pipe.execute()
+            except Exception as e:
+                if not ShardedRedis.is_node_error(e):
+                    raise
+                logger.error(f"Cache warmup: failed to write {len(links)} links to Redis: {e}")
+
+            total += len(links)
+            elapsed = time.perf_counter() - started
+            logger.info(f"Cache warmup: {total} links, {total / elapsed:.0f} links/s")
+            links = await next_links
+
+    await asyncio.gather(*(warmup_shard(shard) for shard in range(db.shards_count)))
+    negative_cache.ready = True
+    logger.info(f"Cache warmup finished: {total} links in {time.perf_counter() - started:.2f}s")
+    return total
+
+
+async def build_link_filter(chunk_size: int) -> int:
+    """
+    Заново заполняет фильтр существующих кодов по всем активным ссылкам без записи в Redis.
+    Пока фильтр заполняется, он не используется для отклонения запросов.
+
+    :param chunk_size: Размер пачки
+    :return: Количество добавленных в фильтр ссылок
+    """
+    db, negative_cache = app_context.async_database, app_context.negative_cache
+    negative_cache.ready = False
+    total = 0
+
+    async def add_shard(shard: int):
+        nonlocal total
+        links = await db.get_active_links_chunk(0, chunk_size, shard)
+        while links:
+            for _, short_url_hash, _, _ in links:
+                negative_cache.add(short_url_hash)
+            total += len(links)
+            links = await db.get_active_links_chunk(links[-1][0], chunk_size, shard)
+
+    await asyncio.gather(*(add_shard(shard) for shard in range(db.shards_count)))
+    negative_cache.ready = True
+    logger.info(f"Link filter rebuilt: {total} links")
+    return total
+
+
+async def warmup_once(chunk_size: int) -> int:
+    """
+    Прогревает Redis один раз на развёртывание из нескольких процессов-воркеров.
+    Прогрев выполняет процесс, первым занявший ключ cache_warmup_lock_key,
+    остальные только строят собственный фильтр существующих кодов.
+    Если прогрев упал, ключ освобождается, чтобы его выполнил следующий запущенный процесс.
+    Если Redis недоступен, ключ считается занятым другим процессом: фильтр строится, а запуск продолжается.
+
+    :param chunk_size: Размер пачки
+    :return: Количество записанных в Redis ссылок
+    """
+    config = app_context.redis_config
+    try:
+        acquired = await app_context.redis.set(
+            config.cache_warmup_lock_key, os.getpid(), nx=True, ex=config.cache_warmup_lock_ttl_seconds
+        )
+    except Exception as e:
+        if not ShardedRedis.is_node_error(e):
+            raise
+        logger.error(f"Failed to take cache warmup lock: {e}")
+        acquired = False
+    if not acquired:
+        logger.info("Cache warmup is done by another worker")
+        if app_context.negative_cache.filter is not None:
+            await build_link_filter(chunk_size)
+        return 0
+    try:
+        return await warmup_links(chunk_size)
+    except BaseException:
+        await app_context.redis.delete(config.cache_warmup_lock_key)
+        raise
+
 
 @asynccontextmanager
 async def cache_warmup(_):
     """
     Функция прогрева кешей.
-    Получает все ссылки из таблицы links и вносит в Redis.
-    Вызывается при запуске через FastApi lifespan
+    Переносит все активные ссылки из таблицы links в Redis, см. warmup_once.
+    Вызывается при запуске через FastApi lifespan.
+    При cache_warmup_in_background API начинает работать сразу,
+    а запросы к ещё не прогретым ссылкам обслуживаются из SQLite.
     """
-    links = database.get_all_links()
-    for link in links:
-        r.set(link[1], link[2] + "_" + str(link[0]))
-    yield
+    config = app_context.redis_config
+    if not config.cache_warmup_in_background:
+        await warmup_once(config.cache_warmup_chunk_size)
+        yield
+        return
+
+    task = asyncio.create_task(warmup_once(config.cache_warmup_chunk_size))
+    try:
+        yield
+    finally:
+        task.cancel()
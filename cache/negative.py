@@ -0,0 +1,96 @@
+import math
+
+
+class BloomFilter:
+    """
+    Фильтр Блума по ключам поиска ссылок (short_url_lookup_key).
+    Ключ поиска уже является равномерно распределённым хешем, поэтому позиции битов
+    вычисляются из него напрямую двойным хешированием, без повторного хеширования.
+    """
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        :param capacity: Ожидаемое количество ключей
+        :param error_rate: Допустимая доля ложноположительных ответов при заполнении до capacity
+        """
+        self._size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+        self.count = 0
+
+    def add(self, key: str):
+        """Добавляет ключ в фильтр."""
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def estimated_error_rate(self) -> float:
+        """Ожидаемая доля ложноположительных ответов при текущем количестве ключей."""
+        return (1 - math.exp(-self._hashes * self.count / self._size)) ** self._hashes
+
+    def stats(self) -> dict:
+        """Размер фильтра, количество ключей и ожидаемая доля ложноположительных ответов."""
+        return {
+            "items": self.count,
+            "size_bytes": len(self._bits),
+            "hashes": self._hashes,
+            "estimated_fpr": self.estimated_error_rate(),
+        }
+
+    def _positions(self, key: str):
+        value = int(key, 16)
+        h1, h2 = value >> 64, (value & 0xFFFFFFFFFFFFFFFF) | 1
+        return ((h1 + i * h2) % self._size for i in range(self._hashes))
+
+
+class NegativeCache:
+    """
+    Учёт заведомо несуществующих коротких кодов.
+    Фильтр Блума всех существующих кодов строится при прогреве кеша и дополняется при создании ссылок:
+    код, которого нет в фильтре, точно не существует, и запрос к SQLite не нужен.
+    Коды, которых нет в базе, но которые прошли фильтр, кешируются отдельно как надгробия с коротким TTL.
+    """
+    def __init__(self, link_filter: BloomFilter | None):
+        """
+        :param link_filter: Фильтр существующих кодов или None, если фильтр отключён
+        """
+        self.filter = link_filter
+        self.ready = False
+        self.definite_misses = 0
+        self.false_positives = 0
+        self.tombstone_hits = 0
+
+    def add(self, lookup_key: str):
+        """Добавляет код в фильтр существующих кодов."""
+        if self.filter is not None:
+            self.filter.add(lookup_key)
+
+    def rejects(self, lookup_key: str) -> bool:
+        """
+        Проверяет, что кода точно нет в базе. Пока фильтр не построен, ничего не отклоняет.
+
+        :param lookup_key: Ключ поиска ссылки
+        :return: True, если кода нет в фильтре
+        """
+        if self.filter is None or not self.ready or lookup_key in self.filter:
+            return False
+        self.definite_misses += 1
+        return True
+
+    def record_db_miss(self, lookup_key: str):
+        """Учитывает промах по базе: если код прошёл фильтр, это ложноположительный ответ фильтра."""
+        if self.filter is not None and self.ready and lookup_key in self.filter:
+            self.false_positives += 1
+
+    def stats(self) -> dict:
+        """Счётчики отклонённых фильтром запросов, ложноположительных ответов и попаданий в надгробия."""
+        checked = self.definite_misses + self.false_positives
+        return {
+            "filter": None if self.filter is None else {"ready": self.ready, **self.filter.stats()},
+            "definite_misses": self.definite_misses,
+            "false_positives": self.false_positives,
+            "observed_fpr": self.false_positives / checked if checked else 0.0,
+            "tombstone_hits": self.tombstone_hits,
+        }
@@ -0,0 +1,95 @@
+import base64
+import dataclasses
+
+# Версия двоичного формата записи ссылки в Redis.
+# Старый формат "<base64 шифротекста>_<id>" начинается с символа base64, поэтому не пересекается с версиями < 0x20
+RECORD_VERSION = 1
+FLAG_BANNED = 0x01
+FLAG_EXPIRES = 0x02
+
+
+@dataclasses.dataclass(slots=True)
+class LinkRecord:
+    """Запись ссылки в Redis: id, шифротекст оригинального URL и флаги."""
+    id: int
+    ciphertext: bytes | memoryview
+    expires_at: int | None = None
+    banned: bool = False
+
+
+def encode_link_record(link_id: int, ciphertext: bytes, expires_at: int | None = None, banned: bool = False) -> bytes:
+    """
+    Кодирует ссылку в двоичный формат:
+    байт версии, байт флагов, id в varint, при FLAG_EXPIRES unix-время истечения в varint, шифротекст без base64.
+
+    :param link_id: ID ссылки в базе данных
+    :param ciphertext: Шифротекст оригинального URL
+    :param expires_at: Unix-время истечения срока действия ссылки
+    :param banned: Флаг блокировки ссылки
+    :return: Значение для записи в Redis
+    """
+    flags = (FLAG_BANNED if banned else 0) | (FLAG_EXPIRES if expires_at is not None else 0)
+    record = bytearray((RECORD_VERSION, flags))
+    _write_varint(record, link_id)
+    if expires_at is not None:
+        _write_varint(record, expires_at)
+    record += ciphertext
+    return bytes(record)
+
+
+def encode_legacy_link_record(link_id: int, ciphertext: bytes) -> bytes:
+    """
+    Кодирует ссылку в старый строковый формат "<base64 шифротекста>_<id>".
+    Используется, пока не все процессы умеют читать двоичный формат.
+
+    :param link_id: ID ссылки в базе данных
+    :param ciphertext: Шифротекст оригинального URL
+    :return: Значение для записи в Redis
+    """
+    return base64.b64encode(ciphertext) + b"_" + str(link_id).encode()
+
+
+def decode_link_record(value: bytes) -> LinkRecord:
+    """
+    Разбирает запись ссылки из Redis в двоичном или старом строковом формате.
+
+    :param value: Значение из Redis
+    :return: Запись ссылки, шифротекст двоичного формата возвращается как memoryview без копирования
+    :raises ValueError: Если формат записи не распознан
+    """
+    if not value:
+        raise ValueError("Empty link record")
+    if value[0] >= 0x20:
+        encoded, _, link_id = value.rpartition(b"_")
+        return LinkRecord(int(link_id), base64.b64decode(encoded))
+    if value[0] != RECORD_VERSION:
+        raise ValueError(f"Unknown link record version {value[0]}")
+
+    flags = value[1]
+    link_id, offset = _read_varint(value, 2)
+    expires_at = None
+    if flags & FLAG_EXPIRES:
+        expires_at, offset = _read_varint(value, offset)
+    return LinkRecord(link_id, memoryview(value)[offset:], expires_at, bool(flags & FLAG_BANNED))
+
+
+def _write_varint(buffer: bytearray, value: int):
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(value: bytes, offset: int) -> tuple[int, int]:
+    byte = value[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+    result = byte & 0x7F
+    shift = 7
+    while True:
+        offset += 1
+        byte = value[offset]
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset + 1
+        shift += 7
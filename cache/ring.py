@@ -0,0 +1,292 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import time
+from typing import Any
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+def node_name(url: str) -> str:
+    """
+    Имя узла Redis на кольце: хост, порт и номер базы без логина и пароля,
+    поэтому смена пароля не перераспределяет ключи.
+
+    :param url: URL Redis, например redis://:password@10.0.0.1:6379/0
+    """
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port or 6379}{parts.path or '/0'}"
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Консистентное хеширование ключей по узлам с виртуальными узлами.
+    Каждый узел занимает на кольце virtual_nodes точек, ключ принадлежит узлу первой точки по часовой стрелке.
+    При добавлении или удалении одного из N узлов на другой узел переходит примерно 1/N ключей.
+    """
+    def __init__(self, nodes: list[str], virtual_nodes: int = 160):
+        """
+        :param nodes: Имена узлов
+        :param virtual_nodes: Количество точек каждого узла на кольце: чем больше, тем равномернее распределение
+        """
+        if not nodes:
+            raise ValueError("Hash ring needs at least one node")
+        points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(virtual_nodes))
+        self.nodes = list(nodes)
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str | bytes) -> str:
+        """
+        :param key: Ключ Redis
+        :return: Имя узла, на котором хранится ключ
+        """
+        if isinstance(key, bytes):
+            key = key.decode()
+        return self._nodes[bisect.bisect(self._hashes, _hash(key)) % len(self._nodes)]
+
+
+class ShardedPipeline:
+    """
+    Pipeline поверх нескольких узлов: команды копятся, а при execute разбиваются на pipeline каждого узла,
+    которые выполняются параллельно. Результаты возвращаются в порядке добавления команд.
+    """
+    def __init__(self, redis: "ShardedRedis"):
+        self._redis = redis
+        self._commands: list[tuple[str, str, str | bytes, tuple, dict]] = []
+
+    def set(self, key: str | bytes, *args, **kwargs):
+        self._commands.append((self._redis.ring.node_for(key), "set", key, args, kwargs))
+        return self
+
+    def delete(self, key: str | bytes):
+        self._commands.append((self._redis.ring.node_for(key), "delete", key, (), {}))
+        return self
+
+    async def execute(self) -> list:
+        """
+        Выполняет команды. Если узел недоступен, команды остальных узлов всё равно выполняются,
+        удаления недоступного узла откладываются, а если на нём были записи, поднимается его ошибка.
+        """
+        by_node: dict[str, list[int]] = {}
+        for i, (node, *_) in enumerate(self._commands):
+            by_node.setdefault(node, []).append(i)
+        self._commands, commands = [], self._commands
+
+        async def execute_node(node: str, positions: list[int]) -> list:
+            pipe = self._redis.client(node).pipeline(transaction=False)
+            for i in positions:
+                _, method, key, args, kwargs = commands[i]
+                getattr(pipe, method)(key, *args, **kwargs)
+            return await self._redis.call(node, pipe.execute)
+
+        outcomes = await asyncio.gather(
+            *(execute_node(node, positions) for node, positions in by_node.items()), return_exceptions=True
+        )
+        results: list[Any] = [None] * len(commands)
+        error = None
+        for (node, positions), outcome in zip(by_node.items(), outcomes):
+            if not isinstance(outcome, BaseException):
+                for i, result in zip(positions, outcome):
+                    results[i] = result
+                continue
+            if not self._redis.is_node_error(outcome):
+                raise outcome
+            # Удаления недоступного узла выполнятся при его возвращении, ошибка нужна только для записей
+            self._redis.defer_deletes(node, [commands[i][2] for i in positions if commands[i][1] == "delete"])
+            if any(commands[i][1] != "delete" for i in positions):
+                error = error or outcome
+        if error is not None:
+            raise error
+        return results
+
+
+class ShardedRedis:
+    """
+    Клиент нескольких узлов Redis с распределением ключей консистентным хешированием (HashRing).
+    Повторяет используемую кешем часть API redis.asyncio.Redis: get, set, mget, delete, pipeline, publish, pubsub.
+    Сообщения pub/sub публикуются на все доступные узлы, а подписка открывается на одном из них,
+    поэтому потеря любого узла не останавливает оповещения.
+    Узел, на котором произошла ошибка соединения, на retry_seconds считается недоступным: команды к нему
+    сразу завершаются ошибкой ConnectionError без ожидания таймаута, и кеш обращается к базе.
+    Ключи недоступного узла на другие узлы не переносятся. Удаления его ключей откладываются и выполняются
+    перед первой командой после его возвращения, чтобы он не отдавал заблокированные или изменённые ссылки.
+    """
+
+    # Сколько отложенных удалений хранить для узла. При переполнении узел очищается целиком при возвращении
+    MAX_DEFERRED_DELETES = 100_000
+
+    def __init__(self, clients: dict[str, Any], virtual_nodes: int = 160, retry_seconds: float = 5):
+        """
+        :param clients: Клиенты redis.asyncio по имени узла (node_name) в порядке перечисления
+        :param virtual_nodes: Количество точек каждого узла на кольце
+        :param retry_seconds: Сколько секунд не обращаться к узлу после ошибки соединения
+        """
+        self.clients = clients
+        self.ring = HashRing(list(clients), virtual_nodes)
+        self._retry_seconds = retry_seconds
+        self._down_until: dict[str, float] = {}
+        self._deferred_deletes: dict[str, set | None] = {}
+        self._pubsub_index = 0
+
+    def client(self, node: str):
+        """
+        :param node: Имя узла
+        :return: Клиент узла
+        :raises redis.exceptions.ConnectionError: Если узел недавно был недоступен
+        """
+        down_until = self._down_until.get(node)
+        if down_until is not None:
+            if time.monotonic() < down_until:
+                from redis.exceptions import ConnectionError
+                raise ConnectionError(f"Redis node {node} is unavailable")
+            del self._down_until[node]
+        return self.clients[node]
+
+    @staticmethod
+    def is_node_error(error: BaseException) -> bool:
+        """Ошибка соединения с узлом, после которой узел считается недоступным."""
+        from redis.exceptions import ConnectionError, TimeoutError
+        return isinstance(error, (ConnectionError, TimeoutError, OSError))
+
+    def defer_deletes(self, node: str, keys: list):
+        """
+        Запоминает удаления ключей недоступного узла до его возвращения.
+
+        :param node: Имя узла
+        :param keys: Ключи узла
+        """
+        if not keys or node in self._deferred_deletes and self._deferred_deletes[node] is None:
+            return
+        deferred = self._deferred_deletes.setdefault(node, set())
+        deferred.update(keys)
+        if len(deferred) > self.MAX_DEFERRED_DELETES:
+            self._deferred_deletes[node] = None
+        logger.warning(f"Deferred deleting {len(keys)} keys on unavailable Redis node {node}")
+
+    async def call(self, node: str, command, *args, **kwargs):
+        """
+        Выполняет команду узла и при ошибке соединения помечает узел недоступным.
+        Перед первой командой вернувшемуся узлу выполняет отложенные удаления.
+
+        :param node: Имя узла
+        :param command: Корутинная функция команды клиента или pipeline этого узла
+        """
+        try:
+            if node in self._deferred_deletes:
+                await self._apply_deferred_deletes(node)
+            return await command(*args, **kwargs)
+        except Exception as e:
+            if not self.is_node_error(e):
+                raise
+            if node not in self._down_until:
+                logger.error(f"Redis node {node} is unavailable for {self._retry_seconds}s: {e}")
+            self._down_until[node] = time.monotonic() + self._retry_seconds
+            raise
+
+    async def _apply_deferred_deletes(self, node: str):
+        keys = self._deferred_deletes.pop(node)
+        client = self.clients[node]
+        try:
+            if keys is None:
+                logger.warning(f"Flushing Redis node {node}: too many deletes were deferred while it was unavailable")
+                await client.flushdb()
+            elif keys:
+                await client.delete(*keys)
+        except Exception:
+            if keys is None:
+                self._deferred_deletes[node] = None
+            else:
+                self.defer_deletes(node, list(keys))
+            raise
+
+    async def _key_command(self, method: str, key: str | bytes, *args, **kwargs):
+        node = self.ring.node_for(key)
+        return await self.call(node, getattr(self.client(node), method), key, *args, **kwargs)
+
+    async def get(self, key: str | bytes):
+        return await self._key_command("get", key)
+
+    async def set(self, key: str | bytes, value, **kwargs):
+        return await self._key_command("set", key, value, **kwargs)
+
+    async def delete(self, *keys: str | bytes) -> int:
+        """Удаляет ключи по одной команде DEL на узел. Удаления на недоступном узле откладываются."""
+        by_node: dict[str, list] = {}
+        for key in keys:
+            by_node.setdefault(self.ring.node_for(key), []).append(key)
+
+        async def delete_node(node: str, node_keys: list) -> int:
+            try:
+                return await self.call(node, self.client(node).delete, *node_keys)
+            except Exception as e:
+                if not self.is_node_error(e):
+                    raise
+                self.defer_deletes(node, node_keys)
+                return 0
+
+        return sum(await asyncio.gather(*(delete_node(node, node_keys) for node, node_keys in by_node.items())))
+
+    async def mget(self, keys: list[str | bytes]) -> list:
+        """Значения ключей в том же порядке, по одной команде MGET на каждый узел."""
+        by_node: dict[str, list[int]] = {}
+        for i, key in enumerate(keys):
+            by_node.setdefault(self.ring.node_for(key), []).append(i)
+        values = await asyncio.gather(*(
+            self.call(node, self.client(node).mget, [keys[i] for i in positions]) for node, positions in by_node.items()
+        ))
+        results: list = [None] * len(keys)
+        for positions, node_values in zip(by_node.values(), values):
+            for i, value in zip(positions, node_values):
+                results[i] = value
+        return results
+
+    def pipeline(self, transaction: bool = False) -> ShardedPipeline:
+        """Pipeline, разбиваемый по узлам. Транзакции между узлами не поддерживаются."""
+        if transaction:
+            raise ValueError("Transactions across Redis nodes are not supported")
+        return ShardedPipeline(self)
+
+    async def publish(self, channel: str, message) -> int:
+        """
+        Публикует сообщение на всех узлах, подписчик каждого процесса слушает один из них.
+        Ошибка поднимается, только если недоступны все узлы.
+
+        :return: Количество получивших сообщение подписчиков
+        """
+        async def publish_node(node: str) -> int:
+            return await self.call(node, self.client(node).publish, channel, message)
+
+        outcomes = await asyncio.gather(*(publish_node(node) for node in self.ring.nodes), return_exceptions=True)
+        received = [outcome for outcome in outcomes if not isinstance(outcome, BaseException)]
+        if not received:
+            raise outcomes[0]
+        for node, outcome in zip(self.ring.nodes, outcomes):
+            if isinstance(outcome, BaseException) and not self.is_node_error(outcome):
+                raise outcome
+        return sum(received)
+
+    def pubsub(self):
+        """
+        Подписка на следующем по кругу доступном узле. Каждое переподключение слушателя
+        переходит к следующему узлу, поэтому недоступный узел не держит подписку.
+        """
+        nodes = self.ring.nodes
+        for offset in range(len(nodes)):
+            node = nodes[(self._pubsub_index + offset) % len(nodes)]
+            if self._down_until.get(node, 0) <= time.monotonic():
+                break
+        self._pubsub_index = (nodes.index(node) + 1) % len(nodes)
+        return self.clients[node].pubsub()
+
+    async def flushdb(self):
+        await asyncio.gather(*(client.flushdb() for client in self.clients.values()))
+
+    async def aclose(self):
+        await asyncio.gather(*(client.aclose() for client in self.clients.values()))
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import SecretStr
 from pydantic_settings import BaseSettings
 
@@ -26,8 +28,43 @@ class DbConfig(BaseSettings):
     Конфигурация для подключения к SQLite базе данных.
 
     :param db_filename: Путь к файлу базы данных SQLite
+    :param short_url_pool_size: Количество заранее подготовленных свободных коротких кодов для каждой длины
+    :param short_url_pool_refill_interval_seconds: Период фонового пополнения пулов коротких кодов
+    :param expired_links_sweep_interval_seconds: Период фонового удаления ссылок с истёкшим сроком действия
+    :param expired_links_sweep_batch_size: Количество ссылок, удаляемых одной транзакцией
+    :param db_readers: Количество соединений для чтения (соединение для записи всегда одно)
+    :param db_synchronous: PRAGMA synchronous (в режиме WAL NORMAL не теряет целостность при сбое)
+    :param db_cache_size: PRAGMA cache_size (отрицательное значение - размер в КиБ)
+    :param db_mmap_size: PRAGMA mmap_size в байтах
+    :param db_busy_timeout_ms: PRAGMA busy_timeout - сколько ждать освобождения блокировки базы
+    :param user_agent_cache_size: Количество id User-Agent, которые процесс держит в памяти для каждой партиции кликов
+    :param click_partitions_dir: Каталог файлов партиций кликов, по умолчанию <имя базы>_clicks рядом с базой
+    :param click_partition_period: Период одной партиции кликов: month или day
+    :param click_partition_retention: Сколько последних периодов кликов хранить, включая текущий (0 - хранить все)
+    :param click_partition_archive_dir: Каталог, в который выгружаются клики удаляемых партиций (CSV, gzip);
+        если не задан, партиции удаляются без выгрузки
+    :param click_partition_retention_interval_seconds: Период фонового удаления устаревших партиций кликов
+    :param db_shards: Количество файлов, по которым ссылки распределяются по хешу короткого кода
+        (шарды, кроме нулевого, - <имя базы>_shard<номер> рядом с базой). После изменения ссылки
+        переносятся командой python rebalance.py
     """
     db_filename: SecretStr
+    db_shards: int = 1
+    db_readers: int = 4
+    db_synchronous: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = "NORMAL"
+    db_cache_size: int = -64000
+    db_mmap_size: int = 268435456
+    db_busy_timeout_ms: int = 5000
+    short_url_pool_size: int = 1000
+    short_url_pool_refill_interval_seconds: float = 5
+    expired_links_sweep_interval_seconds: float = 60
+    expired_links_sweep_batch_size: int = 500
+    user_agent_cache_size: int = 10000
+    click_partitions_dir: str | None = None
+    click_partition_period: Literal["month", "day"] = "month"
+    click_partition_retention: int = 0
+    click_partition_archive_dir: str | None = None
+    click_partition_retention_interval_seconds: float = 3600
 
     class Config:
         env_file = ".env"
@@ -41,9 +78,45 @@ class RedisConfig(BaseSettings):
     """
     Конфигурация для подключения к Redis серверу.
 
-    :param redis_url: URL для подключения к Redis (например, redis://localhost:6379)
+    :param redis_url: URL для подключения к Redis (например, redis://localhost:6379).
+        Несколько URL через запятую - узлы кеша, ключи распределяются по ним консистентным хешированием
+    :param cache_warmup_chunk_size: Количество ссылок, читаемых из SQLite и записываемых в Redis за один шаг прогрева
+    :param cache_warmup_in_background: Прогревать кеш в фоне, не задерживая запуск API
+    :param local_cache_size: Максимальное количество ссылок в кеше в памяти процесса (0 - отключен)
+    :param local_cache_ttl_seconds: Время жизни ссылки в кеше в памяти процесса
+    :param cache_invalidation_channel: Канал Redis pub/sub для сброса ссылок из кеша в памяти всех процессов
+    :param cache_link_added_channel: Канал Redis pub/sub для оповещения всех процессов о созданных ссылках
+    :param negative_cache_ttl_seconds: Время жизни надгробия для несуществующего короткого кода (0 - отключены)
+    :param link_filter_enabled: Строить фильтр Блума существующих коротких кодов
+    :param link_filter_capacity: Ожидаемое количество ссылок в фильтре
+    :param link_filter_error_rate: Допустимая доля ложноположительных ответов фильтра
+    :param cache_value_format: Формат записи ссылок в Redis: двоичный (binary) или старый строковый (legacy).
+        Читаются оба формата, legacy нужен на время обновления, пока работают процессы старой версии
+    :param cache_warmup_lock_key: Ключ Redis, которым процесс-воркер занимает прогрев кеша.
+        Прогревает Redis только занявший ключ процесс, остальные строят лишь фильтр существующих кодов
+    :param cache_warmup_lock_ttl_seconds: Время жизни ключа прогрева. Процессы, запущенные в пределах этого времени,
+        считаются одним развёртыванием и не прогревают Redis повторно
+    :param original_url_key_prefix: Префикс ключей обратного индекса в Redis: ключ оригинального URL -> короткий URL
+    :param redis_virtual_nodes: Количество точек каждого узла Redis на кольце консистентного хеширования
+    :param redis_node_retry_seconds: Сколько секунд не обращаться к узлу Redis после ошибки соединения
     """
     redis_url: SecretStr
+    cache_warmup_chunk_size: int = 5000
+    cache_warmup_in_background: bool = False
+    local_cache_size: int = 10000
+    local_cache_ttl_seconds: float = 60
+    cache_invalidation_channel: str = "links:invalidate"
+    cache_link_added_channel: str = "links:added"
+    negative_cache_ttl_seconds: int = 30
+    link_filter_enabled: bool = True
+    link_filter_capacity: int = 1_000_000
+    link_filter_error_rate: float = 0.01
+    cache_value_format: Literal["binary", "legacy"] = "binary"
+    cache_warmup_lock_key: str = "links:warmup"
+    cache_warmup_lock_ttl_seconds: int = 300
+    original_url_key_prefix: str = "url:"
+    redis_virtual_nodes: int = 160
+    redis_node_retry_seconds: float = 5
 
     class Config:
         env_file = ".env"
@@ -59,9 +132,66 @@ class ApiConfig(BaseSettings):
 
     :param host: Хост на котором будет развёрнуто API (например, 0.0.0.0).
     :param port: Порт на котором будет развёрнуто API (например, 8000).
+    :param admin_token: Токен для административных методов (заголовок X-Admin-Token), без него они недоступны.
+    :param metrics_enabled: Отдавать метрики Prometheus на /metrics
+    :param run_mode: Режим запуска main.py: development - один процесс с автоперезагрузкой,
+        production - несколько процессов-воркеров без автоперезагрузки
+    :param workers: Количество процессов-воркеров в режиме production (по умолчанию по числу ядер)
+    :param metrics_multiproc_dir: Каталог файлов метрик процессов-воркеров в режиме production:
+        /metrics любого воркера отдаёт сумму по всем воркерам. Очищается при запуске main.py
+    :param loop: Реализация event loop: auto (uvloop, если установлен), asyncio или uvloop
+    :param http: Реализация HTTP/1.1: auto (httptools, если установлен), h11 или httptools
+    :param backlog: Максимальная длина очереди соединений, ещё не принятых воркерами
+    :param keep_alive_timeout_seconds: Время, в течение которого неактивное keep-alive соединение остаётся открытым
+    :param shorten_idempotent: Для уже сокращённого URL возвращать существующую короткую ссылку вместо ошибки 400
     """
     host: str = "0.0.0.0"
     port: int = 8000
+    admin_token: SecretStr | None = None
+    metrics_enabled: bool = True
+    run_mode: Literal["development", "production"] = "development"
+    workers: int | None = None
+    metrics_multiproc_dir: str = "prometheus_multiproc"
+    loop: Literal["auto", "asyncio", "uvloop"] = "auto"
+    http: Literal["auto", "h11", "httptools"] = "auto"
+    backlog: int = 2048
+    keep_alive_timeout_seconds: int = 5
+    shorten_idempotent: bool = False
+
+    class Config:
+        env_file = ".env"
+        env_file_encoding = "utf-8"
+        case_sensitive = False
+        env_prefix = ""
+        extra="ignore"
+
+
+class ClicksConfig(BaseSettings):
+    """
+    Конфигурация буферизованной записи кликов.
+
+    :param click_queue_size: Максимальный размер очереди кликов в памяти
+    :param click_flush_interval_ms: Максимальное время между сбросами очереди в SQLite
+    :param click_flush_batch_size: Количество кликов, при котором очередь сбрасывается не дожидаясь интервала
+    :param click_backpressure: Поведение при переполнении очереди: drop - отбросить клик,
+        block - ждать места в очереди, spill - дописать клик в файл на диске
+    :param click_spill_filename: Файл для кликов, не поместившихся в очередь (режим spill).
+        Каждый процесс пишет в свой файл <click_spill_filename>.<pid>, файлы завершившихся процессов
+        дописываются в базу при запуске и остановке остальных
+    :param click_rollup_interval_seconds: Интервал фоновой агрегации кликов в часовую и суточную статистику
+    :param click_rollup_batch_size: Количество кликов, агрегируемых одной транзакцией
+    :param click_rollup_top_user_agents: Сколько самых частых User-Agent хранить в корзине и отдавать в статистике
+    :param click_stats_default_days: Период статистики по умолчанию, если since не указан
+    """
+    click_queue_size: int = 10000
+    click_flush_interval_ms: int = 500
+    click_flush_batch_size: int = 1000
+    click_backpressure: Literal["drop", "block", "spill"] = "block"
+    click_spill_filename: str = "clicks.spill"
+    click_rollup_interval_seconds: int = 60
+    click_rollup_batch_size: int = 5000
+    click_rollup_top_user_agents: int = 10
+    click_stats_default_days: int = 30
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,102 @@
+from functools import cached_property
+
+
+class AppContext:
+    """
+    Ресурсы приложения: конфигурации, база данных, клиент Redis, кеши в памяти и шифрование.
+    Каждый ресурс создаётся при первом обращении, поэтому импорт модулей не читает .env,
+    не открывает соединения и не импортирует тяжёлые зависимости раньше, чем они понадобятся.
+    Закрывается в FastAPI lifespan, обработчики получают контекст через Depends(get_app_context).
+    Ресурс можно подменить присваиванием атрибута, например в тестах и бенчмарках.
+    """
+
+    @cached_property
+    def api_config(self):
+        """Конфигурация API."""
+        from config import ApiConfig
+        return ApiConfig()
+
+    @cached_property
+    def db_config(self):
+        """Конфигурация SQLite."""
+        from config import DbConfig
+        return DbConfig()
+
+    @cached_property
+    def redis_config(self):
+        """Конфигурация Redis и кешей."""
+        from config import RedisConfig
+        return RedisConfig()
+
+    @cached_property
+    def clicks_config(self):
+        """Конфигурация буферизованной записи кликов."""
+        from config import ClicksConfig
+        return ClicksConfig()
+
+    @cached_property
+    def aes_engine(self):
+        """Шифрование AES-256 и ключевой хеш коротких ссылок."""
+        from config import AESConfig
+        from utils.links import AESEngine
+        return AESEngine(AESConfig())
+
+    @cached_property
+    def database(self):
+        """Синхронный доступ к SQLite."""
+        from database.core import Database
+        return Database(self.db_config)
+
+    @cached_property
+    def async_database(self):
+        """Асинхронная обёртка над database."""
+        from database.core import AsyncDatabase
+        return AsyncDatabase(self.database)
+
+    @cached_property
+    def click_buffer(self):
+        """Буфер кликов между редиректами и SQLite."""
+        from database.clicks import ClickBuffer
+        return ClickBuffer(self.async_database, self.clicks_config)
+
+    @cached_property
+    def redis(self):
+        """
+        Клиент Redis. Соединение открывается при первой команде.
+        Если в redis_url перечислено несколько узлов, ключи распределяются по ним через cache.ring.ShardedRedis.
+        """
+        from redis import asyncio as aioredis
+        urls = [url.strip() for url in self.redis_config.redis_url.get_secret_value().split(",") if url.strip()]
+        if len(urls) == 1:
+            return aioredis.from_url(urls[0])
+        from cache.ring import ShardedRedis, node_name
+        return ShardedRedis(
+            {node_name(url): aioredis.from_url(url) for url in urls},
+            self.redis_config.redis_virtual_nodes,
+            self.redis_config.redis_node_retry_seconds,
+        )
+
+    @cached_property
+    def local_cache(self):
+        """Кеш ссылок в памяти процесса."""
+        from cache.local import LocalCache
+        return LocalCache(self.redis_config.local_cache_size, self.redis_config.local_cache_ttl_seconds)
+
+    @cached_property
+    def negative_cache(self):
+        """Кеш несуществующих коротких кодов с фильтром Блума."""
+        from cache.negative import BloomFilter, NegativeCache
+        config = self.redis_config
+        return NegativeCache(
+            BloomFilter(config.link_filter_capacity, config.link_filter_error_rate) if config.link_filter_enabled else None
+        )
+
+    async def aclose(self):
+        """Закрывает созданные соединения с Redis и SQLite. Не созданные ресурсы не трогает."""
+        if "redis" in self.__dict__:
+            await self.redis.aclose()
+        if "database" in self.__dict__:
+            self.database.close()
+
+
+app_context = AppContext()
@@ -1,3 +1,5 @@
-from .core import Database, DatabaseMigrator, ShortLinkWithThatUrlAlreadyExists, ThisLengthPoolFilled, Link, database
+from .core import Database, AsyncDatabase, DatabaseMigrator, ShortLinkWithThatUrlAlreadyExists, ThisLengthPoolFilled, Link, LinkTarget
+from .clicks import ClickBuffer
+from .partitions import ClickPartitions
 
-__all__ = ["Database", "DatabaseMigrator", "ShortLinkWithThatUrlAlreadyExists", "ThisLengthPoolFilled", "Link", "database"]
\ No newline at end of file
+__all__ = ["Database", "AsyncDatabase", "DatabaseMigrator", "ShortLinkWithThatUrlAlreadyExists", "ThisLengthPoolFilled", "Link", "LinkTarget", "ClickBuffer", "ClickPartitions"]
\ No newline at end of file
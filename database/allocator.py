@@ -0,0 +1,81 @@
+import threading
+from collections import deque
+from typing import Callable, Iterable
+
+import utils
+
+
+class ShortCodeAllocator:
+    """
+    Пул заранее сгенерированных свободных коротких кодов для каждой длины.
+    Коды проверяются на занятость пачкой одним запросом при пополнении пула,
+    поэтому выдача кода при создании ссылки не требует обращений к базе.
+    Доля занятых кодов среди сгенерированных при пополнении служит оценкой заполненности длины.
+    """
+    def __init__(self, find_used: Callable[[list[str]], Iterable[str]], pool_size: int = 1000):
+        """
+        :param find_used: Функция, возвращающая из списка ключей поиска (short_url_lookup_key) уже занятые
+        :param pool_size: Размер пула для одной длины
+        """
+        self._find_used = find_used
+        self._pool_size = pool_size
+        self._low_watermark = max(1, pool_size // 4)
+        self._pools: dict[int, deque[str]] = {}
+        self._fill_ratios: dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def take(self, length: int) -> str | None:
+        """
+        Выдаёт свободный код заданной длины.
+
+        :param length: Длина кода
+        :return: Код или None, если свободных кодов этой длины не осталось
+        """
+        with self._lock:
+            pool = self._pools.setdefault(length, deque())
+            if not pool:
+                self._refill(length)
+            if not pool:
+                return None
+            return pool.popleft()
+
+    def refill_low_pools(self):
+        """Пополняет пулы, в которых осталось меньше четверти кодов. Вызывается фоновой задачей."""
+        with self._lock:
+            for length, pool in self._pools.items():
+                if len(pool) < self._low_watermark:
+                    self._refill(length)
+
+    def fill_ratio(self, length: int) -> float:
+        """
+        Оценка доли занятых кодов заданной длины по последним пополнениям пула.
+
+        :param length: Длина кода
+        :return: Доля от 0 до 1
+        """
+        return self._fill_ratios.get(length, 0.0)
+
+    def stats(self) -> dict[int, dict]:
+        """Размер пула и оценка заполненности для каждой длины."""
+        return {
+            length: {"pool": len(pool), "fill_ratio": self.fill_ratio(length)}
+            for length, pool in self._pools.items()
+        }
+
+    def _refill(self, length: int):
+        pool = self._pools[length]
+        pooled = set(pool)
+        candidates = {
+            utils.short_url_lookup_key(code): code
+            for code in (utils.generate_random_string(length) for _ in range(self._pool_size - len(pool)))
+            if code not in pooled
+        }
+        if not candidates:
+            return
+
+        used = set(self._find_used(list(candidates)))
+        pool.extend(code for lookup_key, code in candidates.items() if lookup_key not in used)
+
+        ratio = len(used) / len(candidates)
+        previous = self._fill_ratios.get(length)
+        self._fill_ratios[length] = ratio if previous is None else (previous + ratio) / 2
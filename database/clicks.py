@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from datetime import datetime, timezone
+
+from config import ClicksConfig
+from database.core import AsyncDatabase
+from metrics import click_queue_depth, click_queue_dropped, click_queue_spilled
+from utils import parse_click_metadata, to_db_timestamp
+
+
+class ClickBuffer:
+    """
+    Буфер кликов между редиректами и SQLite.
+    Редирект только кладёт клик в ограниченную очередь в памяти,
+    фоновая задача пачками пишет клики в базу одной транзакцией
+    каждые click_flush_interval_ms или по достижении click_flush_batch_size.
+    """
+    def __init__(self, db: AsyncDatabase, config: ClicksConfig | None = None):
+        self._db = db
+        self._config = config or ClicksConfig()
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._queue: asyncio.Queue | None = None
+        self._flusher: asyncio.Task | None = None
+        self._flushing: asyncio.Future | None = None
+        self._stopping = False
+        self.dropped = 0
+        self.spilled = 0
+
+    def start(self):
+        """
+        Создаёт очередь, запускает фоновую запись кликов и отдаёт метрикам размер очереди и счётчики потерь.
+        Вызывается из FastAPI lifespan.
+        """
+        self._queue = asyncio.Queue(maxsize=self._config.click_queue_size)
+        click_queue_depth.set_function(lambda: self.size)
+        click_queue_dropped.set_function(lambda: self.dropped)
+        click_queue_spilled.set_function(lambda: self.spilled)
+        self._stopping = False
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Останавливает фоновую запись и дописывает в базу все накопленные клики."""
+        if self._flusher is not None:
+            # asyncio.wait_for может поглотить отмену, поэтому цикл записи дополнительно проверяет флаг
+            self._stopping = True
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self._flushing is not None:
+            await self._flushing
+            self._flushing = None
+        while self._queue is not None and not self._queue.empty():
+            await self._flush(self._take_batch([]))
+        await self._flush_spill(orphans=True)
+
+    async def push(self, link_id: int, user_agent: str | None, ip: str | None, referer: str | None = None,
+                   created_at: datetime | None = None):
+        """
+        Добавляет клик в очередь на запись.
+
+        :param link_id: ID ссылки, по которой был клик
+        :param user_agent: Заголовок User-Agent
+        :param ip: IP-адрес клиента
+        :param referer: Заголовок Referer
+        :param created_at: Время клика, по умолчанию текущее
+        """
+        click = (link_id, user_agent, ip, referer, to_db_timestamp(created_at or datetime.now(timezone.utc)))
+
+        if self._config.click_backpressure == "block":
+            await self._queue.put(click)
+            return
+        try:
+            self._queue.put_nowait(click)
+        except asyncio.QueueFull:
+            if self._config.click_backpressure == "spill":
+                self._spill(click)
+            else:
+                self.dropped += 1
+
+    @property
+    def size(self) -> int:
+        """Текущее количество кликов в очереди."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _flush_loop(self):
+        try:
+            await self._flush_spill(orphans=True)
+        except Exception as e:
+            self._logger.error(f"Failed to flush orphaned spilled clicks: {e}")
+        while not self._stopping:
+            # Ошибка одной итерации не должна останавливать запись: иначе в режиме block редиректы ждут место в очереди вечно
+            try:
+                await self._flush_next()
+            except Exception as e:
+                self._logger.error(f"Failed to flush clicks: {e}")
+
+    async def _flush_next(self):
+        interval = self._config.click_flush_interval_ms / 1000
+        batch = self._take_batch([await self._queue.get()])
+        deadline = asyncio.get_running_loop().time() + interval
+        while len(batch) < self._config.click_flush_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+            self._take_batch(batch)
+        # Отмена при остановке не должна прерывать запись уже взятой из очереди пачки
+        self._flushing = asyncio.ensure_future(self._flush(batch))
+        try:
+            await asyncio.shield(self._flushing)
+        finally:
+            if self._flushing.done():
+                self._flushing = None
+        if self._queue.empty():
+            await self._flush_spill()
+
+    def _take_batch(self, batch: list) -> list:
+        while len(batch) < self._config.click_flush_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _flush(self, batch: list):
+        if not batch:
+            return
+        try:
+            await self._db.add_clicks(batch)
+        except Exception as e:
+            self._logger.error(f"Failed to write {len(batch)} clicks: {e}")
+            for click in batch:
+                self._spill(click)
+
+    def _spill(self, click: tuple):
+        try:
+            with open(self._spill_filename, "a") as f:
+                f.write(json.dumps(click) + "\n")
+        except OSError as e:
+            self._logger.error(f"Failed to spill click to disk: {e}")
+            self.dropped += 1
+            return
+        self.spilled += 1
+
+    @staticmethod
+    def _from_spill(click: list) -> tuple:
+        # Файл мог остаться от версии, где клик хранился как (id ссылки, метаданные, время)
+        if len(click) == 3:
+            link_id, metadata, created_at = click
+            return (link_id, *parse_click_metadata(metadata), None, created_at)
+        return tuple(click)
+
+    @property
+    def _spill_filename(self) -> str:
+        # У каждого процесса-воркера свой файл, иначе воркеры забирают и перезаписывают файлы друг друга
+        return f"{self._config.click_spill_filename}.{os.getpid()}"
+
+    def _orphaned_spill_filenames(self) -> list[str]:
+        """
+        Файлы кликов, оставшиеся от завершившихся процессов, и файлы прежнего формата без pid в имени.
+        """
+        directory, basename = os.path.split(self._config.click_spill_filename)
+        pattern = re.compile(re.escape(basename) + r"(?:\.(\d+))?(?:\.processing)?$")
+        try:
+            filenames = sorted(os.listdir(directory or "."))
+        except FileNotFoundError:
+            return []
+        orphans = []
+        for filename in filenames:
+            match = pattern.match(filename)
+            if match and (match.group(1) is None or not _pid_alive(int(match.group(1)))):
+                orphans.append(os.path.join(directory, filename))
+        return orphans
+
+    async def _flush_spill(self, orphans: bool = False):
+        """
+        Дописывает в базу клики из файла процесса, а с orphans - и из файлов завершившихся процессов.
+        Файл забирается переименованием в <файл процесса>.processing, поэтому один файл забирает только один процесс.
+        """
+        processing_filename = self._spill_filename + ".processing"
+        # Файл .processing процесса может остаться от прошлой итерации или от процесса с тем же pid
+        filenames = [processing_filename, self._spill_filename]
+        if orphans:
+            filenames += [filename for filename in self._orphaned_spill_filenames() if filename not in filenames]
+        for filename in filenames:
+            if filename != processing_filename:
+                try:
+                    os.replace(filename, processing_filename)
+                except FileNotFoundError:
+                    continue
+            elif not os.path.exists(processing_filename):
+                continue
+            await self._drain_spill(processing_filename)
+
+    async def _drain_spill(self, processing_filename: str):
+        clicks = []
+        with open(processing_filename, "r") as f:
+            for line in f:
+                try:
+                    clicks.append(self._from_spill(json.loads(line)))
+                except ValueError:
+                    # Строка, недописанная из-за ошибки записи (например, закончилось место на диске)
+                    if line.strip():
+                        self._logger.warning(f"Skipped broken spilled click: {line.strip()[:100]}")
+        os.remove(processing_filename)
+
+        batch_size = self._config.click_flush_batch_size
+        for i in range(0, len(clicks), batch_size):
+            await self._flush(clicks[i:i + batch_size])
+
+
+def _pid_alive(pid: int) -> bool:
+    """Проверяет, работает ли процесс с указанным pid."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
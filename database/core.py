@@ -1,19 +1,58 @@
+import asyncio
+import functools
+import importlib.util
 import logging
 import os
 import sqlite3
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from pydantic import SecretStr
 
 import utils
 from config import DbConfig
-from database.models import Link
+from context import app_context
+from database.allocator import ShortCodeAllocator
+from database.models import Link, LinkTarget
+from database.partitions import ClickPartition, ClickPartitions
+from database.pool import ConnectionPool
+from database.rollups import ClickBucket, HyperLogLog, aggregate_clicks, bucket_start, bucket_step, \
+    decode_user_agents, encode_user_agents, top_counts
+from database.shards import SHARD_ID_RANGE, existing_shards, merge_links_chunks, shard_filename, shard_index
+
+
+# id новой ссылки берётся из счётчика шарда явно: AUTOINCREMENT выдал бы id больше максимального в таблице,
+# а ссылки, перенесённые из других шардов, хранят id чужих диапазонов (см. Database.reserve_link_id_ranges)
+INSERT_LINK_QUERY = (
+    "INSERT INTO links(id, short_url, short_url_hash, original_url, original_url_hash, host_hash, expires_at, "
+    "short_url_length) VALUES((SELECT seq + 1 FROM sqlite_sequence WHERE name = 'links'),?,?,?,?,?,?,?)"
+)
+# Через сколько секунд заявка на оригинальный URL без созданной ссылки считается брошенной
+# (процесс завершился между заявкой и вставкой ссылки) и может быть занята снова
+ORIGINAL_URL_CLAIM_TIMEOUT = 60
 
 
 class Database:
-    def __init__(self):
-        """Инициализирует подключение к SQLite."""
-        self._config = DbConfig()
-        self.connection = sqlite3.connect(self._config.db_filename.get_secret_value())
-        self.cursor = self.connection.cursor()
+    def __init__(self, config: DbConfig | None = None):
+        """
+        Инициализирует пул соединений с SQLite. Соединения открываются при первом запросе.
+        При DB_SHARDS > 1 ссылки распределяются по файлам шардов по хешу короткого кода,
+        у каждого шарда своё соединение на запись. Нулевой шард - основной файл базы,
+        в нём же хранятся агрегаты кликов и служебные таблицы.
+
+        :param config: Конфигурация базы, по умолчанию читается из окружения
+        """
+        self._config = config or DbConfig()
+        self.pool = ConnectionPool(self._config.db_filename.get_secret_value(), self._config)
+        self.shards: list[Database] = [self] + [
+            Database(self._config.model_copy(update={
+                "db_filename": SecretStr(shard_filename(self._config.db_filename.get_secret_value(), shard)),
+                "db_shards": 1,
+            }))
+            for shard in range(1, self._config.db_shards)
+        ]
+        self.short_url_allocator = ShortCodeAllocator(self._find_used_short_url_hashes, self._config.short_url_pool_size)
+        self.click_partitions = ClickPartitions(self._config)
         self._logger= logging.getLogger(self.__class__.__name__)
 
     def get_link_by_short_url(self, short_url: str) -> Link | None:
@@ -23,27 +62,102 @@ class Database:
         :param short_url: Короткий URL для поиска
         :return: Объект Link или None, если ссылка не найдена
         """
-        self.cursor.execute(
-            "SELECT * FROM links WHERE short_url = ? AND banned IS false "
-            "AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP) LIMIT 1",
-            (utils.encrypt_aes256_base64(short_url),)
-        )
-        result = self.cursor.fetchone()
+        short_url_hash = utils.short_url_lookup_key(short_url)
+        with self._shard_pool(short_url_hash).reader() as cursor:
+            cursor.execute(
+                "SELECT id, original_url, short_url_length, banned, banned_at, created_at, expires_at FROM links "
+                "WHERE short_url_hash = ? AND banned IS false "
+                "AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP) LIMIT 1",
+                (short_url_hash,)
+            )
+            result = cursor.fetchone()
 
         if not result:
             return None
-        return Link(*result)
+        # Колонка clicks удалена из links миграцией 2_delete_clicks
+        return Link.from_encrypted(result[0], short_url, result[1], 0, *result[2:])
 
-    def get_all_links(self) -> list[list[str]]:
+    def get_redirect_target(self, short_url: str) -> LinkTarget | None:
+        """
+        Находит по короткому URL только то, что нужно для редиректа: id и оригинальный URL.
+        Заблокированные и просроченные ссылки отфильтровываются запросом.
+
+        :param short_url: Короткий URL для поиска
+        :return: Объект LinkTarget или None, если активной ссылки нет
+        """
+        short_url_hash = utils.short_url_lookup_key(short_url)
+        with self._shard_pool(short_url_hash).reader() as cursor:
+            cursor.execute(
+                "SELECT id, original_url FROM links WHERE short_url_hash = ? AND banned IS false "
+                "AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP) LIMIT 1",
+                (short_url_hash,)
+            )
+            result = cursor.fetchone()
+
+        if not result:
+            return None
+        return LinkTarget(result[0], utils.decrypt_aes256_base64_bytes(result[1]))
+
+    def get_all_links(self, shard: int | None = None) -> list[list[str]]:
         """
         Получает все активные ссылки из базы данных.
 
-        :return: Список ссылок в формате [id, short_url, original_url]
+        :param shard: Номер шарда или None для всех шардов
+        :return: Список ссылок в формате [id, short_url_hash, original_url]
         """
-        self.cursor.execute(
-            "SELECT id,short_url,original_url FROM links WHERE banned IS false AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)",
-        )
-        return self.cursor.fetchall()
+        if shard is None:
+            return [link for shard in range(len(self.shards)) for link in self.get_all_links(shard)]
+        with self.shards[shard].pool.reader() as cursor:
+            cursor.execute(
+                "SELECT id,short_url_hash,original_url FROM links WHERE banned IS false AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)",
+            )
+            return cursor.fetchall()
+
+    def get_active_links_chunk(self, after_id: int, limit: int,
+                               shard: int | None = None) -> list[tuple[int, str, str, str | None]]:
+        """
+        Получает очередную пачку активных ссылок, упорядоченных по id.
+        Позволяет обойти всю таблицу, не загружая её в память целиком.
+        Без номера шарда пачка собирается из всех шардов; чтобы не читать лишнего,
+        обход всех ссылок лучше вести по каждому шарду отдельно.
+
+        :param after_id: id последней ссылки предыдущей пачки (0 для первой пачки)
+        :param limit: Максимальный размер пачки
+        :param shard: Номер шарда или None для всех шардов
+        :return: Список ссылок в формате (id, short_url_hash, original_url, expires_at)
+        """
+        if shard is None:
+            return merge_links_chunks(
+                [self.get_active_links_chunk(after_id, limit, shard) for shard in range(len(self.shards))], limit
+            )
+        with self.shards[shard].pool.reader() as cursor:
+            cursor.execute(
+                "SELECT id,short_url_hash,original_url,expires_at FROM links WHERE id > ? AND banned IS false "
+                "AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP) ORDER BY id LIMIT ?",
+                (after_id, limit,)
+            )
+            return cursor.fetchall()
+
+    def get_active_links_by_hashes(self, short_url_hashes: list[str]) -> list[tuple[int, str, str, str | None]]:
+        """
+        Находит активные ссылки по ключам поиска коротких URL, например чтобы вернуть в кеш разблокированные ссылки.
+
+        :param short_url_hashes: Ключи поиска коротких URL (short_url_lookup_key)
+        :return: Список ссылок в формате get_active_links_chunk: (id, short_url_hash, original_url, expires_at)
+        """
+        by_shard: dict[int, list[str]] = {}
+        for short_url_hash in short_url_hashes:
+            by_shard.setdefault(shard_index(short_url_hash, len(self.shards)), []).append(short_url_hash)
+        links = []
+        for number, shard_hashes in by_shard.items():
+            with self.shards[number].pool.reader() as cursor:
+                links += self._select_in(
+                    cursor,
+                    "SELECT id,short_url_hash,original_url,expires_at FROM links WHERE short_url_hash IN ({}) "
+                    "AND banned IS false AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)",
+                    shard_hashes
+                )
+        return links
 
     def create_link(self, original_url: str, short_length: int, expires_at: datetime | None = None) -> tuple[int, str]:
         """
@@ -55,44 +169,707 @@ class Database:
         :return: Кортеж (id созданной ссылки, сгенерированный короткий URL)
         :raises ShortLinkWithThatUrlAlreadyExists: Если ссылка с таким URL уже существует
         """
+        original_url_hash = utils.original_url_lookup_key(original_url)
+        if not self._claim_original_url_hashes([original_url_hash]):
+            raise ShortLinkWithThatUrlAlreadyExists("Short link with that url already exists")
         original_url_encoded = utils.encrypt_aes256_base64(original_url)
-        short_url = self._generate_short_url(short_length)
-        short_url_encoded = utils.encrypt_aes256_base64(short_url)
+        host_hash = utils.host_lookup_key(utils.url_host(original_url))
+        expires_at = utils.to_db_timestamp(expires_at)
         try:
-            self.cursor.execute(
-                "INSERT INTO links(short_url, original_url, expires_at, short_url_length) VALUES(?,?,?,?)",
-                (short_url_encoded, original_url_encoded, expires_at, short_length,),
-            )
-            self.connection.commit()
-            link_id = self.cursor.lastrowid
-        except sqlite3.IntegrityError as e:
-            if e.args[0] == "UNIQUE constraint failed: links.original_url":
-                raise ShortLinkWithThatUrlAlreadyExists("Short link with that url already exists")
+            while True:
+                short_url = self._generate_short_url(short_length)
+                short_url_encoded = utils.encrypt_aes256_base64(short_url)
+                short_url_hash = utils.short_url_lookup_key(short_url)
+                try:
+                    with self._shard_pool(short_url_hash).writer() as cursor:
+                        cursor.execute(
+                            INSERT_LINK_QUERY,
+                            (short_url_encoded, short_url_hash, original_url_encoded, original_url_hash,
+                             host_hash, expires_at, short_length,),
+                        )
+                        return cursor.lastrowid, short_url
+                except sqlite3.IntegrityError as e:
+                    if e.args[0] in ("UNIQUE constraint failed: links.original_url", "UNIQUE constraint failed: links.original_url_hash"):
+                        raise ShortLinkWithThatUrlAlreadyExists("Short link with that url already exists")
+                    # Код из пула успел занять другой процесс, берём следующий
+                    if e.args[0] != "UNIQUE constraint failed: links.short_url_hash":
+                        raise
+        except ShortLinkWithThatUrlAlreadyExists:
+            raise
+        except BaseException:
+            # Ссылка не создана: заявка снимается, чтобы URL можно было сократить снова
+            self._release_original_url_hashes([original_url_hash])
+            raise
+
+    def create_links(self, links: list[tuple[str, int, datetime | None]]) -> list[tuple[int, str, str] | Exception]:
+        """
+        Создает пачку коротких ссылок одной транзакцией на каждый шард.
+        Ошибка одной ссылки не прерывает создание остальных.
+
+        :param links: Список кортежей (оригинальный URL, длина короткой строки, дата истечения срока или None)
+        :return: Для каждой ссылки в том же порядке кортеж (id, короткий URL, оригинальный URL, зашифрованный
+            как в базе) или исключение ShortLinkWithThatUrlAlreadyExists / ThisLengthPoolFilled
+        """
+        original_url_hashes = [utils.original_url_lookup_key(original_url) for original_url, _, _ in links]
+        claimed = self._claim_original_url_hashes(list(dict.fromkeys(original_url_hashes)))
+
+        filled_lengths = {length for length in {length for _, length, _ in links} if self._check_short_urls_pool_filled(length)}
+
+        results: list[tuple[int, str] | Exception | None] = [None] * len(links)
+        new = []
+        for i, ((_, short_length, _), original_url_hash) in enumerate(zip(links, original_url_hashes)):
+            if original_url_hash not in claimed:
+                results[i] = ShortLinkWithThatUrlAlreadyExists("Short link with that url already exists")
+                continue
+            short_url = None if short_length in filled_lengths else self.short_url_allocator.take(short_length)
+            if short_url is None:
+                results[i] = ThisLengthPoolFilled("Pool of short urls with that length is filled")
+                continue
+            claimed.discard(original_url_hash)
+            new.append((i, short_url))
+        # Заявки URL, для которых не нашлось свободного кода
+        self._release_original_url_hashes(list(claimed))
+        if not new:
+            return results
+
+        # Шифруются только URL ссылок, которые действительно будут созданы
+        original_urls_encoded = app_context.aes_engine.encrypt_many([links[i][0] for i, _ in new])
+        rows = [
+            (i, short_url, (
+                utils.encrypt_aes256_base64(short_url), utils.short_url_lookup_key(short_url), original_url_encoded,
+                original_url_hashes[i], utils.host_lookup_key(utils.url_host(links[i][0])),
+                utils.to_db_timestamp(links[i][2]), links[i][1],
+            ))
+            for (i, short_url), original_url_encoded in zip(new, original_urls_encoded)
+        ]
+        by_shard: dict[int, list] = {}
+        for entry in rows:
+            by_shard.setdefault(shard_index(entry[2][1], len(self.shards)), []).append(entry)
+        for shard, shard_rows in by_shard.items():
+            try:
+                with self.shards[shard].pool.writer() as cursor:
+                    cursor.executemany(
+                        INSERT_LINK_QUERY,
+                        [row for _, _, row in shard_rows],
+                    )
+                    ids = {short_url_hash: link_id for link_id, short_url_hash in self._select_in(
+                        cursor, "SELECT id, short_url_hash FROM links WHERE short_url_hash IN ({})",
+                        [row[1] for _, _, row in shard_rows]
+                    )}
+            except sqlite3.IntegrityError:
+                # Конкурентная вставка того же кода: пачка шарда откатилась, создаём её ссылки по одной
+                self._release_original_url_hashes([row[3] for _, _, row in shard_rows])
+                for i, _, row in shard_rows:
+                    try:
+                        # Шифрование детерминировано: create_link записывает тот же шифротекст
+                        results[i] = (*self.create_link(links[i][0], links[i][1], links[i][2]), row[2])
+                    except (ShortLinkWithThatUrlAlreadyExists, ThisLengthPoolFilled) as e:
+                        results[i] = e
+                continue
+
+            for i, short_url, row in shard_rows:
+                results[i] = (ids[row[1]], short_url, row[2])
+        return results
+
+    def get_links_by_original_urls(self, original_urls: list[str]) -> dict[str, tuple[int, str, datetime | None]]:
+        """
+        Находит активные ссылки, уже созданные для URL, одним чтением по индексу original_url_hash.
+        URL сравниваются в каноническом виде (utils.canonicalize_url).
+
+        :param original_urls: Оригинальные URL
+        :return: Для каждого найденного URL кортеж (id ссылки, короткий URL, дата истечения срока или None)
+        """
+        hashes = {original_url: utils.original_url_lookup_key(original_url) for original_url in original_urls}
+        rows = []
+        for shard in self.shards:
+            with shard.pool.reader() as cursor:
+                rows += self._select_in(
+                    cursor,
+                    "SELECT original_url_hash, id, short_url, expires_at FROM links WHERE original_url_hash IN ({}) "
+                    "AND banned IS false AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)",
+                    list(set(hashes.values()))
+                )
+        found = {
+            original_url_hash: (link_id, utils.decrypt_aes256_base64_bytes(short_url), utils.from_db_timestamp(expires_at))
+            for original_url_hash, link_id, short_url, expires_at in rows
+        }
+        return {
+            original_url: found[original_url_hash]
+            for original_url, original_url_hash in hashes.items() if original_url_hash in found
+        }
+
+    def delete_expired_links(self, limit: int) -> list[str]:
+        """
+        Удаляет пачку ссылок с истёкшим сроком действия, одной короткой транзакцией в каждом шарде.
 
-        return link_id, short_url
+        :param limit: Максимальное количество удаляемых ссылок
+        :return: short_url_hash удалённых ссылок
+        """
+        deleted = []
+        for shard in self.shards:
+            if len(deleted) >= limit:
+                break
+            with shard.pool.writer() as cursor:
+                cursor.execute(
+                    "SELECT id, short_url_hash, original_url_hash FROM links "
+                    "WHERE expires_at IS NOT NULL AND expires_at <= CURRENT_TIMESTAMP ORDER BY expires_at LIMIT ?",
+                    (limit - len(deleted),)
+                )
+                rows = cursor.fetchall()
+                if rows:
+                    cursor.execute(f"DELETE FROM links WHERE id IN ({','.join('?' * len(rows))})", [row[0] for row in rows])
+            deleted += [short_url_hash for _, short_url_hash, _ in rows]
+            self._release_original_url_hashes([original_url_hash for _, _, original_url_hash in rows if original_url_hash])
+        return deleted
+
+    def set_links_banned(self, banned: bool, short_urls: list[str], hosts: list[str]) -> list[tuple[str, str | None]]:
+        """
+        Блокирует или разблокирует ссылки по коротким URL и по хостам оригинальных URL
+        одной транзакцией в каждом шарде.
+        Ссылки по хосту ищутся по индексу host_hash, оригинальные URL не расшифровываются.
 
-    def add_click_on_link(self, link_id: int, metadata: str):
+        :param banned: True для блокировки, False для разблокировки
+        :param short_urls: Короткие URL
+        :param hosts: Хосты оригинальных URL, совпадение точное (поддомены не включаются)
+        :return: Для каждой найденной ссылки кортеж (short_url_hash, original_url_hash)
+        """
+        short_url_hashes = {utils.short_url_lookup_key(short_url) for short_url in short_urls}
+        host_hashes = list({utils.host_lookup_key(host) for host in hosts})
+        query = "SELECT id, short_url_hash, original_url_hash FROM links WHERE {column} IN ({{}})"
+        links = []
+        for number, shard in enumerate(self.shards):
+            shard_short_url_hashes = [
+                short_url_hash for short_url_hash in short_url_hashes if shard_index(short_url_hash, len(self.shards)) == number
+            ]
+            with shard.pool.writer() as cursor:
+                # Выборка и обновление в одной транзакции: другой процесс не изменит ссылки между ними
+                cursor.execute("BEGIN IMMEDIATE")
+                # Возвращаются и ссылки, уже бывшие в нужном состоянии: повтор запроса после ошибки Redis
+                # снова сбросит их из кеша
+                rows = {row[0]: row[1:] for row in self._select_in(
+                    cursor, query.format(column="short_url_hash"), shard_short_url_hashes
+                )}
+                rows.update((row[0], row[1:]) for row in self._select_in(cursor, query.format(column="host_hash"), host_hashes))
+                ids = list(rows)
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    cursor.execute(
+                        f"UPDATE links SET banned = ?, banned_at = {'COALESCE(banned_at, CURRENT_TIMESTAMP)' if banned else 'NULL'} "
+                        f"WHERE id IN ({','.join('?' * len(chunk))})",
+                        [int(banned), *chunk]
+                    )
+            links += rows.values()
+        return links
+
+    def add_click_on_link(self, link_id: int, user_agent: str | None, ip: str | None, referer: str | None = None):
         """
         Регистрирует клик по ссылке в статистике.
 
         :param link_id: ID ссылки, по которой был клик
-        :param metadata: Метаданные клика (User-Agent, IP и т.д.)
+        :param user_agent: Заголовок User-Agent
+        :param ip: IP-адрес клиента
+        :param referer: Заголовок Referer
+        """
+        self.add_clicks([(link_id, user_agent, ip, referer, utils.to_db_timestamp(datetime.now(timezone.utc)))])
+
+    def add_clicks(self, clicks: list[tuple[int, str | None, str | None, str | None, str]]):
+        """
+        Записывает пачку кликов в партиции их периодов, по одной транзакции на партицию.
+        IP хранится упакованным (utils.pack_ip), User-Agent - ссылкой на строку в словаре партиции.
+
+        :param clicks: Список кортежей (id ссылки, User-Agent, IP, Referer, время клика в формате %Y-%m-%d %H:%M:%S)
+        """
+        by_partition: dict[str, list[tuple]] = {}
+        for link_id, user_agent, ip, referer, created_at in clicks:
+            by_partition.setdefault(self.click_partitions.name_for(created_at), []).append(
+                (None, link_id, user_agent, utils.pack_ip(ip), referer, created_at)
+            )
+        for name, rows in by_partition.items():
+            self.click_partitions.get(name).insert_clicks(rows)
+
+    def rollup_clicks(self, limit: int, top_user_agents: int) -> int:
+        """
+        Добавляет в часовые и суточные агрегаты очередную пачку кликов после сохранённых отметок партиций
+        и сдвигает отметку в той же транзакции, поэтому каждый клик учитывается в агрегатах ровно один раз.
+
+        :param limit: Максимальное количество кликов в пачке
+        :param top_user_agents: Сколько самых частых User-Agent хранить в корзине
+        :return: Количество учтённых кликов
+        """
+        marks = self._get_rollup_marks()
+        rolled_up = 0
+        for name in self.click_partitions.names():
+            if rolled_up >= limit:
+                break
+            partition = self.click_partitions.get(name)
+            if partition.get_last_click_id() > marks.get(name, 0):
+                rolled_up += self._rollup_partition(partition, limit - rolled_up, top_user_agents)
+        return rolled_up
+
+    def _rollup_partition(self, partition: ClickPartition, limit: int, top_user_agents: int) -> int:
+        with self.pool.writer() as cursor:
+            # Отметка читается под блокировкой записи, иначе два процесса учтут одну пачку дважды
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT last_click_id FROM click_rollup_state WHERE name = ?", (partition.name,))
+            row = cursor.fetchone()
+            clicks = partition.get_clicks_after(row[0] if row else 0, limit)
+            if not clicks:
+                return 0
+
+            for (link_id, granularity, bucket), added in aggregate_clicks(clicks, top_user_agents).items():
+                cursor.execute(
+                    "SELECT clicks, unique_ips, user_agents FROM click_rollups WHERE link_id = ? AND granularity = ? AND bucket = ?",
+                    (link_id, granularity, bucket,)
+                )
+                row = cursor.fetchone()
+                if row:
+                    stored = ClickBucket(row[0], HyperLogLog.from_bytes(row[1]), decode_user_agents(row[2]))
+                    stored.merge(added, top_user_agents)
+                    added = stored
+                cursor.execute(
+                    "INSERT OR REPLACE INTO click_rollups(link_id, granularity, bucket, clicks, unique_ips, user_agents) "
+                    "VALUES(?,?,?,?,?,?)",
+                    (link_id, granularity, bucket, added.clicks, added.unique_ips.to_bytes(),
+                     encode_user_agents(added.user_agents),)
+                )
+            cursor.execute(
+                "INSERT OR REPLACE INTO click_rollup_state(name, last_click_id) VALUES(?,?)",
+                (partition.name, clicks[-1][0],)
+            )
+        return len(clicks)
+
+    def _get_rollup_marks(self) -> dict[str, int]:
+        """Отметки агрегации: id последнего учтённого клика для каждой партиции."""
+        with self.pool.reader() as cursor:
+            cursor.execute("SELECT name, last_click_id FROM click_rollup_state")
+            return dict(cursor.fetchall())
+
+    def drop_expired_click_partitions(self, keep: int, archive_dir: str | None) -> list[str]:
+        """
+        Удаляет партиции кликов старше keep последних периодов. Удаление партиции - это удаление файла,
+        а не DELETE по индексу, поэтому не зависит от количества кликов.
+        Партиция, клики которой ещё не учтены в агрегатах, пропускается до следующего запуска.
+
+        :param keep: Количество хранимых периодов, включая текущий
+        :param archive_dir: Каталог для выгрузки кликов удаляемых партиций в CSV, сжатый gzip, или None
+        :return: Имена удалённых партиций
         """
-        self.cursor.execute("INSERT INTO clicks(link_id, metadata) VALUES(?,?)", (link_id, metadata,))
-        self.connection.commit()
+        cutoff = self.click_partitions.retention_cutoff(keep, datetime.now(timezone.utc))
+        marks = self._get_rollup_marks()
+        dropped = []
+        for name in self.click_partitions.names():
+            if name >= cutoff:
+                break
+            if self.click_partitions.get(name).get_last_click_id() > marks.get(name, 0):
+                self._logger.warning(f"Click partition {name} is expired but not rolled up yet")
+                continue
+            if not self.click_partitions.drop(name, archive_dir):
+                continue
+            dropped.append(name)
+            # Отметку агрегации удаляет только процесс, удаливший файл партиции
+            with self.pool.writer() as cursor:
+                cursor.execute("DELETE FROM click_rollup_state WHERE name = ?", (name,))
+        return dropped
 
-    def _check_short_urls_pool_filled(self, length):
-        self.cursor.execute("SELECT COUNT(*) FROM links WHERE short_url_length = ?", (length,))
-        return self.cursor.fetchone()[0] >= length ** len(utils.charset_for_string_generate)
+    def get_link_click_stats(self, short_url: str, granularity: str, since: datetime, until: datetime,
+                             top_user_agents: int) -> dict | None:
+        """
+        Статистика кликов по ссылке из агрегатов: O(корзин за период), без чтения самих кликов.
+        Клики, ещё не учтённые фоновой агрегацией, в статистику не попадают.
+
+        :param short_url: Короткий URL
+        :param granularity: Размер корзины: hour или day
+        :param since: Начало периода, округляется вниз до начала корзины
+        :param until: Конец периода (не включительно)
+        :param top_user_agents: Сколько самых частых User-Agent вернуть
+        :return: Словарь clicks, unique_ips, top_user_agents и buckets (bucket, clicks, unique_ips)
+            или None, если ссылка не найдена
+        """
+        since = bucket_start(utils.to_utc(since), granularity)
+        short_url_hash = utils.short_url_lookup_key(short_url)
+        with self._shard_pool(short_url_hash).reader() as cursor:
+            cursor.execute("SELECT id FROM links WHERE short_url_hash = ?", (short_url_hash,))
+            link = cursor.fetchone()
+        if not link:
+            return None
+        with self.pool.reader() as cursor:
+            cursor.execute(
+                "SELECT bucket, clicks, unique_ips, user_agents FROM click_rollups "
+                "WHERE link_id = ? AND granularity = ? AND bucket >= ? AND bucket < ? ORDER BY bucket",
+                (link[0], granularity, utils.to_db_timestamp(since), utils.to_db_timestamp(until),)
+            )
+            rows = cursor.fetchall()
+
+        total = ClickBucket()
+        buckets = []
+        for bucket, clicks, unique_ips, user_agents in rows:
+            stored = ClickBucket(clicks, HyperLogLog.from_bytes(unique_ips), decode_user_agents(user_agents))
+            buckets.append({"bucket": bucket, "clicks": clicks, "unique_ips": stored.unique_ips.count()})
+            total.clicks += stored.clicks
+            total.unique_ips.merge(stored.unique_ips)
+            for user_agent, count in stored.user_agents.items():
+                total.user_agents[user_agent] = total.user_agents.get(user_agent, 0) + count
+        return {
+            "granularity": granularity,
+            "since": utils.to_db_timestamp(since),
+            "until": utils.to_db_timestamp(until),
+            "bucket_seconds": int(bucket_step(granularity).total_seconds()),
+            "clicks": total.clicks,
+            "unique_ips": total.unique_ips.count(),
+            "top_user_agents": [
+                {"user_agent": user_agent, "clicks": count}
+                for user_agent, count in top_counts(total.user_agents, top_user_agents).items()
+            ],
+            "buckets": buckets,
+        }
+
+    def get_short_url_pool_stats(self) -> list[dict]:
+        """
+        Заполненность пространства коротких кодов по длинам.
+
+        :return: Список словарей length, used, capacity, fill_ratio, pooled (свободных кодов в пуле процесса)
+        """
+        used_by_length: dict[int, int] = {}
+        for shard in self.shards:
+            with shard.pool.reader() as cursor:
+                cursor.execute("SELECT length, used FROM short_url_pool_stats")
+                for length, used in cursor.fetchall():
+                    used_by_length[length] = used_by_length.get(length, 0) + used
+        allocator_stats = self.short_url_allocator.stats()
+        stats = []
+        for length, used in sorted(used_by_length.items()):
+            capacity = len(utils.charset_for_string_generate) ** length
+            stats.append({
+                "length": length,
+                "used": used,
+                "capacity": capacity,
+                "fill_ratio": used / capacity,
+                "pooled": allocator_stats.get(length, {}).get("pool", 0),
+            })
+        return stats
+
+    def refill_short_url_pools(self):
+        """Пополняет заканчивающиеся пулы свободных коротких кодов."""
+        self.short_url_allocator.refill_low_pools()
+
+    def reserve_link_id_ranges(self):
+        """
+        Ставит счётчик id ссылок каждого шарда на максимальный id его диапазона
+        [номер шарда * SHARD_ID_RANGE, (номер шарда + 1) * SHARD_ID_RANGE) среди всех шардов
+        или на начало диапазона, если таких ссылок нет, чтобы id ссылок не пересекались между шардами.
+        Ссылки, перенесённые из другого шарда, сохраняют id чужого диапазона: вставка с явным id сдвигает
+        счётчик AUTOINCREMENT, и без этого шард выдавал бы id из диапазона другого шарда.
+        Вызывается DatabaseMigrator после миграции шардов и после переноса ссылок.
+        """
+        starts = [number * SHARD_ID_RANGE for number in range(len(self.shards))]
+        sequences = list(starts)
+        for shard in self.shards:
+            with shard.pool.reader() as cursor:
+                for number, start in enumerate(starts):
+                    cursor.execute("SELECT MAX(id) FROM links WHERE id >= ? AND id < ?", (start, start + SHARD_ID_RANGE,))
+                    max_id = cursor.fetchone()[0]
+                    if max_id is not None:
+                        sequences[number] = max(sequences[number], max_id)
+        for shard, sequence in zip(self.shards, sequences):
+            with shard.pool.writer() as cursor:
+                cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'links'")
+                cursor.execute("INSERT INTO sqlite_sequence(name, seq) VALUES('links', ?)", (sequence,))
+
+    def rebalance_shards(self, batch_size: int = 1000) -> int:
+        """
+        Переносит ссылки в шарды, соответствующие текущему DB_SHARDS, с сохранением id.
+        Пачка сначала записывается в новый шард и только затем удаляется из старого, поэтому прерванный
+        перенос можно безопасно повторить. Файлы шардов сверх DB_SHARDS после переноса удаляются.
+        Выполняется при остановленном сервисе: пока ссылки переносятся, часть из них ищется не в том шарде.
+
+        :param batch_size: Количество ссылок, читаемых из шарда за один запрос
+        :return: Количество перенесённых ссылок
+        """
+        db_filename = self._config.db_filename.get_secret_value()
+        moved = 0
+        for source in existing_shards(db_filename):
+            if source < len(self.shards):
+                pool = self.shards[source].pool
+            else:
+                pool = ConnectionPool(shard_filename(db_filename, source), self._config)
+            moved += self._move_foreign_links(source, pool, batch_size)
+            if source < len(self.shards):
+                continue
+
+            with pool.reader() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM links")
+                left = cursor.fetchone()[0]
+            pool.close()
+            if left:
+                self._logger.warning(f"Shard {source} still has {left} links and is kept")
+                continue
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(shard_filename(db_filename, source) + suffix):
+                    os.remove(shard_filename(db_filename, source) + suffix)
+        self.reserve_link_id_ranges()
+        return moved
+
+    def _move_foreign_links(self, source: int, pool: ConnectionPool, batch_size: int) -> int:
+        moved = last_id = 0
+        while True:
+            with pool.reader() as cursor:
+                cursor.execute("SELECT * FROM links WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size,))
+                rows = cursor.fetchall()
+                columns = [column[0] for column in cursor.description]
+            if not rows:
+                return moved
+            last_id = rows[-1][0]
+
+            by_target: dict[int, list[tuple]] = {}
+            for row in rows:
+                target = shard_index(row[columns.index("short_url_hash")], len(self.shards))
+                if target != source:
+                    by_target.setdefault(target, []).append(row)
+
+            copied = []
+            for target, target_rows in by_target.items():
+                ids = [row[0] for row in target_rows]
+                with self.shards[target].pool.writer() as cursor:
+                    cursor.executemany(
+                        f"INSERT OR IGNORE INTO links({','.join(columns)}) VALUES({','.join('?' * len(columns))})", target_rows
+                    )
+                    found = {row[0] for row in self._select_in(cursor, "SELECT id FROM links WHERE id IN ({})", ids)}
+                for link_id in ids:
+                    if link_id in found:
+                        copied.append(link_id)
+                    else:
+                        # В шарде назначения уже есть ссылка на тот же URL, созданная параллельно
+                        self._logger.warning(f"Link {link_id} conflicts with shard {target}, kept in shard {source}")
+            if copied:
+                with pool.writer() as cursor:
+                    for i in range(0, len(copied), 500):
+                        chunk = copied[i:i + 500]
+                        cursor.execute(f"DELETE FROM links WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                moved += len(copied)
+                self._logger.info(f"Shard {source}: {moved} links moved")
+
+    def close(self):
+        """Закрывает соединения всех шардов и партиций кликов."""
+        for shard in self.shards:
+            shard.pool.close()
+        self.click_partitions.close()
+
+    @staticmethod
+    def _select_in(cursor: sqlite3.Cursor, query: str, values: list) -> list[tuple]:
+        """
+        Выполняет запрос с условием IN для длинного списка значений, разбивая его на части по 500.
+
+        :param cursor: Курсор, через который выполняется запрос
+        :param query: Запрос с {} на месте списка параметров IN
+        :param values: Значения для IN
+        """
+        rows = []
+        for i in range(0, len(values), 500):
+            chunk = values[i:i + 500]
+            cursor.execute(query.format(','.join('?' * len(chunk))), chunk)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    def _shard_pool(self, short_url_hash: str) -> ConnectionPool:
+        """Пул соединений шарда, в котором хранится ссылка с ключом поиска short_url_hash."""
+        return self.shards[shard_index(short_url_hash, len(self.shards))].pool
+
+    def _claim_original_url_hashes(self, original_url_hashes: list[str]) -> set[str]:
+        """
+        Занимает ключи оригинальных URL в таблице original_url_claims основной базы перед вставкой ссылок.
+        Уникальный индекс links.original_url_hash действует только внутри шарда, а первичный ключ
+        одной таблицы не даёт двум процессам одновременно создать ссылки на один URL в разных шардах.
+        Брошенная заявка без ссылки старше ORIGINAL_URL_CLAIM_TIMEOUT занимается заново.
+
+        :param original_url_hashes: Ключи оригинальных URL (original_url_lookup_key) без повторов
+        :return: Ключи, занятые этим вызовом
+        """
+        claimed = set()
+        taken = []
+        with self.pool.writer() as cursor:
+            for original_url_hash in original_url_hashes:
+                try:
+                    cursor.execute("INSERT INTO original_url_claims(original_url_hash) VALUES(?)", (original_url_hash,))
+                    claimed.add(original_url_hash)
+                except sqlite3.IntegrityError:
+                    taken.append(original_url_hash)
+        if not taken:
+            return claimed
+
+        stale_condition = f"claimed_at <= datetime('now', '-{ORIGINAL_URL_CLAIM_TIMEOUT} seconds')"
+        with self.pool.reader() as cursor:
+            stale = {row[0] for row in self._select_in(
+                cursor, f"SELECT original_url_hash FROM original_url_claims WHERE original_url_hash IN ({{}}) AND {stale_condition}",
+                taken
+            )}
+        stale -= self._find_existing_original_url_hashes(list(stale))
+        if not stale:
+            return claimed
+        with self.pool.writer() as cursor:
+            for original_url_hash in stale:
+                # Условие повторяется в UPDATE: брошенную заявку занимает только один процесс
+                cursor.execute(
+                    f"UPDATE original_url_claims SET claimed_at = CURRENT_TIMESTAMP WHERE original_url_hash = ? AND {stale_condition}",
+                    (original_url_hash,)
+                )
+                if cursor.rowcount:
+                    claimed.add(original_url_hash)
+        return claimed
+
+    def _release_original_url_hashes(self, original_url_hashes: list[str]):
+        """Снимает заявки на оригинальные URL удалённых или не созданных ссылок."""
+        if not original_url_hashes:
+            return
+        with self.pool.writer() as cursor:
+            for i in range(0, len(original_url_hashes), 500):
+                chunk = original_url_hashes[i:i + 500]
+                cursor.execute(f"DELETE FROM original_url_claims WHERE original_url_hash IN ({','.join('?' * len(chunk))})", chunk)
+
+    def _find_existing_original_url_hashes(self, original_url_hashes: list[str]) -> set[str]:
+        existing = set()
+        for shard in self.shards:
+            with shard.pool.reader() as cursor:
+                existing.update(row[0] for row in self._select_in(
+                    cursor, "SELECT original_url_hash FROM links WHERE original_url_hash IN ({})", original_url_hashes
+                ))
+        return existing
+
+    def _find_used_short_url_hashes(self, short_url_hashes: list[str]) -> set[str]:
+        by_shard: dict[int, list[str]] = {}
+        for short_url_hash in short_url_hashes:
+            by_shard.setdefault(shard_index(short_url_hash, len(self.shards)), []).append(short_url_hash)
+        used = set()
+        for shard, hashes in by_shard.items():
+            with self.shards[shard].pool.reader() as cursor:
+                used.update(row[0] for row in self._select_in(
+                    cursor, "SELECT short_url_hash FROM links WHERE short_url_hash IN ({})", hashes
+                ))
+        return used
+
+    def _check_short_urls_pool_filled(self, length) -> bool:
+        used = 0
+        for shard in self.shards:
+            with shard.pool.reader() as cursor:
+                cursor.execute("SELECT used FROM short_url_pool_stats WHERE length = ?", (length,))
+                result = cursor.fetchone()
+            used += result[0] if result else 0
+        return used >= len(utils.charset_for_string_generate) ** length
 
     def _generate_short_url(self, length: int) -> str:
         if self._check_short_urls_pool_filled(length):
             raise ThisLengthPoolFilled("Pool of short urls with that length is filled")
-        while True:
-            short_url = utils.generate_random_string(length)
-            if not self.get_link_by_short_url(short_url):
-                return short_url
+        short_url = self.short_url_allocator.take(length)
+        if short_url is None:
+            raise ThisLengthPoolFilled("Pool of short urls with that length is filled")
+        return short_url
+
+
+class AsyncDatabase:
+    """
+    Асинхронная обёртка над Database.
+    Запросы к SQLite выполняются в пуле потоков, чтобы не блокировать event loop.
+    Потоков столько же, сколько соединений во всех шардах Database: чтения идут параллельно,
+    записи в один шард по очереди.
+    """
+    def __init__(self, db: Database):
+        self._db = db
+        self._executor = ThreadPoolExecutor(
+            max_workers=(db.pool.readers_count + 1) * len(db.shards), thread_name_prefix="sqlite"
+        )
+
+    @property
+    def shards_count(self) -> int:
+        """Количество шардов ссылок."""
+        return len(self._db.shards)
+
+    async def get_link_by_short_url(self, short_url: str) -> Link | None:
+        """Асинхронный вариант Database.get_link_by_short_url"""
+        return await self._run(self._db.get_link_by_short_url, short_url)
+
+    async def get_redirect_target(self, short_url: str) -> LinkTarget | None:
+        """Асинхронный вариант Database.get_redirect_target"""
+        return await self._run(self._db.get_redirect_target, short_url)
+
+    async def get_all_links(self) -> list[list[str]]:
+        """Асинхронный вариант Database.get_all_links, шарды читаются параллельно"""
+        chunks = await asyncio.gather(*(self._run(self._db.get_all_links, shard) for shard in range(self.shards_count)))
+        return [link for chunk in chunks for link in chunk]
+
+    async def get_active_links_chunk(self, after_id: int, limit: int,
+                                     shard: int | None = None) -> list[tuple[int, str, str, str | None]]:
+        """Асинхронный вариант Database.get_active_links_chunk, без номера шарда шарды читаются параллельно"""
+        if shard is not None:
+            return await self._run(self._db.get_active_links_chunk, after_id, limit, shard)
+        chunks = await asyncio.gather(*(
+            self._run(self._db.get_active_links_chunk, after_id, limit, shard) for shard in range(self.shards_count)
+        ))
+        return merge_links_chunks(chunks, limit)
+
+    async def get_active_links_by_hashes(self, short_url_hashes: list[str]) -> list[tuple[int, str, str, str | None]]:
+        """Асинхронный вариант Database.get_active_links_by_hashes"""
+        return await self._run(self._db.get_active_links_by_hashes, short_url_hashes)
+
+    async def create_link(self, original_url: str, short_length: int, expires_at: datetime | None = None) -> tuple[int, str]:
+        """Асинхронный вариант Database.create_link"""
+        return await self._run(self._db.create_link, original_url, short_length, expires_at)
+
+    async def create_links(self, links: list[tuple[str, int, datetime | None]]) -> list[tuple[int, str, str] | Exception]:
+        """Асинхронный вариант Database.create_links"""
+        return await self._run(self._db.create_links, links)
+
+    async def rollup_clicks(self, limit: int, top_user_agents: int) -> int:
+        """Асинхронный вариант Database.rollup_clicks"""
+        return await self._run(self._db.rollup_clicks, limit, top_user_agents)
+
+    async def get_link_click_stats(self, short_url: str, granularity: str, since: datetime, until: datetime,
+                                   top_user_agents: int) -> dict | None:
+        """Асинхронный вариант Database.get_link_click_stats"""
+        return await self._run(self._db.get_link_click_stats, short_url, granularity, since, until, top_user_agents)
+
+    async def get_short_url_pool_stats(self) -> list[dict]:
+        """Асинхронный вариант Database.get_short_url_pool_stats"""
+        return await self._run(self._db.get_short_url_pool_stats)
 
+    async def refill_short_url_pools(self):
+        """Асинхронный вариант Database.refill_short_url_pools"""
+        return await self._run(self._db.refill_short_url_pools)
+
+    async def delete_expired_links(self, limit: int) -> list[str]:
+        """Асинхронный вариант Database.delete_expired_links"""
+        return await self._run(self._db.delete_expired_links, limit)
+
+    async def set_links_banned(self, banned: bool, short_urls: list[str], hosts: list[str]) -> list[tuple[str, str | None]]:
+        """Асинхронный вариант Database.set_links_banned"""
+        return await self._run(self._db.set_links_banned, banned, short_urls, hosts)
+
+    async def add_click_on_link(self, link_id: int, user_agent: str | None, ip: str | None, referer: str | None = None):
+        """Асинхронный вариант Database.add_click_on_link"""
+        return await self._run(self._db.add_click_on_link, link_id, user_agent, ip, referer)
+
+    async def get_links_by_original_urls(self, original_urls: list[str]) -> dict[str, tuple[int, str, datetime | None]]:
+        """Асинхронный вариант Database.get_links_by_original_urls"""
+        return await self._run(self._db.get_links_by_original_urls, original_urls)
+
+    async def drop_expired_click_partitions(self, keep: int, archive_dir: str | None) -> list[str]:
+        """Асинхронный вариант Database.drop_expired_click_partitions"""
+        return await self._run(self._db.drop_expired_click_partitions, keep, archive_dir)
+
+    async def add_clicks(self, clicks: list[tuple[int, str | None, str | None, str | None, str]]):
+        """Асинхронный вариант Database.add_clicks"""
+        return await self._run(self._db.add_clicks, clicks)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+
+# Миграции схемы кликов. Клики и их агрегаты хранятся только в основной базе и партициях,
+# поэтому в шардах ссылок эти миграции только отмечаются применёнными
+CLICK_MIGRATIONS = {6, 7, 8}
+# Миграции таблиц только основной базы: кликов и заявок на оригинальные URL (original_url_claims)
+MAIN_DATABASE_MIGRATIONS = CLICK_MIGRATIONS | {11}
+# Таблицы кликов, которые удаляются из шардов: clicks создаётся ещё миграцией 1_initial
+CLICK_TABLES = ("click_rollups", "click_rollup_state", "user_agents", "clicks")
 
 
 class DatabaseMigrator:
@@ -100,85 +877,155 @@ class DatabaseMigrator:
     Класс для выполнения миграций с БД
     TODO: пока не реализован откат миграции при ошибке в каком-то её запросе (SQLite не позволяет закинуть пачку запросов и автоматом её откатить в случае ошибки)
     """
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, migrations_dir: str = "migrations", links_shard: bool = False):
+        """
+        :param db: База данных или партиция кликов: объект с пулом соединений в атрибуте pool
+        :param migrations_dir: Каталог миграций относительно пакета database:
+            migrations для основной базы, migrations/partitions для партиций кликов
+        :param links_shard: База - дополнительный шард ссылок: миграции таблиц основной базы
+            (MAIN_DATABASE_MIGRATIONS) не применяются
+        """
         self._db = db
-        self._migrations_dir = os.path.dirname(os.path.realpath(__file__))+"/migrations/"
+        self._links_shard = links_shard
+        self._migrations_dir = os.path.dirname(os.path.realpath(__file__))+f"/{migrations_dir}/"
         self._logger= logging.getLogger(self.__class__.__name__)
         try:
             self._get_current_version()
         except sqlite3.OperationalError:
             self._create_migrations_table()
+        # Шарды ссылок проходят те же версии, что и основная база, но без таблиц кликов
+        self._shard_migrators = [
+            DatabaseMigrator(shard, migrations_dir, links_shard=True) for shard in getattr(db, "shards", [db])[1:]
+        ]
 
     def upgrade(self, version: int = 0):
         if version == 0:
             version = int(self._get_migrations_files()[-1].split("_")[0])
 
         migrations_files = self._get_needed_migrations_files(version)
-        if not migrations_files:
-            raise FileNotFoundError(f"The database is already the latest version")
-
         for migration_file in migrations_files:
             self._upgrade_to_version(migration_file)
+        if self._links_shard:
+            self._drop_click_tables()
+
+        # Новый шард мигрируется и тогда, когда основная база уже последней версии
+        shards_upgraded = self._migrate_shards("upgrade", version)
+        if self._shard_migrators:
+            self._db.reserve_link_id_ranges()
+        if not migrations_files and not shards_upgraded:
+            raise FileNotFoundError(f"The database is already the latest version")
 
     def downgrade(self, version: int = 0):
         migrations_files = self._get_needed_migrations_files(version, is_downgrade=True)
-        if not migrations_files:
-            raise FileNotFoundError(f"The database is already downgraded to version {version}")
-
         for migration_file in migrations_files:
             self._downgrade_to_version(migration_file)
 
-    def _upgrade_to_version(self, migration_filename: str):
-        upgrade_code = self._get_migration_code(migration_filename).split("--- downgrade")[0]
-        upgrade_queries = []
-        for query in upgrade_code.split(';'):
-            query = query.strip()
-            if query:
-                upgrade_queries.append(query)
+        if not self._migrate_shards("downgrade", version) and not migrations_files:
+            raise FileNotFoundError(f"The database is already downgraded to version {version}")
 
-        self._execute_migration_code(upgrade_queries, migration_filename)
+    def _migrate_shards(self, action: str, version: int) -> bool:
+        """
+        Применяет upgrade или downgrade к шардам ссылок.
 
+        :return: True, если хотя бы один шард был изменён
+        """
+        migrated = False
+        for migrator in self._shard_migrators:
+            try:
+                getattr(migrator, action)(version)
+                migrated = True
+            except FileNotFoundError:
+                pass
+        return migrated
+
+    def _drop_click_tables(self):
+        """Удаляет из шарда ссылок таблицы кликов, созданные 1_initial или миграциями прежних версий."""
+        for table in CLICK_TABLES:
+            with self._db.pool.writer() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+    def _skips(self, migration_version: int) -> bool:
+        return self._links_shard and migration_version in MAIN_DATABASE_MIGRATIONS
+
+    def _upgrade_to_version(self, migration_filename: str):
         migration_name = migration_filename.split("_")[-1].replace(".sql", "")
         migration_version = int(migration_filename.split("_")[0])
-        self._db.cursor.execute(
-            "INSERT INTO migrations(number,name) VALUES(?,?)",
-            (migration_version, migration_name)
-        )
-        self._db.connection.commit()
+        if not self._skips(migration_version):
+            upgrade_code = self._get_migration_code(migration_filename).split("--- downgrade")[0]
+            self._execute_migration_code(self._split_queries(upgrade_code), migration_filename)
+            self._execute_migration_script(migration_filename, "upgrade")
+
+        with self._db.pool.writer() as cursor:
+            cursor.execute(
+                "INSERT INTO migrations(number,name) VALUES(?,?)",
+                (migration_version, migration_name)
+            )
 
     def _downgrade_to_version(self, migration_filename: str):
-        downgrade_code = self._get_migration_code(migration_filename).split("--- downgrade")[-1]
-        downgrade_queries = []
-        for query in downgrade_code.split(';'):
-            query = query.strip()
-            if query:
-                downgrade_queries.append(query)
+        migration_version = int(migration_filename.split("_")[0])
+        if not self._skips(migration_version):
+            downgrade_code = self._get_migration_code(migration_filename).split("--- downgrade")[-1]
+            self._execute_migration_script(migration_filename, "downgrade")
+            self._execute_migration_code(self._split_queries(downgrade_code), migration_filename)
 
-        self._execute_migration_code(downgrade_queries, migration_filename)
+        with self._db.pool.writer() as cursor:
+            cursor.execute(
+                "DELETE FROM migrations WHERE number = ?",
+                (migration_version,)
+            )
 
-        migration_version = int(migration_filename.split("_")[0])
-        self._db.cursor.execute(
-            "DELETE FROM migrations WHERE number = ?",
-            (migration_version,)
-        )
-        self._db.connection.commit()
+    @staticmethod
+    def _split_queries(code: str) -> list[str]:
+        """Разбивает код миграции на запросы по ';' с учётом ';' внутри триггеров (BEGIN ... END)."""
+        queries = []
+        query = ""
+        for part in code.split(';'):
+            query += part + ";"
+            if sqlite3.complete_statement(query):
+                if query.strip(" \n;"):
+                    queries.append(query.strip())
+                query = ""
+        return queries
 
     def _execute_migration_code(self, code: list[str], migration_filename: str):
         for query in code:
             try:
-                self._db.cursor.execute(query)
+                with self._db.pool.writer() as cursor:
+                    cursor.execute(query)
                 self._logger.info(query)
             except sqlite3.OperationalError as e:
                 raise MigrationError(f"Upgrade to {migration_filename} error:\n" + e.__str__())
 
+    def _execute_migration_script(self, migration_filename: str, action: str):
+        """
+        Выполняет python-часть миграции (например, заполнение новой колонки), если она есть.
+        Файл лежит рядом с .sql и называется так же, функции upgrade(db)/downgrade(db) необязательны.
+        """
+        script_path = self._migrations_dir + migration_filename.replace(".sql", ".py")
+        if not os.path.exists(script_path):
+            return
+
+        spec = importlib.util.spec_from_file_location(migration_filename.replace(".sql", ""), script_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        if not hasattr(module, action):
+            return
+
+        try:
+            getattr(module, action)(self._db)
+            self._logger.info(f"{migration_filename}: {action} script")
+        except (sqlite3.Error, ValueError) as e:
+            raise MigrationError(f"Script of {migration_filename} error:\n" + e.__str__())
+
     def _get_migration_code(self, migration_filename: str):
         with open(self._migrations_dir+migration_filename, "r") as f:
             return f.read()
 
     def _get_current_version(self):
         try:
-            self._db.cursor.execute("SELECT number FROM migrations ORDER BY number DESC LIMIT 1")
-            return self._db.cursor.fetchone()[0]
+            with self._db.pool.writer() as cursor:
+                cursor.execute("SELECT number FROM migrations ORDER BY number DESC LIMIT 1")
+                return cursor.fetchone()[0]
         except IndexError:
             return 0
         except TypeError:
@@ -192,10 +1039,10 @@ class DatabaseMigrator:
             if file.endswith(".sql"):
                 migrations.append(file)
 
-        migrations.sort()
+        migrations.sort(key=lambda x: int(x.split("_")[0]))
         return migrations
 
-    def _get_needed_migrations_files(self, version: int = 0, is_downgrade: bool = False) -> set[str] | None:
+    def _get_needed_migrations_files(self, version: int = 0, is_downgrade: bool = False) -> list[str] | None:
         files = set()
         current_version = self._get_current_version()
 
@@ -212,12 +1059,13 @@ class DatabaseMigrator:
         sorted_files = sorted(files, key=lambda x: int(x.split("_")[0]))
 
         if is_downgrade:
-            return set(sorted_files[::-1])
+            return sorted_files[::-1]
 
-        return set(sorted_files)
+        return sorted_files
 
     def _create_migrations_table(self):
-        self._db.cursor.execute("""CREATE TABLE migrations(
+        with self._db.pool.writer() as cursor:
+            cursor.execute("""CREATE TABLE migrations(
     number INTEGER PRIMARY KEY,
     name TEXT NOT NULL UNIQUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -228,5 +1076,3 @@ class DatabaseMigrator:
 class MigrationError(Exception): pass
 class ShortLinkWithThatUrlAlreadyExists(Exception): pass
 class ThisLengthPoolFilled(Exception): pass
-
-database = Database()
@@ -0,0 +1,26 @@
+"""
+Заполняет host_hash для уже существующих ссылок пачками.
+"""
+import utils
+
+BATCH_SIZE = 1000
+
+
+def upgrade(db):
+    last_id = 0
+    while True:
+        with db.pool.writer() as cursor:
+            cursor.execute(
+                "SELECT id, original_url FROM links WHERE id > ? AND host_hash IS NULL ORDER BY id LIMIT ?",
+                (last_id, BATCH_SIZE)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            cursor.executemany(
+                "UPDATE links SET host_hash = ? WHERE id = ?",
+                [(utils.host_lookup_key(utils.url_host(utils.decrypt_aes256_base64_bytes(original_url))), link_id)
+                 for link_id, original_url in rows]
+            )
+        last_id = rows[-1][0]
@@ -0,0 +1,11 @@
+--- upgrade
+ALTER TABLE links
+    ADD COLUMN host_hash TEXT;
+
+CREATE INDEX idx_links_host_hash ON links(host_hash);
+
+--- downgrade
+DROP INDEX IF EXISTS idx_links_host_hash;
+
+ALTER TABLE links
+    DROP COLUMN host_hash;
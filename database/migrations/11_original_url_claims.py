@@ -0,0 +1,31 @@
+"""
+Заполняет original_url_claims ключами оригинальных URL уже существующих ссылок всех шардов пачками.
+Шарды мигрируются после основной базы, новый шард без таблицы links пропускается.
+"""
+BATCH_SIZE = 1000
+
+
+def upgrade(db):
+    for shard in getattr(db, "shards", [db]):
+        with shard.pool.reader() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'links'")
+            if cursor.fetchone() is None:
+                continue
+        last_id = 0
+        while True:
+            with shard.pool.reader() as cursor:
+                cursor.execute(
+                    "SELECT id, original_url_hash FROM links WHERE id > ? AND original_url_hash IS NOT NULL "
+                    "ORDER BY id LIMIT ?",
+                    (last_id, BATCH_SIZE)
+                )
+                rows = cursor.fetchall()
+            if not rows:
+                break
+
+            with db.pool.writer() as cursor:
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO original_url_claims(original_url_hash) VALUES(?)",
+                    [(original_url_hash,) for _, original_url_hash in rows]
+                )
+            last_id = rows[-1][0]
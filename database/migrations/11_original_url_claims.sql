@@ -0,0 +1,8 @@
+--- upgrade
+CREATE TABLE original_url_claims (
+    original_url_hash TEXT PRIMARY KEY,
+    claimed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+--- downgrade
+DROP TABLE IF EXISTS original_url_claims;
@@ -0,0 +1,23 @@
+"""Заполняет short_url_hash для уже существующих ссылок пачками."""
+import utils
+
+BATCH_SIZE = 1000
+
+
+def upgrade(db):
+    last_id = 0
+    while True:
+        with db.pool.writer() as cursor:
+            cursor.execute(
+                "SELECT id, short_url FROM links WHERE id > ? AND short_url_hash IS NULL ORDER BY id LIMIT ?",
+                (last_id, BATCH_SIZE)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            cursor.executemany(
+                "UPDATE links SET short_url_hash = ? WHERE id = ?",
+                [(utils.short_url_lookup_key(utils.decrypt_aes256_base64_bytes(short_url)), link_id) for link_id, short_url in rows]
+            )
+        last_id = rows[-1][0]
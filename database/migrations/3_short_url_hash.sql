@@ -0,0 +1,11 @@
+--- upgrade
+ALTER TABLE links
+    ADD COLUMN short_url_hash TEXT;
+
+CREATE UNIQUE INDEX idx_links_short_url_hash ON links(short_url_hash);
+
+--- downgrade
+DROP INDEX IF EXISTS idx_links_short_url_hash;
+
+ALTER TABLE links
+    DROP COLUMN short_url_hash;
\ No newline at end of file
@@ -0,0 +1,24 @@
+--- upgrade
+CREATE TABLE short_url_pool_stats(
+    length INTEGER PRIMARY KEY,
+    used INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO short_url_pool_stats(length, used)
+SELECT short_url_length, COUNT(*) FROM links GROUP BY short_url_length;
+
+CREATE TRIGGER trg_links_pool_stats_insert AFTER INSERT ON links
+BEGIN
+    INSERT INTO short_url_pool_stats(length, used) VALUES(NEW.short_url_length, 1)
+        ON CONFLICT(length) DO UPDATE SET used = used + 1;
+END;
+
+CREATE TRIGGER trg_links_pool_stats_delete AFTER DELETE ON links
+BEGIN
+    UPDATE short_url_pool_stats SET used = used - 1 WHERE length = OLD.short_url_length;
+END;
+
+--- downgrade
+DROP TRIGGER IF EXISTS trg_links_pool_stats_delete;
+DROP TRIGGER IF EXISTS trg_links_pool_stats_insert;
+DROP TABLE IF EXISTS short_url_pool_stats;
\ No newline at end of file
@@ -0,0 +1,5 @@
+--- upgrade
+CREATE INDEX idx_links_expires_at ON links(expires_at) WHERE expires_at IS NOT NULL;
+
+--- downgrade
+DROP INDEX IF EXISTS idx_links_expires_at;
\ No newline at end of file
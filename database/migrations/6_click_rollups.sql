@@ -0,0 +1,22 @@
+--- upgrade
+CREATE TABLE click_rollups(
+    link_id INTEGER NOT NULL,
+    granularity TEXT NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    clicks INTEGER NOT NULL DEFAULT 0,
+    unique_ips BLOB NOT NULL,
+    user_agents TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (link_id, granularity, bucket),
+    FOREIGN KEY (link_id) REFERENCES links(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE TABLE click_rollup_state(
+    name TEXT PRIMARY KEY,
+    last_click_id INTEGER NOT NULL
+);
+
+INSERT INTO click_rollup_state(name, last_click_id) VALUES('clicks', 0);
+
+--- downgrade
+DROP TABLE IF EXISTS click_rollup_state;
+DROP TABLE IF EXISTS click_rollups;
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""
+Переносит метаданные кликов из текстовой колонки metadata в колонки user_agent_id и ip пачками
+и удаляет metadata. Откат собирает metadata обратно из колонок.
+"""
+import utils
+from database.partitions import intern_user_agents
+
+BATCH_SIZE = 1000
+
+
+def upgrade(db):
+    last_id = 0
+    while True:
+        with db.pool.writer() as cursor:
+            cursor.execute(
+                "SELECT id, metadata FROM clicks WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, BATCH_SIZE)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            parsed = [(click_id, *utils.parse_click_metadata(metadata)) for click_id, metadata in rows]
+            user_agent_ids = intern_user_agents(cursor, {user_agent for _, user_agent, _ in parsed if user_agent})
+            cursor.executemany(
+                "UPDATE clicks SET user_agent_id = ?, ip = ? WHERE id = ?",
+                [(user_agent_ids.get(user_agent), utils.pack_ip(ip), click_id) for click_id, user_agent, ip in parsed]
+            )
+        last_id = rows[-1][0]
+
+    with db.pool.writer() as cursor:
+        cursor.execute("ALTER TABLE clicks DROP COLUMN metadata")
+
+
+def downgrade(db):
+    with db.pool.writer() as cursor:
+        cursor.execute("ALTER TABLE clicks ADD COLUMN metadata TEXT")
+
+    last_id = 0
+    while True:
+        with db.pool.writer() as cursor:
+            cursor.execute(
+                "SELECT clicks.id, user_agents.value, ip FROM clicks "
+                "LEFT JOIN user_agents ON user_agents.id = clicks.user_agent_id "
+                "WHERE clicks.id > ? ORDER BY clicks.id LIMIT ?",
+                (last_id, BATCH_SIZE)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            cursor.executemany(
+                "UPDATE clicks SET metadata = ? WHERE id = ?",
+                [
+                    ("User-Agent: " + (user_agent or "") + "\nIP: " + (utils.unpack_ip(ip) or ""), click_id)
+                    for click_id, user_agent, ip in rows
+                ]
+            )
+        last_id = rows[-1][0]
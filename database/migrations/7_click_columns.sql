@@ -0,0 +1,26 @@
+--- upgrade
+CREATE TABLE user_agents(
+    id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL UNIQUE
+);
+
+ALTER TABLE clicks
+    ADD COLUMN user_agent_id INTEGER;
+
+ALTER TABLE clicks
+    ADD COLUMN ip BLOB;
+
+ALTER TABLE clicks
+    ADD COLUMN referer TEXT;
+
+--- downgrade
+ALTER TABLE clicks
+    DROP COLUMN referer;
+
+ALTER TABLE clicks
+    DROP COLUMN ip;
+
+ALTER TABLE clicks
+    DROP COLUMN user_agent_id;
+
+DROP TABLE IF EXISTS user_agents;
\ No newline at end of file
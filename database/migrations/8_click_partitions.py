@@ -0,0 +1,98 @@
+"""
+Переносит клики из таблицы clicks основной базы в файлы партиций пачками, сохраняя id кликов,
+поэтому отметка агрегации переносится в каждую партицию без изменений. Затем удаляет clicks и user_agents.
+Откат сначала учитывает в агрегатах все клики, затем возвращает их в основную базу и удаляет партиции.
+"""
+from config import ClicksConfig
+from database.partitions import intern_user_agents
+
+BATCH_SIZE = 1000
+
+
+def upgrade(db):
+    with db.pool.reader() as cursor:
+        cursor.execute("SELECT last_click_id FROM click_rollup_state WHERE name = 'clicks'")
+        row = cursor.fetchone()
+    rolled_up_id = row[0] if row else 0
+
+    names = set()
+    last_id = 0
+    while True:
+        with db.pool.reader() as cursor:
+            cursor.execute(
+                "SELECT clicks.id, link_id, user_agents.value, ip, referer, created_at FROM clicks "
+                "LEFT JOIN user_agents ON user_agents.id = clicks.user_agent_id "
+                "WHERE clicks.id > ? ORDER BY clicks.id LIMIT ?",
+                (last_id, BATCH_SIZE)
+            )
+            rows = cursor.fetchall()
+        if not rows:
+            break
+
+        by_partition = {}
+        for row in rows:
+            by_partition.setdefault(db.click_partitions.name_for(row[-1]), []).append(row)
+        for name, clicks in by_partition.items():
+            db.click_partitions.get(name).insert_clicks(clicks)
+        names.update(by_partition)
+        last_id = rows[-1][0]
+
+    with db.pool.writer() as cursor:
+        cursor.executemany(
+            "INSERT OR REPLACE INTO click_rollup_state(name, last_click_id) VALUES(?,?)",
+            [(name, rolled_up_id) for name in names]
+        )
+        cursor.execute("DELETE FROM click_rollup_state WHERE name = 'clicks'")
+    with db.pool.writer() as cursor:
+        cursor.execute("DROP TABLE clicks")
+    with db.pool.writer() as cursor:
+        cursor.execute("DROP TABLE user_agents")
+
+
+def downgrade(db):
+    # id кликов в разных партициях пересекаются, поэтому в общую таблицу клики попадают с новыми id,
+    # а отметка агрегации сдвигается за последний из них
+    while db.rollup_clicks(BATCH_SIZE, ClicksConfig().click_rollup_top_user_agents):
+        pass
+
+    with db.pool.writer() as cursor:
+        cursor.execute("""CREATE TABLE user_agents(
+    id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL UNIQUE
+)""")
+    with db.pool.writer() as cursor:
+        cursor.execute("""CREATE TABLE clicks(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    link_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    user_agent_id INTEGER,
+    ip BLOB,
+    referer TEXT,
+    FOREIGN KEY (link_id) REFERENCES links(id) ON DELETE CASCADE
+)""")
+    with db.pool.writer() as cursor:
+        cursor.execute("CREATE INDEX idx_clicks_created_at ON clicks(created_at)")
+    with db.pool.writer() as cursor:
+        cursor.execute("CREATE INDEX idx_clicks_link_id ON clicks(link_id)")
+
+    for name in db.click_partitions.names():
+        partition = db.click_partitions.get(name)
+        last_id = 0
+        while clicks := partition.get_clicks_after(last_id, BATCH_SIZE):
+            with db.pool.writer() as cursor:
+                user_agent_ids = intern_user_agents(cursor, {click[2] for click in clicks if click[2]})
+                cursor.executemany(
+                    "INSERT INTO clicks(link_id, user_agent_id, ip, referer, created_at) VALUES(?,?,?,?,?)",
+                    [
+                        (link_id, user_agent_ids.get(user_agent), ip, referer, created_at)
+                        for _, link_id, user_agent, ip, referer, created_at in clicks
+                    ]
+                )
+            last_id = clicks[-1][0]
+        db.click_partitions.drop(name)
+
+    with db.pool.writer() as cursor:
+        cursor.execute("DELETE FROM click_rollup_state")
+        cursor.execute(
+            "INSERT INTO click_rollup_state(name, last_click_id) SELECT 'clicks', COALESCE(MAX(id), 0) FROM clicks"
+        )
@@ -0,0 +1,5 @@
+--- upgrade
+-- Клики переносятся в файлы партиций, а таблицы clicks и user_agents удаляются скриптом 8_click_partitions.py
+
+--- downgrade
+-- Таблицы clicks и user_agents создаются и заполняются из партиций скриптом 8_click_partitions.py
\ No newline at end of file
@@ -0,0 +1,27 @@
+"""
+Заполняет original_url_hash для уже существующих ссылок пачками.
+Если несколько ссылок ведут на URL с одинаковым каноническим видом, ключ получает только первая из них.
+"""
+import utils
+
+BATCH_SIZE = 1000
+
+
+def upgrade(db):
+    last_id = 0
+    while True:
+        with db.pool.writer() as cursor:
+            cursor.execute(
+                "SELECT id, original_url FROM links WHERE id > ? AND original_url_hash IS NULL ORDER BY id LIMIT ?",
+                (last_id, BATCH_SIZE)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            cursor.executemany(
+                "UPDATE OR IGNORE links SET original_url_hash = ? WHERE id = ?",
+                [(utils.original_url_lookup_key(utils.decrypt_aes256_base64_bytes(original_url)), link_id)
+                 for link_id, original_url in rows]
+            )
+        last_id = rows[-1][0]
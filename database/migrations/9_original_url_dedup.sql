@@ -0,0 +1,11 @@
+--- upgrade
+ALTER TABLE links
+    ADD COLUMN original_url_hash TEXT;
+
+CREATE UNIQUE INDEX idx_links_original_url_hash ON links(original_url_hash);
+
+--- downgrade
+DROP INDEX IF EXISTS idx_links_original_url_hash;
+
+ALTER TABLE links
+    DROP COLUMN original_url_hash;
\ No newline at end of file
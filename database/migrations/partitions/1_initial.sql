@@ -0,0 +1,18 @@
+--- upgrade
+CREATE TABLE user_agents(
+    id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE clicks(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    link_id INTEGER NOT NULL,
+    user_agent_id INTEGER,
+    ip BLOB,
+    referer TEXT,
+    created_at TIMESTAMP NOT NULL
+);
+
+--- downgrade
+DROP TABLE IF EXISTS clicks;
+DROP TABLE IF EXISTS user_agents;
\ No newline at end of file
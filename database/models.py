@@ -1,45 +1,90 @@
-import dataclasses
 import datetime
 from typing import Optional, Union
 
 import utils
 
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Признак ещё не расшифрованного значения в слотах _short_url/_original_url
+_ENCRYPTED = object()
 
-@dataclasses.dataclass
-class Link:
-    """Модель для представления записи из таблицы links."""
-    id: int
-    _short_url: str = dataclasses.field()
-    _original_url: str = dataclasses.field()
-    clicks: int
-    short_url_length: int
-
-    _banned: Union[str, bool] = dataclasses.field(default="0")
-    _banned_at: Optional[Union[str, datetime.datetime]] = dataclasses.field(default=None)
-    _created_at: Union[str, datetime.datetime] = dataclasses.field(
-        default_factory=lambda: datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    )
-    _expires_at: Optional[Union[str, datetime.datetime]] = dataclasses.field(default=None)
 
-    def __post_init__(self):
-        """Преобразуем строковые значения после инициализации."""
-        if isinstance(self._banned, str):
-            self._banned = self._banned == "1"
-        elif isinstance(self._banned, int):
-            self._banned = bool(self._banned)
+def _parse_datetime(value: Optional[Union[str, datetime.datetime]]) -> Optional[datetime.datetime]:
+    if value and isinstance(value, str):
+        return datetime.datetime.strptime(value, DATETIME_FORMAT)
+    return value or None
+
 
-        if self._banned_at and isinstance(self._banned_at, str):
-            self._banned_at = datetime.datetime.strptime(self._banned_at, "%Y-%m-%d %H:%M:%S")
+def _decrypt(value: str) -> str:
+    try:
+        return utils.decrypt_aes256_base64_bytes(value)
+    except Exception as e:
+        print(e)
+        return value
 
-        if self._created_at and isinstance(self._created_at, str):
-            self._created_at = datetime.datetime.strptime(self._created_at, "%Y-%m-%d %H:%M:%S")
 
-        if self._expires_at and isinstance(self._expires_at, str):
-            self._expires_at = datetime.datetime.strptime(self._expires_at, "%Y-%m-%d %H:%M:%S")
+class Link:
+    """
+    Модель для представления записи из таблицы links.
+    Даты разбираются, а зашифрованные URL расшифровываются только при первом обращении,
+    поэтому пачка записей, у которых читают только часть полей, создаётся дёшево.
+    """
+    __slots__ = (
+        "id", "clicks", "short_url_length", "_short_url", "_short_url_encrypted", "_original_url",
+        "_original_url_encrypted", "_banned", "_banned_at", "_created_at", "_expires_at",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        _short_url: str,
+        _original_url: str,
+        clicks: int,
+        short_url_length: int,
+        _banned: Union[str, int, bool] = "0",
+        _banned_at: Optional[Union[str, datetime.datetime]] = None,
+        _created_at: Optional[Union[str, datetime.datetime]] = None,
+        _expires_at: Optional[Union[str, datetime.datetime]] = None,
+    ):
+        self.id = id
+        self._short_url = _short_url
+        self._original_url = _original_url
+        self.clicks = clicks
+        self.short_url_length = short_url_length
+        self._banned = _banned
+        self._banned_at = _banned_at
+        self._created_at = _created_at or datetime.datetime.now().strftime(DATETIME_FORMAT)
+        self._expires_at = _expires_at
+
+    @classmethod
+    def from_encrypted(cls, id: int, short_url: Optional[str], original_url_encrypted: str, *fields) -> "Link":
+        """
+        Создаёт запись по строке таблицы links с зашифрованным оригинальным URL, который расшифруется при обращении.
+
+        :param id: ID ссылки
+        :param short_url: Короткий URL в открытом виде
+        :param original_url_encrypted: Оригинальный URL в зашифрованном виде
+        :param fields: Остальные поля в порядке конструктора, начиная с clicks
+        """
+        link = cls(id, short_url, _ENCRYPTED, *fields)
+        link._original_url_encrypted = original_url_encrypted
+        return link
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Link):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in (
+            "id", "short_url", "original_url", "clicks", "short_url_length", "banned", "banned_at", "created_at",
+            "expires_at",
+        ))
+
+    def __repr__(self) -> str:
+        return f"Link(id={self.id!r}, short_url_length={self.short_url_length!r})"
 
     @property
     def banned(self) -> bool:
         """Флаг блокировки ссылки."""
+        if not isinstance(self._banned, bool):
+            self._banned = self._banned == "1" if isinstance(self._banned, str) else bool(self._banned)
         return self._banned
 
     @banned.setter
@@ -50,6 +95,7 @@ class Link:
     @property
     def banned_at(self) -> Optional[datetime.datetime]:
         """Дата блокировки ссылки."""
+        self._banned_at = _parse_datetime(self._banned_at)
         return self._banned_at
 
     @banned_at.setter
@@ -60,56 +106,56 @@ class Link:
     @property
     def created_at(self) -> datetime.datetime:
         """Дата создания ссылки."""
+        self._created_at = _parse_datetime(self._created_at)
         return self._created_at
 
     @created_at.setter
     def created_at(self, value: datetime.datetime) -> None:
         """Установка даты создания."""
-        if isinstance(value, str):
-            self._created_at = datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
-        else:
-            self._created_at = value
+        self._created_at = value
 
     @property
     def expires_at(self) -> Optional[datetime.datetime]:
         """Дата истечения срока действия ссылки."""
+        self._expires_at = _parse_datetime(self._expires_at)
         return self._expires_at
 
     @expires_at.setter
     def expires_at(self, value: Optional[datetime.datetime]) -> None:
         """Установка даты истечения срока."""
-        if isinstance(value, str):
-            if value:
-                self._expires_at = datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
-            else:
-                self._expires_at = None
-        else:
-            self._expires_at = value
+        self._expires_at = value
 
     @property
     def short_url(self) -> str:
         """Расшифрованный короткий URL."""
+        if self._short_url is _ENCRYPTED:
+            self._short_url = _decrypt(self._short_url_encrypted)
         return self._short_url
 
     @short_url.setter
     def short_url(self, value: str) -> None:
-        """Установка короткого URL в расшифрованном виде."""
-        try:
-            self._short_url = utils.decrypt_aes256_base64_bytes(value)
-        except Exception as e:
-            print(e)
-            self._short_url = value
+        """Установка короткого URL в зашифрованном виде, расшифровывается при обращении."""
+        self._short_url = _ENCRYPTED
+        self._short_url_encrypted = value
 
     @property
     def original_url(self) -> str:
         """Расшифрованный оригинальный URL."""
+        if self._original_url is _ENCRYPTED:
+            self._original_url = _decrypt(self._original_url_encrypted)
         return self._original_url
 
     @original_url.setter
     def original_url(self, value: str) -> None:
-        """Установка оригинального URL в расшифрованном виде."""
-        try:
-            self._original_url = utils.decrypt_aes256_base64_bytes(value)
-        except Exception as e:
-            print(e)
-            self._original_url = value
+        """Установка оригинального URL в зашифрованном виде, расшифровывается при обращении."""
+        self._original_url = _ENCRYPTED
+        self._original_url_encrypted = value
+
+
+class LinkTarget:
+    """Минимальная запись для редиректа: только id и расшифрованный оригинальный URL."""
+    __slots__ = ("id", "original_url")
+
+    def __init__(self, id: int, original_url: str):
+        self.id = id
+        self.original_url = original_url
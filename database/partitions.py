@@ -0,0 +1,237 @@
+import csv
+import gzip
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import utils
+from config import DbConfig
+from database.pool import ConnectionPool
+
+PARTITION_MIGRATIONS_DIR = "migrations/partitions"
+
+
+def intern_user_agents(cursor: sqlite3.Cursor, user_agents: set[str]) -> dict[str, int]:
+    """
+    Находит или добавляет строки User-Agent в таблицу user_agents. Вызывается в транзакции записи.
+
+    :param cursor: Курсор соединения на запись
+    :param user_agents: Строки User-Agent
+    :return: id для каждого User-Agent
+    """
+    values = list(user_agents)
+    cursor.executemany("INSERT OR IGNORE INTO user_agents(value) VALUES(?)", [(value,) for value in values])
+    ids = {}
+    for i in range(0, len(values), 500):
+        chunk = values[i:i + 500]
+        cursor.execute(f"SELECT id, value FROM user_agents WHERE value IN ({','.join('?' * len(chunk))})", chunk)
+        ids.update((value, user_agent_id) for user_agent_id, value in cursor.fetchall())
+    return ids
+
+
+class ClickPartition:
+    """
+    Файл SQLite с кликами за один период (месяц или сутки) и словарём User-Agent этих кликов.
+    Схема создаётся DatabaseMigrator из миграций migrations/partitions при первом открытии в процессе.
+    """
+    def __init__(self, name: str, filename: str, config: DbConfig):
+        """
+        :param name: Имя партиции, например clicks_2024_01
+        :param filename: Путь к файлу партиции
+        :param config: Конфигурация базы: PRAGMA и размер кеша User-Agent
+        """
+        self.name = name
+        self.filename = filename
+        # Читают партицию только фоновые задачи, одного соединения на чтение достаточно
+        self.pool = ConnectionPool(filename, config.model_copy(update={"db_readers": 1}))
+        self._user_agent_cache_size = config.user_agent_cache_size
+        # id User-Agent из таблицы user_agents: строки неизменяемы, поэтому кеш не устаревает.
+        # Доступ только под блокировкой записи
+        self._user_agent_ids: dict[str, int] = {}
+
+    def insert_clicks(self, clicks: list[tuple[int | None, int, str | None, bytes | None, str | None, str]]):
+        """
+        Записывает пачку кликов одной транзакцией. Клик с уже существующим id пропускается.
+
+        :param clicks: Список кортежей (id клика или None, id ссылки, User-Agent, упакованный IP,
+            Referer, время клика в формате DB_TIMESTAMP_FORMAT)
+        """
+        with self.pool.writer() as cursor:
+            user_agent_ids = self._intern_user_agents(cursor, {click[2] for click in clicks if click[2]})
+            cursor.executemany(
+                "INSERT OR IGNORE INTO clicks(id, link_id, user_agent_id, ip, referer, created_at) VALUES(?,?,?,?,?,?)",
+                [
+                    (click_id, link_id, user_agent_ids.get(user_agent), ip, referer, created_at)
+                    for click_id, link_id, user_agent, ip, referer, created_at in clicks
+                ]
+            )
+
+    def get_clicks_after(self, last_click_id: int, limit: int) -> list[tuple[int, int, str | None, bytes | None, str | None, str]]:
+        """
+        :param last_click_id: id последнего уже обработанного клика
+        :param limit: Максимальное количество кликов
+        :return: Клики в формате (id клика, id ссылки, User-Agent, упакованный IP, Referer, время клика) по возрастанию id
+        """
+        with self.pool.reader() as cursor:
+            cursor.execute(
+                "SELECT clicks.id, link_id, user_agents.value, ip, referer, created_at FROM clicks "
+                "LEFT JOIN user_agents ON user_agents.id = clicks.user_agent_id "
+                "WHERE clicks.id > ? ORDER BY clicks.id LIMIT ?",
+                (last_click_id, limit,)
+            )
+            return cursor.fetchall()
+
+    def get_last_click_id(self) -> int:
+        """id последнего записанного клика или 0, если кликов нет."""
+        with self.pool.reader() as cursor:
+            cursor.execute("SELECT MAX(id) FROM clicks")
+            return cursor.fetchone()[0] or 0
+
+    def export(self, filename: str, batch_size: int = 10000) -> int:
+        """
+        Выгружает клики партиции в CSV, сжатый gzip. Файл сначала пишется под временным именем,
+        поэтому прерванная выгрузка не оставляет неполный архив.
+
+        :param filename: Путь к архиву
+        :param batch_size: Количество кликов, читаемых за один запрос
+        :return: Количество выгруженных кликов
+        """
+        exported = last_click_id = 0
+        with gzip.open(filename + ".tmp", "wt", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("id", "link_id", "user_agent", "ip", "referer", "created_at"))
+            while clicks := self.get_clicks_after(last_click_id, batch_size):
+                writer.writerows(
+                    (click_id, link_id, user_agent, utils.unpack_ip(ip), referer, created_at)
+                    for click_id, link_id, user_agent, ip, referer, created_at in clicks
+                )
+                exported += len(clicks)
+                last_click_id = clicks[-1][0]
+        os.replace(filename + ".tmp", filename)
+        return exported
+
+    def _intern_user_agents(self, cursor: sqlite3.Cursor, user_agents: set[str]) -> dict[str, int]:
+        ids = {user_agent: self._user_agent_ids[user_agent] for user_agent in user_agents if user_agent in self._user_agent_ids}
+        missing = {user_agent for user_agent in user_agents if user_agent not in ids}
+        if not missing:
+            return ids
+
+        found = intern_user_agents(cursor, missing)
+        if len(self._user_agent_ids) + len(found) > self._user_agent_cache_size:
+            self._user_agent_ids.clear()
+        self._user_agent_ids.update(found)
+        ids.update(found)
+        return ids
+
+
+class ClickPartitions:
+    """
+    Клики, разбитые по периодам на отдельные файлы SQLite в каталоге click_partitions_dir.
+    Запись кликов не конкурирует за блокировку основной базы со ссылками, а удаление старых кликов
+    сводится к удалению файла партиции вместо DELETE по индексу created_at.
+    Партиция открывается при первом обращении, файл и схема создаются при первой записи в период.
+    """
+    def __init__(self, config: DbConfig):
+        """
+        :param config: Конфигурация базы
+        """
+        self._config = config
+        self.directory = config.click_partitions_dir or \
+            os.path.splitext(config.db_filename.get_secret_value())[0] + "_clicks"
+        self._partitions: dict[str, ClickPartition] = {}
+        self._lock = threading.Lock()
+
+    def name_for(self, created_at: str) -> str:
+        """
+        :param created_at: Время клика в формате DB_TIMESTAMP_FORMAT
+        :return: Имя партиции периода, в который попадает клик
+        """
+        if self._config.click_partition_period == "day":
+            return "clicks_" + created_at[:10].replace("-", "_")
+        return "clicks_" + created_at[:7].replace("-", "_")
+
+    def retention_cutoff(self, keep: int, now: datetime) -> str:
+        """
+        :param keep: Количество хранимых периодов, включая текущий
+        :param now: Текущее время
+        :return: Имя самой старой хранимой партиции: партиции с меньшим именем устарели
+        """
+        if self._config.click_partition_period == "day":
+            return self.name_for(utils.to_db_timestamp(now - timedelta(days=keep - 1)))
+        months = now.year * 12 + now.month - 1 - (keep - 1)
+        return f"clicks_{months // 12:04d}_{months % 12 + 1:02d}"
+
+    def names(self) -> list[str]:
+        """Имена существующих партиций в хронологическом порядке."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            filename[:-len(".db")] for filename in os.listdir(self.directory)
+            if filename.startswith("clicks_") and filename.endswith(".db")
+        )
+
+    def get(self, name: str) -> ClickPartition:
+        """
+        Открывает партицию, при необходимости создаёт файл и применяет миграции схемы партиций.
+
+        :param name: Имя партиции
+        """
+        partition = self._partitions.get(name)
+        if partition is not None:
+            return partition
+        from database.core import DatabaseMigrator
+
+        with self._lock:
+            if name not in self._partitions:
+                os.makedirs(self.directory, exist_ok=True)
+                partition = ClickPartition(name, os.path.join(self.directory, name + ".db"), self._config)
+                try:
+                    DatabaseMigrator(partition, PARTITION_MIGRATIONS_DIR).upgrade()
+                except FileNotFoundError:
+                    pass
+                self._partitions[name] = partition
+            return self._partitions[name]
+
+    def drop(self, name: str, archive_dir: str | None = None) -> bool:
+        """
+        Удаляет файл партиции, предварительно выгрузив клики в archive_dir/<имя>.csv.gz.
+        Файл сначала переименовывается, поэтому из нескольких процессов партицию удаляет только один.
+
+        :param name: Имя партиции
+        :param archive_dir: Каталог архивов или None, если архив не нужен
+        :return: False, если партицию уже удалил другой процесс
+        """
+        if not os.path.exists(os.path.join(self.directory, name + ".db")):
+            return False
+        partition = self.get(name)
+        with partition.pool.writer() as cursor:
+            cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        partition.pool.close()
+        with self._lock:
+            self._partitions.pop(name, None)
+
+        expired_filename = partition.filename + ".expired"
+        try:
+            os.rename(partition.filename, expired_filename)
+        except FileNotFoundError:
+            return False
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(partition.filename + suffix):
+                os.remove(partition.filename + suffix)
+
+        if archive_dir:
+            os.makedirs(archive_dir, exist_ok=True)
+            expired = ClickPartition(name, expired_filename, self._config)
+            expired.export(os.path.join(archive_dir, name + ".csv.gz"))
+            expired.pool.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(expired_filename + suffix):
+                os.remove(expired_filename + suffix)
+        return True
+
+    def close(self):
+        """Закрывает соединения всех открытых партиций."""
+        with self._lock:
+            for partition in self._partitions.values():
+                partition.pool.close()
@@ -0,0 +1,114 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from config import DbConfig
+from metrics import sqlite_busy_errors, sqlite_lock_wait_seconds
+
+_reader_wait_seconds = sqlite_lock_wait_seconds.labels("reader")
+_writer_wait_seconds = sqlite_lock_wait_seconds.labels("writer")
+
+
+class ConnectionPool:
+    """
+    Пул соединений с SQLite: одно соединение на запись и несколько на чтение.
+    База открывается в режиме WAL, поэтому чтения не блокируются записью и выполняются параллельно.
+    Каждый вызов получает собственный курсор.
+    Соединения открываются при первом обращении в каждом процессе: пул, созданный при импорте модуля,
+    не передаёт свои соединения процессам-воркерам, запущенным через fork.
+    """
+    def __init__(self, filename: str, config: DbConfig):
+        """
+        :param filename: Путь к файлу базы данных
+        :param config: Конфигурация с количеством читающих соединений и значениями PRAGMA
+        """
+        self._filename = filename
+        self._config = config
+        self._pid: int | None = None
+        self._open_lock = threading.Lock()
+        self._writer: sqlite3.Connection | None = None
+        self._writer_lock = threading.Lock()
+        self._readers: queue.Queue[sqlite3.Connection] = queue.Queue()
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Cursor]:
+        """Выдаёт курсор свободного читающего соединения, ожидая освобождения, если все заняты."""
+        self._ensure_open()
+        started = time.perf_counter()
+        connection = self._readers.get()
+        _reader_wait_seconds.observe(time.perf_counter() - started)
+        try:
+            yield connection.cursor()
+        except sqlite3.OperationalError as e:
+            _count_busy(e)
+            raise
+        finally:
+            self._readers.put(connection)
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Выдаёт курсор соединения на запись. Одновременно пишет только один поток.
+        При выходе без ошибки транзакция фиксируется, при ошибке откатывается.
+        """
+        self._ensure_open()
+        started = time.perf_counter()
+        with self._writer_lock:
+            _writer_wait_seconds.observe(time.perf_counter() - started)
+            cursor = self._writer.cursor()
+            try:
+                yield cursor
+                self._writer.commit()
+            except BaseException as e:
+                self._writer.rollback()
+                _count_busy(e)
+                raise
+
+    @property
+    def readers_count(self) -> int:
+        """Количество читающих соединений."""
+        return self._config.db_readers
+
+    def close(self):
+        """Закрывает все соединения пула. При следующем обращении пул откроет их заново."""
+        if self._pid != os.getpid():
+            return
+        with self._writer_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+        self._pid = None
+
+    def _ensure_open(self):
+        if self._pid == os.getpid():
+            return
+        with self._open_lock:
+            if self._pid == os.getpid():
+                return
+            # Соединения и блокировки, унаследованные от родительского процесса, не трогаем:
+            # SQLite не поддерживает использование соединения в нескольких процессах
+            self._writer = self._connect()
+            self._writer.execute("PRAGMA journal_mode=WAL")
+            self._writer_lock = threading.Lock()
+            self._readers = queue.Queue()
+            for _ in range(self._config.db_readers):
+                self._readers.put(self._connect())
+            self._pid = os.getpid()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self._filename, check_same_thread=False)
+        connection.execute(f"PRAGMA synchronous={self._config.db_synchronous}")
+        connection.execute(f"PRAGMA cache_size={int(self._config.db_cache_size)}")
+        connection.execute(f"PRAGMA mmap_size={int(self._config.db_mmap_size)}")
+        connection.execute(f"PRAGMA busy_timeout={int(self._config.db_busy_timeout_ms)}")
+        return connection
+
+
+def _count_busy(error: BaseException):
+    """Учитывает ошибку database is locked, возникающую после истечения busy_timeout."""
+    if isinstance(error, sqlite3.OperationalError) and "locked" in str(error):
+        sqlite_busy_errors.inc()
@@ -0,0 +1,147 @@
+import dataclasses
+import hashlib
+import json
+import math
+from datetime import datetime, timedelta
+
+from utils import DB_TIMESTAMP_FORMAT
+
+GRANULARITIES = ("hour", "day")
+# 2^10 регистров по байту: 1 КБ на корзину, стандартная ошибка оценки около 3%
+HLL_PRECISION = 10
+
+
+class HyperLogLog:
+    """
+    Оценка количества уникальных значений (HyperLogLog) с регистрами в bytearray.
+    Скетчи с одинаковой точностью объединяются поэлементным максимумом,
+    поэтому число уникальных IP за период считается по скетчам корзин без обращения к кликам.
+    """
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: bytes | None = None):
+        """
+        :param precision: Количество бит хеша для номера регистра (регистров 2^precision)
+        :param registers: Сохранённые регистры, см. to_bytes
+        """
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << precision)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        """Восстанавливает скетч из to_bytes, точность определяется по количеству регистров."""
+        return cls(len(data).bit_length() - 1, data)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    def add(self, value: bytes | str):
+        """Добавляет значение в скетч."""
+        if isinstance(value, str):
+            value = value.encode()
+        h = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "big")
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        """
+        Объединяет скетч с другим скетчем той же точности.
+
+        :raises ValueError: Если точность скетчей различается
+        """
+        if other.precision != self.precision:
+            raise ValueError("HyperLogLog precision mismatch")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        """Оценка количества уникальных добавленных значений."""
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Поправка для малых значений: линейный подсчёт по пустым регистрам
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+@dataclasses.dataclass(slots=True)
+class ClickBucket:
+    """Агрегат кликов по ссылке за час или сутки."""
+    clicks: int = 0
+    unique_ips: HyperLogLog = dataclasses.field(default_factory=HyperLogLog)
+    user_agents: dict[str, int] = dataclasses.field(default_factory=dict)
+
+    def merge(self, other: "ClickBucket", top_user_agents: int):
+        """
+        Добавляет к корзине другую корзину и оставляет top_user_agents самых частых User-Agent.
+        Редкие User-Agent отбрасываются при каждом слиянии, поэтому их счётчики приблизительны.
+        """
+        self.clicks += other.clicks
+        self.unique_ips.merge(other.unique_ips)
+        for user_agent, clicks in other.user_agents.items():
+            self.user_agents[user_agent] = self.user_agents.get(user_agent, 0) + clicks
+        self.user_agents = top_counts(self.user_agents, top_user_agents)
+
+
+def top_counts(counts: dict[str, int], limit: int) -> dict[str, int]:
+    """
+    :param counts: Счётчики по значениям
+    :param limit: Сколько значений оставить
+    :return: limit значений с наибольшими счётчиками, по убыванию
+    """
+    return dict(sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit])
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    """
+    :param timestamp: Время клика
+    :param granularity: hour или day
+    :return: Начало часа или суток, в которые попадает timestamp
+    """
+    if granularity == "day":
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def bucket_step(granularity: str) -> timedelta:
+    """Длина корзины."""
+    return timedelta(days=1) if granularity == "day" else timedelta(hours=1)
+
+
+def aggregate_clicks(clicks: list[tuple[int, int, str | None, bytes | None, str | None, str]],
+                     top_user_agents: int) -> dict[tuple, ClickBucket]:
+    """
+    Агрегирует пачку кликов в часовые и суточные корзины.
+
+    :param clicks: Клики в формате (id клика, id ссылки, User-Agent, упакованный IP, Referer,
+        время клика в формате DB_TIMESTAMP_FORMAT)
+    :param top_user_agents: Сколько самых частых User-Agent хранить в корзине
+    :return: Корзины по ключу (id ссылки, гранулярность, начало корзины в формате DB_TIMESTAMP_FORMAT)
+    """
+    buckets: dict[tuple, ClickBucket] = {}
+    for _, link_id, user_agent, ip, _, created_at in clicks:
+        timestamp = datetime.strptime(created_at, DB_TIMESTAMP_FORMAT)
+        for granularity in GRANULARITIES:
+            key = (link_id, granularity, bucket_start(timestamp, granularity).strftime(DB_TIMESTAMP_FORMAT))
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = ClickBucket()
+            bucket.clicks += 1
+            if ip is not None:
+                bucket.unique_ips.add(ip)
+            if user_agent is not None:
+                bucket.user_agents[user_agent] = bucket.user_agents.get(user_agent, 0) + 1
+    for bucket in buckets.values():
+        bucket.user_agents = top_counts(bucket.user_agents, top_user_agents)
+    return buckets
+
+
+def encode_user_agents(user_agents: dict[str, int]) -> str:
+    return json.dumps(user_agents, separators=(",", ":"))
+
+
+def decode_user_agents(value: str) -> dict[str, int]:
+    return json.loads(value)
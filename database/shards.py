@@ -0,0 +1,47 @@
+import heapq
+import os
+import re
+
+# Диапазон id ссылок каждого шарда: шард i выдаёт id начиная с i * SHARD_ID_RANGE,
+# поэтому id ссылок уникальны во всех шардах и не меняются при переносе ссылки в другой шард
+SHARD_ID_RANGE = 2 ** 40
+
+
+def shard_filename(db_filename: str, shard: int) -> str:
+    """
+    :param db_filename: Путь к основному файлу базы
+    :param shard: Номер шарда
+    :return: Путь к файлу шарда: нулевой шард - основной файл, остальные - <имя базы>_shard<номер> рядом с ним
+    """
+    if shard == 0:
+        return db_filename
+    root, ext = os.path.splitext(db_filename)
+    return f"{root}_shard{shard}{ext}"
+
+
+def shard_index(short_url_hash: str, shards: int) -> int:
+    """
+    :param short_url_hash: Ключ поиска короткого URL (short_url_lookup_key)
+    :param shards: Количество шардов
+    :return: Номер шарда, в котором хранится ссылка
+    """
+    return int(short_url_hash[:8], 16) % shards
+
+
+def existing_shards(db_filename: str) -> list[int]:
+    """Номера шардов, файлы которых есть на диске, включая нулевой."""
+    root, ext = os.path.splitext(db_filename)
+    directory = os.path.dirname(root) or "."
+    pattern = re.compile(re.escape(os.path.basename(root)) + r"_shard(\d+)" + re.escape(ext) + "$")
+    numbers = [int(match.group(1)) for match in map(pattern.match, os.listdir(directory)) if match]
+    return [0] + sorted(numbers)
+
+
+def merge_links_chunks(chunks: list[list[tuple]], limit: int) -> list[tuple]:
+    """
+    Объединяет пачки ссылок разных шардов, упорядоченные по id, в одну пачку из limit первых по id ссылок.
+
+    :param chunks: Пачки ссылок, первый элемент каждой ссылки - id
+    :param limit: Размер пачки
+    """
+    return list(heapq.merge(*chunks, key=lambda link: link[0]))[:limit]
@@ -1,4 +1,7 @@
 import logging
+import os
+import shutil
+
 import uvicorn
 
 from config import ApiConfig
@@ -9,10 +12,28 @@ api_config = ApiConfig()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    uvicorn.run(
-        "api:app",
-        host=api_config.host,
-        port=api_config.port,
-        reload=True,
-        log_level="info"
-    )
+    if api_config.run_mode == "production":
+        # Воркеры пишут метрики в файлы общего каталога, prometheus_client читает переменную при импорте,
+        # поэтому она задаётся до запуска воркеров. Файлы прошлого запуска удаляются
+        shutil.rmtree(api_config.metrics_multiproc_dir, ignore_errors=True)
+        os.makedirs(api_config.metrics_multiproc_dir)
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.path.abspath(api_config.metrics_multiproc_dir)
+        uvicorn.run(
+            "api:app",
+            host=api_config.host,
+            port=api_config.port,
+            workers=api_config.workers or os.cpu_count(),
+            loop=api_config.loop,
+            http=api_config.http,
+            backlog=api_config.backlog,
+            timeout_keep_alive=api_config.keep_alive_timeout_seconds,
+            log_level="info"
+        )
+    else:
+        uvicorn.run(
+            "api:app",
+            host=api_config.host,
+            port=api_config.port,
+            reload=True,
+            log_level="info"
+        )
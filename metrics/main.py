@@ -0,0 +1,96 @@
+import functools
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, \
+    multiprocess
+
+__all__ = [
+    "CONTENT_TYPE_LATEST", "generate_latest_metrics", "mark_process_dead", "timed", "stage_seconds", "cache_lookups", "redirect_db_fallbacks",
+    "aes_operations", "sqlite_lock_wait_seconds", "sqlite_busy_errors", "click_queue_depth", "click_queue_dropped",
+    "click_queue_spilled",
+]
+
+# Границы корзин от 50 мкс до 1 с: попадания в кеш укладываются в сотни микросекунд, запросы к SQLite в миллисекунды
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0
+)
+
+stage_seconds = Histogram(
+    "link_shortener_stage_seconds",
+    "Время выполнения этапов обработки запроса",
+    ["handler", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+cache_lookups = Counter(
+    "link_shortener_cache_lookups",
+    "Результаты поиска ссылок в кеше: local и redis - попадания, negative - заведомо несуществующий код, miss - промах",
+    ["result"],
+)
+redirect_db_fallbacks = Counter(
+    "link_shortener_redirect_db_fallbacks",
+    "Поиски ссылки в SQLite при промахе кеша на пути редиректа",
+    ["result"],
+)
+aes_operations = Counter(
+    "link_shortener_aes_operations",
+    "Операции шифрования и дешифрования AES",
+    ["operation"],
+)
+sqlite_lock_wait_seconds = Histogram(
+    "link_shortener_sqlite_lock_wait_seconds",
+    "Ожидание соединения из пула SQLite: writer - блокировка записи, reader - свободное читающее соединение",
+    ["connection"],
+    buckets=LATENCY_BUCKETS,
+)
+sqlite_busy_errors = Counter(
+    "link_shortener_sqlite_busy_errors",
+    "Ошибки database is locked после истечения busy_timeout",
+)
+# Очередь кликов у каждого воркера своя: в режиме нескольких процессов значения живых воркеров суммируются
+click_queue_depth = Gauge(
+    "link_shortener_click_queue_depth", "Клики в очереди, ещё не записанные в базу", multiprocess_mode="livesum"
+)
+click_queue_dropped = Gauge(
+    "link_shortener_click_queue_dropped", "Клики, отброшенные при переполнении очереди", multiprocess_mode="livesum"
+)
+click_queue_spilled = Gauge(
+    "link_shortener_click_queue_spilled", "Клики, выгруженные в файл при переполнении очереди", multiprocess_mode="livesum"
+)
+
+
+def generate_latest_metrics() -> bytes:
+    """
+    Метрики в текстовом формате Prometheus.
+    Если задан PROMETHEUS_MULTIPROC_DIR (main.py в режиме production), значения собираются из файлов
+    всех процессов-воркеров, иначе отдаются метрики текущего процесса.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def mark_process_dead():
+    """Удаляет файлы gauge завершающегося воркера, чтобы его значения не попадали в сумму живых процессов."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def timed(histogram):
+    """
+    Декоратор асинхронной функции, записывающий время её выполнения в гистограмму, в том числе при исключении.
+
+    :param histogram: Гистограмма с уже заданными значениями меток
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
@@ -1,5 +1,6 @@
-from unittest.mock import Mock, ANY
+from unittest.mock import ANY, patch
 from database import ShortLinkWithThatUrlAlreadyExists, ThisLengthPoolFilled
+from context import app_context
 
 
 class TestShortenEndpoint:
@@ -14,7 +15,7 @@ class TestShortenEndpoint:
         assert response.status_code == 200, f"Expected 200, got {response.status_code}. Response: {response.text}"
         assert response.json() == {"url": "abc123"}
 
-        mock_database.create_link.assert_called_once_with("https://example.com/", 6)
+        mock_database.create_link.assert_called_once_with("https://example.com/", 6, None)
         mock_redis.set.assert_called_once()
 
     def test_shorten_existing_url(self, test_client, mock_database, sample_link_data):
@@ -48,13 +49,120 @@ class TestShortenEndpoint:
         assert response.status_code == 503, f"Expected 503, got {response.status_code}"
         assert "Technical troubles" in response.json()["detail"]
 
+    def test_shorten_idempotent_returns_existing(self, test_client, mock_database, mock_redis, sample_link_data):
+        """В идемпотентном режиме для уже сокращённого URL возвращается существующая ссылка без записи в базу"""
+        # Arrange
+        mock_redis.mget.side_effect = None
+        mock_redis.mget.return_value = [b"encrypted_abc123"]
+
+        # Act
+        with patch.object(app_context.api_config, 'shorten_idempotent', True):
+            response = test_client.post("/api/v1/shorten", json=sample_link_data)
+
+        # Assert
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}. Response: {response.text}"
+        assert response.json() == {"url": "abc123"}
+        mock_database.create_link.assert_not_called()
+        mock_database.get_links_by_original_urls.assert_not_called()
+
+    def test_shorten_existing_url_rejected_by_database(self, test_client, mock_database, mock_redis, sample_link_data):
+        """Без идемпотентного режима существующая ссылка не ищется заранее, URL отклоняет уникальный индекс базы"""
+        # Arrange
+        mock_database.create_link.side_effect = ShortLinkWithThatUrlAlreadyExists("Short link with that url already exists")
+
+        # Act
+        response = test_client.post("/api/v1/shorten", json=sample_link_data)
+
+        # Assert
+        assert response.status_code == 400, f"Expected 400, got {response.status_code}"
+        assert "already exists" in response.json()["detail"]
+        mock_database.get_links_by_original_urls.assert_not_called()
+        mock_redis.mget.assert_not_called()
+
+
+class TestShortenBatchEndpoint:
+    """Тесты для эндпоинта пакетного создания коротких ссылок"""
+
+    def test_batch_per_item_results(self, test_client, mock_database, mock_redis):
+        """Ошибка одного элемента не прерывает создание остальных"""
+        mock_database.create_links.return_value = [
+            (1, "abc12", "ZW5jcnlwdGVkXzE="),
+            ShortLinkWithThatUrlAlreadyExists("Short link with that url already exists"),
+            (2, "def34", "ZW5jcnlwdGVkXzM="),
+        ]
+        pipe = mock_redis.pipeline.return_value
+
+        response = test_client.post("/api/v1/shorten/batch", json={"items": [
+            {"url": "https://example.com/1", "length": 5},
+            {"url": "https://example.com/2", "length": 5},
+            {"url": "https://example.com/3", "length": 5},
+        ]})
+
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}. Response: {response.text}"
+        assert response.json()["results"] == [
+            {"url": "abc12"},
+            {"error": "Short link with that url already exists"},
+            {"url": "def34"},
+        ]
+        mock_database.create_links.assert_called_once()
+        # Для каждой созданной ссылки: запись ссылки и запись обратного индекса по оригинальному URL
+        assert pipe.set.call_count == 4
+        mock_redis.set.assert_not_called()
+
+    def test_batch_idempotent_creates_only_new_urls(self, test_client, mock_database):
+        """В идемпотентном режиме в базу передаются только URL без существующей ссылки"""
+        # Arrange
+        mock_database.get_links_by_original_urls.return_value = {"https://example.com/1": (1, "abc12", None)}
+        mock_database.create_links.return_value = [(2, "def34", "ZW5jcnlwdGVkXzI=")]
+
+        # Act
+        with patch.object(app_context.api_config, 'shorten_idempotent', True):
+            response = test_client.post("/api/v1/shorten/batch", json={"items": [
+                {"url": "https://example.com/1", "length": 5},
+                {"url": "https://example.com/2", "length": 5},
+            ]})
+
+        # Assert
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}. Response: {response.text}"
+        assert response.json()["results"] == [{"url": "abc12"}, {"url": "def34"}]
+        mock_database.create_links.assert_called_once_with([("https://example.com/2", 5, None)])
+
+    def test_batch_idempotent_duplicate_urls(self, test_client, mock_database, mock_redis):
+        """В идемпотентном режиме повторы одного URL в пачке создаются один раз и получают одну ссылку"""
+        # Arrange
+        mock_database.create_links.return_value = [(1, "abc12", "ZW5jcnlwdGVkXzE="), (2, "def34", "ZW5jcnlwdGVkXzI=")]
+        pipe = mock_redis.pipeline.return_value
+
+        # Act
+        with patch.object(app_context.api_config, 'shorten_idempotent', True):
+            response = test_client.post("/api/v1/shorten/batch", json={"items": [
+                {"url": "https://example.com/1", "length": 5},
+                {"url": "https://EXAMPLE.com:443/1", "length": 6},
+                {"url": "https://example.com/2", "length": 5},
+                {"url": "https://example.com/1", "length": 5},
+            ]})
+
+        # Assert
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}. Response: {response.text}"
+        assert response.json()["results"] == [{"url": "abc12"}, {"url": "abc12"}, {"url": "def34"}, {"url": "abc12"}]
+        mock_database.create_links.assert_called_once_with(
+            [("https://example.com/1", 5, None), ("https://example.com/2", 5, None)]
+        )
+        assert pipe.set.call_count == 4
+
+    def test_batch_empty(self, test_client):
+        """Пустой список ссылок не принимается"""
+        response = test_client.post("/api/v1/shorten/batch", json={"items": []})
+
+        assert response.status_code == 422, f"Expected 422, got {response.status_code}"
+
 
 class TestRedirectEndpoint:
     """Тесты для эндпоинта редиректа"""
 
-    def test_successful_redirect(self, test_client, mock_database, mock_redis, mock_link):
+    def test_successful_redirect(self, test_client, mock_database, mock_redis, mock_click_buffer, mock_link):
         """Успешный редирект по короткой ссылке"""
-        mock_database.get_link_by_short_url.return_value = mock_link
+        mock_database.get_redirect_target.return_value = mock_link
 
         response = test_client.get("/abc123", follow_redirects=False)
 
@@ -62,41 +170,59 @@ class TestRedirectEndpoint:
         assert response.headers["location"] == "https://example.com"
 
         mock_redis.get.assert_called_once()
-        mock_database.get_link_by_short_url.assert_called_once_with("abc123")
-        mock_database.add_click_on_link.assert_called_once_with(1, ANY)
+        mock_database.get_redirect_target.assert_called_once_with("abc123")
+        mock_click_buffer.push.assert_called_once_with(1, ANY, ANY, ANY)
+        mock_database.add_click_on_link.assert_not_called()
 
-    def test_redirect_with_cache(self, test_client, mock_database, mock_redis, mock_link_cached):
+    def test_redirect_with_cache(self, test_client, mock_database, mock_redis, mock_click_buffer, mock_link_cached):
         """Редирект с использованием кэша"""
-        mock_redis.get.return_value = Mock(decode=Mock(return_value="encrypted_https://example.com_1"))
+        from cache.records import encode_link_record
+        mock_redis.get.return_value = encode_link_record(1, b"encrypted_https://example.com")
+
+        response = test_client.get("/abc123", follow_redirects=False)
 
-        import cache.main
-        original_decrypt = cache.main.decrypt_aes256_base64_bytes
-        cache.main.decrypt_aes256_base64_bytes = Mock(return_value="https://example.com")
+        assert response.status_code == 307, f"Expected 307, got {response.status_code}"
+        assert response.headers["location"] == "https://example.com"
+
+        mock_database.get_redirect_target.assert_not_called()
+        mock_click_buffer.push.assert_called_once_with(1, ANY, ANY, ANY)
+
+    def test_redirect_with_legacy_cache_value(self, test_client, mock_database, mock_redis, mock_click_buffer):
+        """Редирект по ссылке, записанной в Redis в старом строковом формате"""
+        from cache.records import encode_legacy_link_record
+        mock_redis.get.return_value = encode_legacy_link_record(1, b"encrypted_https://example.com")
 
-        try:
-            response = test_client.get("/abc123", follow_redirects=False)
+        response = test_client.get("/abc123", follow_redirects=False)
+
+        assert response.status_code == 307, f"Expected 307, got {response.status_code}"
+        assert response.headers["location"] == "https://example.com"
+        mock_database.get_redirect_target.assert_not_called()
 
-            assert response.status_code == 307, f"Expected 307, got {response.status_code}"
-            assert response.headers["location"] == "https://example.com"
+    def test_redirect_unknown_code_skips_database(self, test_client, mock_database, mock_redis, negative_cache):
+        """Редирект по коду, которого нет в фильтре существующих кодов, не обращается к базе"""
+        from cache import BloomFilter
+        negative_cache.filter = BloomFilter(1000, 0.01)
+        negative_cache.ready = True
 
-            mock_database.get_link_by_short_url.assert_not_called()
-            mock_database.add_click_on_link.assert_called_once_with(1, ANY)
-        finally:
-            cache.main.decrypt_aes256_base64_bytes = original_decrypt
+        response = test_client.get("/zzzzzz", follow_redirects=False)
+
+        assert response.status_code == 404, f"Expected 404, got {response.status_code}"
+        mock_database.get_redirect_target.assert_not_called()
+        assert negative_cache.definite_misses == 1
 
     def test_redirect_nonexistent_link(self, test_client, mock_database, mock_redis):
         """Редирект по несуществующей ссылке"""
         mock_redis.get.return_value = None
-        mock_database.get_link_by_short_url.return_value = None
+        mock_database.get_redirect_target.return_value = None
 
         response = test_client.get("/nonexistent")
 
         assert response.status_code == 404, f"Expected 404, got {response.status_code}. Response: {response.text}"
         assert "does not exist" in response.json()["detail"]
 
-    def test_redirect_metadata_captured(self, test_client, mock_database, mock_redis, mock_link):
+    def test_redirect_metadata_captured(self, test_client, mock_database, mock_redis, mock_click_buffer, mock_link):
         """Проверка захвата метаданных при редиректе"""
-        mock_database.get_link_by_short_url.return_value = mock_link
+        mock_database.get_redirect_target.return_value = mock_link
 
         headers = {
             "User-Agent": "Test-Agent/1.0"
@@ -106,9 +232,181 @@ class TestRedirectEndpoint:
 
         assert response.status_code == 307, f"Expected 307, got {response.status_code}"
 
-        call_args = mock_database.add_click_on_link.call_args
-        assert call_args is not None
-        metadata = call_args[0][1]
-        assert "User-Agent: Test-Agent/1.0" in metadata
+        mock_click_buffer.push.assert_called_once_with(1, "Test-Agent/1.0", "testclient", None)
+
+    def test_redirect_without_user_agent(self, test_client, mock_database, mock_click_buffer, mock_link):
+        """Редирект без заголовка User-Agent записывает клик с пустым User-Agent"""
+        mock_database.get_redirect_target.return_value = mock_link
+
+        response = test_client.get(
+            "/abc123", headers={"User-Agent": "", "Referer": "https://ref.example"}, follow_redirects=False
+        )
+
+        assert response.status_code == 307, f"Expected 307, got {response.status_code}"
+        mock_click_buffer.push.assert_called_once_with(1, "", "testclient", "https://ref.example")
+
+class TestAdminEndpoints:
+    """Тесты для административных эндпоинтов"""
+
+    def test_admin_disabled_without_token(self, test_client):
+        """Административные методы недоступны, если ADMIN_TOKEN не задан"""
+        from unittest.mock import patch
+        with patch.object(app_context.api_config, 'admin_token', None):
+            response = test_client.get("/api/v1/admin/cache/stats")
+
+        assert response.status_code == 403, f"Expected 403, got {response.status_code}"
+
+    def test_admin_invalid_token(self, test_client):
+        """Неверный токен администратора"""
+        from unittest.mock import patch
+        from pydantic import SecretStr
+        with patch.object(app_context.api_config, 'admin_token', SecretStr("secret")):
+            response = test_client.get("/api/v1/admin/cache/stats", headers={"X-Admin-Token": "wrong"})
+
+        assert response.status_code == 401, f"Expected 401, got {response.status_code}"
+
+    def test_cache_stats(self, test_client):
+        """Получение счётчиков кеша в памяти"""
+        from unittest.mock import patch
+        from pydantic import SecretStr
+        with patch.object(app_context.api_config, 'admin_token', SecretStr("secret")):
+            response = test_client.get("/api/v1/admin/cache/stats", headers={"X-Admin-Token": "secret"})
+
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+        assert {"hits", "misses", "evictions"} <= set(response.json()["local"])
+        assert "false_positives" in response.json()["negative"]
+
+    def test_pool_stats(self, test_client, mock_database):
+        """Получение заполненности пространства коротких кодов"""
+        from unittest.mock import patch
+        from pydantic import SecretStr
+        mock_database.get_short_url_pool_stats.return_value = [
+            {"length": 5, "used": 10, "capacity": 62 ** 5, "fill_ratio": 10 / 62 ** 5, "pooled": 990}
+        ]
+        with patch.object(app_context.api_config, 'admin_token', SecretStr("secret")):
+            response = test_client.get("/api/v1/admin/pool/stats", headers={"X-Admin-Token": "secret"})
+
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+        assert response.json()["lengths"][0]["used"] == 10
+
+    def test_ban_links(self, test_client, mock_database, mock_redis):
+        """Блокировка по коротким кодам и хосту сбрасывает ссылки и обратный индекс из Redis одним pipeline"""
+        from unittest.mock import patch
+        from pydantic import SecretStr
+        mock_database.set_links_banned.return_value = [("hash1", "urlhash1"), ("hash2", None)]
+        pipe = mock_redis.pipeline.return_value
+
+        with patch.object(app_context.api_config, 'admin_token', SecretStr("secret")):
+            response = test_client.post("/api/v1/admin/links/ban", headers={"X-Admin-Token": "secret"},
+                                        json={"short_urls": ["abc12"], "hosts": ["evil.example"]})
+
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}. Response: {response.text}"
+        assert response.json() == {"links": 2}
+        mock_database.set_links_banned.assert_awaited_once_with(True, ["abc12"], ["evil.example"])
+        assert [call.args[0] for call in pipe.delete.call_args_list] == ["hash1", "hash2", "url:urlhash1"]
+        pipe.execute.assert_awaited_once()
+        mock_redis.publish.assert_awaited_once()
+
+    def test_unban_links_restores_cache(self, test_client, mock_database, mock_redis):
+        """Разблокированные ссылки сбрасываются из кешей и сразу возвращаются в Redis"""
+        import base64
+        from unittest.mock import patch
+        from pydantic import SecretStr
+        mock_database.set_links_banned.return_value = [("hash1", "urlhash1"), ("hash2", None)]
+        mock_database.get_active_links_by_hashes.return_value = [
+            (1, "hash1", base64.b64encode(b"cipher").decode(), None)
+        ]
+        pipe = mock_redis.pipeline.return_value
+
+        with patch.object(app_context.api_config, 'admin_token', SecretStr("secret")):
+            response = test_client.post("/api/v1/admin/links/unban", headers={"X-Admin-Token": "secret"},
+                                        json={"short_urls": ["abc12", "abc34"]})
+
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}. Response: {response.text}"
+        assert response.json() == {"links": 2}
+        mock_database.set_links_banned.assert_awaited_once_with(False, ["abc12", "abc34"], [])
+        mock_database.get_active_links_by_hashes.assert_awaited_once_with(["hash1", "hash2"])
+        assert [call.args[0] for call in pipe.delete.call_args_list] == ["hash1", "hash2", "url:urlhash1"]
+        assert [call.args[0] for call in pipe.set.call_args_list] == ["hash1"]
+        assert mock_redis.publish.await_count == 2
+
+    def test_unban_links_requires_target(self, test_client, mock_database):
+        """Запрос без коротких кодов и хостов отклоняется"""
+        from unittest.mock import patch
+        from pydantic import SecretStr
+        with patch.object(app_context.api_config, 'admin_token', SecretStr("secret")):
+            response = test_client.post("/api/v1/admin/links/unban", headers={"X-Admin-Token": "secret"}, json={})
+
+        assert response.status_code == 422, f"Expected 422, got {response.status_code}"
+        mock_database.set_links_banned.assert_not_called()
+
+
+class TestLinkStatsEndpoint:
+    """Тесты для эндпоинта статистики переходов"""
+
+    def test_link_stats(self, test_client, mock_database):
+        """Статистика по суточным агрегатам за указанный период"""
+        mock_database.get_link_click_stats.return_value = {"granularity": "day", "clicks": 3, "buckets": []}
+
+        response = test_client.get("/api/v1/links/abc123/stats?since=2024-01-01T00:00:00Z&until=2024-01-08T00:00:00Z")
+
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+        assert response.json()["clicks"] == 3
+        short_url, granularity, since, until, _ = mock_database.get_link_click_stats.call_args.args
+        assert (short_url, granularity, (until - since).days) == ("abc123", "day", 7)
+
+    def test_link_stats_not_found(self, test_client, mock_database):
+        """Статистика несуществующей ссылки"""
+        mock_database.get_link_click_stats.return_value = None
+
+        response = test_client.get("/api/v1/links/abc123/stats?granularity=hour")
+
+        assert response.status_code == 404, f"Expected 404, got {response.status_code}"
+
+
+class TestMetricsEndpoint:
+    """Тесты для эндпоинта метрик Prometheus"""
+
+    def test_metrics_after_redirect(self, test_client, mock_database, mock_link):
+        """Метрики этапов редиректа и поиска в базе после запроса"""
+        mock_database.get_redirect_target.return_value = mock_link
+
+        test_client.get("/abc123", follow_redirects=False)
+        response = test_client.get("/metrics")
+
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+        assert response.headers["content-type"].startswith("text/plain")
+        assert 'link_shortener_stage_seconds_count{handler="redirect",stage="db"}' in response.text
+        assert 'link_shortener_redirect_db_fallbacks_total{result="found"}' in response.text
+        assert "link_shortener_click_queue_depth" in response.text
+        mock_database.get_redirect_target.assert_called_once_with("abc123")
+
+    def test_metrics_summed_across_workers(self, tmp_path):
+        """Метрики воркеров суммируются через каталог PROMETHEUS_MULTIPROC_DIR, gauge завершённого воркера не учитывается"""
+        import os
+        import subprocess
+        import sys
+
+        env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+        worker = (
+            "import metrics; metrics.cache_lookups.labels('local').inc(); metrics.click_queue_depth.set(5); "
+            "metrics.mark_process_dead() if {dead} else None"
+        )
+        for dead in (False, True):
+            subprocess.run([sys.executable, "-c", worker.format(dead=dead)], env=env, check=True)
+
+        output = subprocess.run(
+            [sys.executable, "-c", "import sys, metrics; sys.stdout.buffer.write(metrics.generate_latest_metrics())"],
+            env=env, check=True, capture_output=True,
+        ).stdout.decode()
+
+        assert 'link_shortener_cache_lookups_total{result="local"} 2.0' in output
+        assert "link_shortener_click_queue_depth 5.0" in output
+
+    def test_metrics_disabled(self, test_client):
+        """Метрики отключены настройкой"""
+        from unittest.mock import patch
+        with patch.object(app_context.api_config, 'metrics_enabled', False):
+            response = test_client.get("/metrics")
 
-        assert "IP:" in metadata
\ No newline at end of file
+        assert response.status_code == 404, f"Expected 404, got {response.status_code}"
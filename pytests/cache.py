@@ -0,0 +1,552 @@
+"""
+Тесты для модуля кеша.
+"""
+import asyncio
+import base64
+import time
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+
+
+class TestCacheWarmup:
+    """Тесты для прогрева кеша."""
+
+    def test_warmup_streams_chunks_into_pipeline(self, mock_database, mock_redis):
+        """Тест, что прогрев читает ссылки пачками и пишет каждую пачку одним pipeline."""
+        from cache import warmup_links
+        from cache.records import encode_link_record
+        chunks = {
+            0: [(1, "hash1", "enc1", None), (2, "hash2", "enc2", "2030-01-01 00:00:00")],
+            2: [(3, "hash3", "enc3", None)],
+            3: [],
+        }
+        mock_database.get_active_links_chunk.side_effect = lambda after_id, limit, shard: chunks[after_id]
+        pipe = Mock(set=Mock(), execute=AsyncMock(return_value=[]))
+        mock_redis.pipeline.return_value = pipe
+
+        # Act
+        total = asyncio.run(warmup_links(2))
+
+        # Assert
+        assert total == 3
+        assert pipe.execute.await_count == 2
+        pipe.set.assert_any_call("hash3", encode_link_record(3, base64.b64decode("enc3")), exat=None)
+        pipe.set.assert_any_call(
+            "hash2", encode_link_record(2, base64.b64decode("enc2"), 1893456000), exat=1893456000
+        )
+        mock_redis.set.assert_not_called()
+
+    def test_warmup_reads_shards_separately(self, mock_database, mock_redis):
+        """Тест, что при нескольких шардах каждый шард обходится своей последовательностью пачек."""
+        from cache import warmup_links
+        chunks = {
+            (0, 0): [(1, "hash1", "enc1", None)],
+            (0, 1): [],
+            (1, 0): [(2 ** 40 + 1, "hash2", "enc2", None)],
+            (1, 2 ** 40 + 1): [],
+        }
+        mock_database.shards_count = 2
+        mock_database.get_active_links_chunk.side_effect = lambda after_id, limit, shard: chunks[(shard, after_id)]
+
+        # Act
+        total = asyncio.run(warmup_links(100))
+
+        # Assert
+        assert total == 2
+        assert mock_database.get_active_links_chunk.await_count == 4
+
+    def test_warmup_once_by_first_worker(self, mock_database, mock_redis):
+        """Тест, что Redis прогревает только процесс, первым занявший ключ прогрева."""
+        from cache import warmup_once
+        mock_database.get_active_links_chunk.side_effect = [[(1, "hash1", "enc1", None)], []]
+        mock_redis.set.return_value = True
+
+        # Act
+        total = asyncio.run(warmup_once(2))
+
+        # Assert
+        assert total == 1
+        assert mock_redis.set.call_args.kwargs["nx"] is True
+        mock_redis.pipeline.return_value.execute.assert_awaited_once()
+
+    def test_warmup_once_skipped_by_other_workers(self, mock_database, mock_redis, negative_cache):
+        """Тест, что остальные процессы не пишут в Redis, а только строят фильтр существующих кодов."""
+        from cache import BloomFilter, warmup_once
+        negative_cache.filter = BloomFilter(1000, 0.01)
+        mock_database.get_active_links_chunk.side_effect = [[(1, "ab" * 16, "enc1", None)], []]
+        mock_redis.set.return_value = None
+
+        # Act
+        total = asyncio.run(warmup_once(2))
+
+        # Assert
+        assert total == 0
+        mock_redis.pipeline.assert_not_called()
+        assert negative_cache.ready
+        assert "ab" * 16 in negative_cache.filter
+
+
+class TestLinkExpiry:
+    """Тесты для кеширования ссылок со сроком действия."""
+
+    def test_set_short_link_with_expiry(self, mock_redis, local_cache):
+        """Тест, что ссылка со сроком действия кешируется в Redis и в памяти не дольше этого срока."""
+        from datetime import datetime, timedelta, timezone
+        from cache import set_short_link
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=10)
+
+        # Act
+        asyncio.run(set_short_link("abc123", "https://example.com", 1, expires_at))
+
+        # Assert
+        assert mock_redis.set.call_args.kwargs["exat"] == int(expires_at.timestamp())
+        lookup_key = mock_redis.set.call_args.args[0]
+        assert local_cache._data[lookup_key][0] <= time.monotonic() + 10
+
+    def test_expired_link_not_cached(self, mock_redis, local_cache):
+        """Тест, что уже истёкшая ссылка не попадает в кеш."""
+        from datetime import datetime
+        from cache import set_short_link
+
+        # Act
+        asyncio.run(set_short_link("abc123", "https://example.com", 1, datetime(2000, 1, 1)))
+
+        # Assert
+        mock_redis.set.assert_not_called()
+        assert len(local_cache) == 0
+
+    def test_delete_short_links(self, mock_redis, local_cache):
+        """Тест, что удалённые ссылки удаляются из Redis одним pipeline и сбрасываются из кеша в памяти."""
+        from cache import delete_short_links
+
+        local_cache.set("hash1", "link")
+
+        # Act
+        asyncio.run(delete_short_links(["hash1", "hash2"]))
+
+        # Assert
+        pipe = mock_redis.pipeline.return_value
+        assert pipe.delete.call_count == 2
+        pipe.execute.assert_awaited_once()
+        mock_redis.publish.assert_awaited_once()
+        assert local_cache.get("hash1") is None
+
+
+    def test_original_url_index(self, mock_redis):
+        """Тест, что обратный индекс оригинальных URL пишется одним pipeline и читается одним MGET."""
+        from datetime import datetime
+        from cache import get_short_urls_by_original_urls, set_original_urls
+        pipe = mock_redis.pipeline.return_value
+        mock_redis.mget.side_effect = None
+        mock_redis.mget.return_value = [b"encrypted_abc123", None]
+
+        # Act
+        asyncio.run(set_original_urls([
+            ("https://example.com/1", "abc123", None),
+            ("https://example.com/2", "def456", datetime(2000, 1, 1)),
+        ]))
+        short_urls = asyncio.run(get_short_urls_by_original_urls(["https://example.com/1", "https://example.com/3"]))
+
+        # Assert
+        assert pipe.set.call_count == 1
+        assert pipe.set.call_args.args[0] == mock_redis.mget.call_args.args[0][0]
+        assert short_urls == ["abc123", None]
+
+
+class TestLocalCache:
+    """Тесты для кеша в памяти процесса."""
+
+    def test_lru_eviction(self):
+        """Тест, что при переполнении вытесняется самая давно использованная запись."""
+        from cache import LocalCache
+        local_cache = LocalCache(maxsize=2, ttl=60)
+        local_cache.set("a", 1)
+        local_cache.set("b", 2)
+        local_cache.get("a")
+
+        # Act
+        local_cache.set("c", 3)
+
+        # Assert
+        assert local_cache.get("b") is None
+        assert local_cache.get("a") == 1
+        assert local_cache.get("c") == 3
+        assert local_cache.stats()["evictions"] == 1
+
+    def test_ttl_expiry(self):
+        """Тест, что запись с истёкшим TTL не возвращается."""
+        from cache import LocalCache
+        local_cache = LocalCache(maxsize=10, ttl=0)
+
+        # Act
+        local_cache.set("a", 1)
+
+        # Assert
+        assert local_cache.get("a") is None
+        assert local_cache.stats()["misses"] == 1
+
+    def test_get_short_link_uses_local_cache(self, mock_redis, local_cache):
+        """Тест, что повторный запрос ссылки обслуживается из памяти без обращения к Redis."""
+        from cache import get_short_link
+        from cache.records import encode_link_record
+        mock_redis.get.return_value = encode_link_record(1, b"encrypted_https://example.com")
+
+        async def scenario():
+            return await get_short_link("abc123"), await get_short_link("abc123")
+
+        # Act
+        first, second = asyncio.run(scenario())
+
+        # Assert
+        assert first == second
+        assert first.id == 1
+        assert mock_redis.get.await_count == 1
+        assert local_cache.stats()["hits"] == 1
+
+    def test_get_short_link_not_cached_after_concurrent_invalidation(self, mock_redis, local_cache):
+        """Тест, что ссылка, сброшенная во время чтения из Redis, не сохраняется в памяти."""
+        from cache import get_short_link
+        from cache.records import encode_link_record
+        from utils import short_url_lookup_key
+        lookup_key = short_url_lookup_key("abc123")
+
+        async def get_invalidated(key):
+            # Сообщение о блокировке ссылки обработано слушателем, пока GET ждал ответа Redis
+            local_cache.invalidate(key)
+            return encode_link_record(1, b"encrypted_https://example.com")
+
+        mock_redis.get.side_effect = get_invalidated
+
+        # Act
+        link = asyncio.run(get_short_link("abc123"))
+
+        # Assert
+        assert link.id == 1
+        assert local_cache.peek(lookup_key) is None
+
+        # Act
+        mock_redis.get.side_effect = None
+        mock_redis.get.return_value = encode_link_record(1, b"encrypted_https://example.com")
+        asyncio.run(get_short_link("abc123"))
+
+        # Assert
+        assert local_cache.peek(lookup_key) is not None
+
+    def test_invalidate_publishes_to_other_workers(self, mock_redis, local_cache):
+        """Тест, что сброс ссылки удаляет её из памяти и рассылается остальным процессам."""
+        from cache import invalidate_short_links
+        local_cache.set("hash1", "link")
+
+        # Act
+        asyncio.run(invalidate_short_links(["hash1"]))
+
+        # Assert
+        assert local_cache.get("hash1") is None
+        mock_redis.publish.assert_awaited_once()
+        assert mock_redis.publish.call_args[0][1] == "hash1"
+
+
+class TestNegativeCache:
+    """Тесты для кеша несуществующих коротких кодов."""
+
+    def test_bloom_filter(self):
+        """Тест, что фильтр не даёт ложноотрицательных ответов, а доля ложноположительных близка к заданной."""
+        from cache import BloomFilter
+        from utils import short_url_lookup_key
+        bloom = BloomFilter(1000, 0.01)
+        present = [short_url_lookup_key(f"code{i}") for i in range(1000)]
+
+        # Act
+        for key in present:
+            bloom.add(key)
+        false_positives = sum(short_url_lookup_key(f"absent{i}") in bloom for i in range(10000))
+
+        # Assert
+        assert all(key in bloom for key in present)
+        assert false_positives / 10000 < 0.03
+        assert 0.005 < bloom.estimated_error_rate() < 0.02
+
+    def test_tombstone_in_redis(self, mock_redis, local_cache, negative_cache):
+        """Тест, что надгробие из Redis возвращается как заведомо несуществующая ссылка и кешируется в памяти."""
+        from cache import get_short_link, LINK_MISSING
+        mock_redis.get.return_value = b""
+
+        # Act
+        first = asyncio.run(get_short_link("abc123"))
+        second = asyncio.run(get_short_link("abc123"))
+
+        # Assert
+        assert first is LINK_MISSING and second is LINK_MISSING
+        mock_redis.get.assert_awaited_once()
+        assert negative_cache.tombstone_hits == 1
+
+    def test_set_short_link_missing(self, mock_redis, local_cache, negative_cache):
+        """Тест, что промах по базе записывает надгробие без перезаписи ключа и учитывает ложноположительный ответ."""
+        from cache import BloomFilter, set_short_link_missing
+        from utils import short_url_lookup_key
+        negative_cache.filter = BloomFilter(1000, 0.01)
+        negative_cache.ready = True
+        negative_cache.add(short_url_lookup_key("abc123"))
+
+        # Act
+        asyncio.run(set_short_link_missing("abc123"))
+
+        # Assert
+        assert mock_redis.set.call_args.kwargs["nx"] is True
+        assert negative_cache.false_positives == 1
+        assert negative_cache.stats()["observed_fpr"] == 1.0
+
+    def test_created_link_added_to_filter(self, mock_redis, local_cache, negative_cache):
+        """Тест, что созданная ссылка добавляется в фильтр и о ней оповещаются остальные процессы."""
+        from cache import BloomFilter, set_short_link
+        from utils import short_url_lookup_key
+        negative_cache.filter = BloomFilter(1000, 0.01)
+
+        # Act
+        asyncio.run(set_short_link("abc123", "https://example.com", 1))
+
+        # Assert
+        assert short_url_lookup_key("abc123") in negative_cache.filter
+        mock_redis.publish.assert_awaited_once()
+
+
+    def test_created_link_added_to_filter_when_redis_fails(self, mock_redis, local_cache, negative_cache):
+        """Тест, что при ошибке Redis созданная ссылка всё равно попадает в фильтр, а запрос не падает."""
+        from cache import BloomFilter, get_short_link, set_short_links
+        from utils import short_url_lookup_key
+        negative_cache.filter = BloomFilter(1000, 0.01)
+        mock_redis.pipeline.return_value.execute.side_effect = ConnectionError("Redis is down")
+        mock_redis.publish.side_effect = ConnectionError("Redis is down")
+
+        # Act
+        asyncio.run(set_short_links([("abc123", "ZW5jcnlwdGVkX2h0dHBzOi8vZXhhbXBsZS5jb20=", 1, None)]))
+        local_cache.clear()
+        result = asyncio.run(get_short_link("abc123"))
+
+        # Assert
+        assert short_url_lookup_key("abc123") in negative_cache.filter
+        assert result is None
+
+
+class TestLinkRecords:
+    """Тесты для формата записи ссылок в Redis."""
+
+    def test_binary_roundtrip(self):
+        """Тест кодирования и разбора двоичной записи со всеми флагами."""
+        from cache.records import encode_link_record, decode_link_record
+
+        # Act
+        record = decode_link_record(encode_link_record(300, b"\x00\xffcipher", expires_at=1893456000, banned=True))
+
+        # Assert
+        assert record.id == 300
+        assert bytes(record.ciphertext) == b"\x00\xffcipher"
+        assert record.expires_at == 1893456000
+        assert record.banned is True
+
+    def test_binary_smaller_than_legacy(self):
+        """Тест, что двоичная запись короче строковой на накладные расходы base64."""
+        from cache.records import encode_link_record, encode_legacy_link_record
+        from utils import encrypt_aes256_bytes
+        ciphertext = encrypt_aes256_bytes("https://example.com/some/long/path?with=query")
+
+        # Act
+        binary = encode_link_record(123456, ciphertext)
+        legacy = encode_legacy_link_record(123456, ciphertext)
+
+        # Assert
+        assert len(binary) == 2 + 3 + len(ciphertext)
+        assert len(legacy) > len(ciphertext) * 4 // 3
+
+    def test_legacy_record_decoded(self):
+        """Тест разбора записи в старом строковом формате во время обновления."""
+        from cache.records import decode_link_record
+        from utils import encrypt_aes256_base64, decrypt_aes256_bytes
+
+        # Act
+        record = decode_link_record((encrypt_aes256_base64("https://example.com") + "_42").encode())
+
+        # Assert
+        assert record.id == 42
+        assert record.expires_at is None
+        assert decrypt_aes256_bytes(record.ciphertext) == "https://example.com"
+
+
+def sharded_fakeredis(nodes: int, retry_seconds: float = 60):
+    """
+    Клиент ShardedRedis поверх отдельных серверов fakeredis и сами серверы по имени узла.
+    fakeredis входит в bench/requirements.txt, без него тесты пропускаются.
+    """
+    pytest.importorskip("fakeredis")
+    from fakeredis import FakeServer, aioredis as fake_aioredis
+    from cache import ShardedRedis
+    servers = {f"node{i}:6379/0": FakeServer() for i in range(nodes)}
+    clients = {name: fake_aioredis.FakeRedis(server=server) for name, server in servers.items()}
+    return ShardedRedis(clients, retry_seconds=retry_seconds), servers
+
+
+class TestShardedRedis:
+    """Тесты для распределения ключей по нескольким узлам Redis."""
+
+    def test_ring_moves_keys_only_to_added_node(self):
+        """Тест, что добавление пятого узла переносит около 1/5 ключей и только на новый узел."""
+        from cache import HashRing
+        keys = [f"{i:032x}" for i in range(20000)]
+        before = HashRing(["a", "b", "c", "d"])
+        after = HashRing(["a", "b", "c", "d", "e"])
+
+        # Act
+        moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+
+        # Assert
+        assert 0.15 < len(moved) / len(keys) < 0.25
+        assert {after.node_for(key) for key in moved} == {"e"}
+
+    def test_ring_moves_only_removed_node_keys(self):
+        """Тест, что удаление узла переносит только его ключи."""
+        from cache import HashRing
+        keys = [f"{i:032x}" for i in range(20000)]
+        before = HashRing(["a", "b", "c"])
+        after = HashRing(["a", "c"])
+
+        # Act
+        moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+
+        # Assert
+        assert moved
+        assert {before.node_for(key) for key in moved} == {"b"}
+
+    def test_pipeline_and_mget_split_by_node(self):
+        """Тест, что пакетная запись и чтение разбиваются по узлам и возвращают значения в исходном порядке."""
+        redis, servers = sharded_fakeredis(3)
+        keys = [f"key{i}" for i in range(30)]
+
+        async def scenario():
+            pipe = redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.set(key, key.encode())
+            results = await pipe.execute()
+            values = await redis.mget(keys + ["missing"])
+            per_node = {name: await client.dbsize() for name, client in redis.clients.items()}
+            return results, values, per_node
+
+        # Act
+        results, values, per_node = asyncio.run(scenario())
+
+        # Assert
+        assert results == [True] * len(keys)
+        assert values == [key.encode() for key in keys] + [None]
+        assert all(per_node.values())
+        assert per_node == {
+            name: sum(redis.ring.node_for(key) == name for key in keys) for name in servers
+        }
+
+    def test_unavailable_node_falls_back_to_database(self, mock_redis, local_cache):
+        """Тест, что ссылки с недоступного узла ищутся в базе, а остальные узлы продолжают отвечать."""
+        import base64
+        from unittest.mock import patch
+        from redis.exceptions import ConnectionError
+        from cache import get_short_link, set_short_links
+        from context import app_context
+        from utils import short_url_lookup_key
+        redis, servers = sharded_fakeredis(2)
+        codes = [f"code{i}" for i in range(20)]
+        down = redis.ring.node_for(short_url_lookup_key(codes[0]))
+        alive = next(code for code in codes if redis.ring.node_for(short_url_lookup_key(code)) != down)
+
+        async def scenario():
+            await set_short_links([
+                (code, base64.b64encode(f"encrypted_https://example.com/{code}".encode()).decode(), i, None)
+                for i, code in enumerate(codes)
+            ])
+            servers[down].connected = False
+            return await get_short_link(codes[0]), await get_short_link(alive)
+
+        # Act
+        with patch.object(app_context, "redis", redis):
+            lost, served = asyncio.run(scenario())
+
+        # Assert
+        assert lost is None
+        assert served.original_url == f"https://example.com/{alive}"
+        assert redis.ring.node_for(short_url_lookup_key(codes[0])) == down
+        with pytest.raises(ConnectionError):
+            redis.client(down)
+
+    def test_pubsub_survives_first_node_loss(self):
+        """Тест, что при недоступном первом узле оповещения публикуются и принимаются через остальные узлы."""
+        redis, servers = sharded_fakeredis(3)
+        first = redis.ring.nodes[0]
+
+        async def scenario():
+            servers[first].connected = False
+            await redis.publish("links:added", "probe")
+            pubsub = redis.pubsub()
+            await pubsub.subscribe("links:added")
+            await pubsub.get_message(timeout=1)
+            received = await redis.publish("links:added", "abc")
+            message = await pubsub.get_message(timeout=1)
+            await pubsub.aclose()
+            return received, message
+
+        # Act
+        received, message = asyncio.run(scenario())
+
+        # Assert
+        assert received == 1
+        assert message["data"] == b"abc"
+
+    def test_deletes_on_unavailable_node_deferred(self):
+        """Тест, что удаление ключей недоступного узла не падает и выполняется после возвращения узла."""
+        redis, servers = sharded_fakeredis(2, retry_seconds=0)
+        keys = [f"key{i}" for i in range(20)]
+        down = redis.ring.node_for(keys[0])
+
+        async def scenario():
+            for key in keys:
+                await redis.set(key, b"link")
+            servers[down].connected = False
+            pipe = redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.delete(key)
+            await pipe.execute()
+            servers[down].connected = True
+            return await redis.mget(keys)
+
+        # Act
+        values = asyncio.run(scenario())
+
+        # Assert
+        assert values == [None] * len(keys)
+
+    def test_warmup_with_unavailable_node(self, mock_database, negative_cache):
+        """Тест, что прогрев не прерывает запуск, если один из узлов недоступен, и фильтр строится."""
+        from unittest.mock import patch
+        from cache import BloomFilter, warmup_once
+        from context import app_context
+        redis, servers = sharded_fakeredis(3)
+        negative_cache.filter = BloomFilter(1000, 0.01)
+        links = [(i, f"{i:032x}", base64.b64encode(b"cipher").decode(), None) for i in range(1, 31)]
+        mock_database.get_active_links_chunk.side_effect = lambda after_id, limit, shard: [
+            link for link in links if link[0] > after_id
+        ][:limit]
+        lock_node = redis.ring.node_for(app_context.redis_config.cache_warmup_lock_key)
+        down = next(node for node in servers if node != lock_node)
+
+        async def scenario():
+            servers[down].connected = False
+            warmed = await warmup_once(10)
+            servers[lock_node].connected = False
+            await redis.delete(app_context.redis_config.cache_warmup_lock_key)
+            return warmed, await warmup_once(10)
+
+        # Act
+        with patch.object(app_context, "redis", redis):
+            warmed, skipped = asyncio.run(scenario())
+
+        # Assert
+        assert warmed == 30
+        assert skipped == 0
+        assert negative_cache.ready
+        assert all(link[1] in negative_cache.filter for link in links)
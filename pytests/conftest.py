@@ -1,8 +1,13 @@
+import asyncio
+
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import AsyncMock, Mock, patch, MagicMock
 from fastapi.testclient import TestClient
 from contextlib import asynccontextmanager
 
+from cache import LocalCache, NegativeCache
+from context import app_context
+
 
 @asynccontextmanager
 async def mock_cache_warmup(app):
@@ -17,14 +22,40 @@ with patch('cache.cache_warmup', mock_cache_warmup):
 def mock_all_dependencies():
     """Мокаем все зависимости глобально"""
     mock_db = MagicMock()
-    mock_db.create_link = Mock()
-    mock_db.get_link_by_short_url = Mock()
-    mock_db.add_click_on_link = Mock()
-    mock_db.get_all_links = Mock(return_value=[])
+    mock_db.shards_count = 1
+    mock_db.create_link = AsyncMock()
+    mock_db.create_links = AsyncMock()
+    mock_db.get_link_by_short_url = AsyncMock()
+    mock_db.get_redirect_target = AsyncMock()
+    mock_db.add_click_on_link = AsyncMock()
+    mock_db.get_all_links = AsyncMock(return_value=[])
+    mock_db.get_active_links_chunk = AsyncMock(return_value=[])
+    mock_db.get_short_url_pool_stats = AsyncMock(return_value=[])
+    mock_db.delete_expired_links = AsyncMock(return_value=[])
+    mock_db.rollup_clicks = AsyncMock(return_value=0)
+    mock_db.get_link_click_stats = AsyncMock()
+    mock_db.get_links_by_original_urls = AsyncMock(return_value={})
+    mock_db.set_links_banned = AsyncMock(return_value=[])
+    mock_db.get_active_links_by_hashes = AsyncMock(return_value=[])
+
+    mock_click_buffer = Mock()
+    mock_click_buffer.start = Mock()
+    mock_click_buffer.stop = AsyncMock()
+    mock_click_buffer.push = AsyncMock()
 
     mock_redis = Mock()
-    mock_redis.get = Mock(return_value=None)
-    mock_redis.set = Mock()
+    mock_redis.get = AsyncMock(return_value=None)
+    mock_redis.set = AsyncMock()
+    mock_redis.mget = AsyncMock(side_effect=lambda keys: [None] * len(keys))
+    mock_redis.pipeline = Mock(return_value=Mock(set=Mock(), delete=Mock(), execute=AsyncMock(return_value=[])))
+    mock_redis.publish = AsyncMock()
+    mock_redis.aclose = AsyncMock()
+
+    async def listen_forever():
+        await asyncio.Event().wait()
+        yield
+
+    mock_redis.pubsub = Mock(return_value=Mock(subscribe=AsyncMock(), aclose=AsyncMock(), listen=listen_forever))
 
     from dataclasses import dataclass
 
@@ -35,17 +66,22 @@ def mock_all_dependencies():
 
     mock_link_cached = MockLinkCached(original_url="https://example.com", id=1)
 
-    with patch('api.main.database', mock_db):
-        with patch('cache.main.database', mock_db):
-            with patch('cache.main.r', mock_redis):
-                with patch('cache.main.encrypt_aes256_base64') as mock_encrypt:
-                    with patch('cache.main.decrypt_aes256_base64_bytes') as mock_decrypt:
-                        mock_encrypt.side_effect = lambda x: f"encrypted_{x}"
-                        mock_decrypt.side_effect = lambda x: x.replace("encrypted_", "")
+    with patch.object(app_context, 'async_database', mock_db), \
+            patch.object(app_context, 'click_buffer', mock_click_buffer):
+        with patch.object(app_context, 'redis', mock_redis), \
+                patch.object(app_context, 'local_cache', LocalCache(100, 60)) as local_cache, \
+                patch.object(app_context, 'negative_cache', NegativeCache(None)) as negative_cache:
+                with patch('cache.main.encrypt_aes256_bytes') as mock_encrypt:
+                    with patch('cache.main.decrypt_aes256_bytes') as mock_decrypt:
+                        mock_encrypt.side_effect = lambda x: f"encrypted_{x}".encode()
+                        mock_decrypt.side_effect = lambda x: bytes(x).decode().replace("encrypted_", "")
 
                         yield {
                             'database': mock_db,
+                            'click_buffer': mock_click_buffer,
                             'redis': mock_redis,
+                            'local_cache': local_cache,
+                            'negative_cache': negative_cache,
                             'link_cached': mock_link_cached,
                             'encrypt': mock_encrypt,
                             'decrypt': mock_decrypt
@@ -55,7 +91,7 @@ def mock_all_dependencies():
 @pytest.fixture
 def test_client():
     """Создаем тестовый клиент"""
-    with TestClient(app) as client:
+    with patch('cache.cache_warmup', mock_cache_warmup), TestClient(app) as client:
         yield client
 
 
@@ -64,11 +100,26 @@ def mock_database(mock_all_dependencies):
     return mock_all_dependencies['database']
 
 
+@pytest.fixture
+def mock_click_buffer(mock_all_dependencies):
+    return mock_all_dependencies['click_buffer']
+
+
 @pytest.fixture
 def mock_redis(mock_all_dependencies):
     return mock_all_dependencies['redis']
 
 
+@pytest.fixture
+def local_cache(mock_all_dependencies):
+    return mock_all_dependencies['local_cache']
+
+
+@pytest.fixture
+def negative_cache(mock_all_dependencies):
+    return mock_all_dependencies['negative_cache']
+
+
 @pytest.fixture
 def mock_link_cached(mock_all_dependencies):
     return mock_all_dependencies['link_cached']
@@ -88,4 +139,5 @@ def mock_link():
     mock_link.id = 1
     mock_link.original_url = "https://example.com"
     mock_link.short_url = "abc123"
+    mock_link.expires_at = None
     return mock_link
\ No newline at end of file
@@ -8,17 +8,37 @@ import sqlite3
 class TestDatabaseClass:
     """Тесты для класса Database."""
 
-    def setup_method(self):
-        """Настройка перед каждым тестом."""
-        from database import Database
+    @pytest.fixture(autouse=True)
+    def setup_db(self, tmp_path, monkeypatch):
+        """Настройка перед каждым тестом: отдельная мигрированная база во временном каталоге."""
+        from database import Database, DatabaseMigrator
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
         self.db = Database()
+        DatabaseMigrator(self.db).upgrade()
+        yield
+        self.db.close()
 
     def test_init_creates_connection(self):
-        """Тест инициализации подключения к базе данных."""
+        """Тест инициализации пула соединений с базой данных в режиме WAL."""
+        # Act
+        with self.db.pool.writer() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            journal_mode = cursor.fetchone()[0]
+        with self.db.pool.reader() as cursor:
+            assert isinstance(cursor, sqlite3.Cursor)
+
+        # Assert
+        assert journal_mode == "wal"
+
+    def test_readers_not_blocked_by_writer(self):
+        """Тест, что чтение выполняется, пока открыта транзакция на запись."""
+        # Act
+        with self.db.pool.writer() as writer_cursor:
+            writer_cursor.execute("SELECT 1")
+            result = self.db.get_link_by_short_url("nonexistent_url_12345")
+
         # Assert
-        assert self.db.connection is not None
-        assert self.db.cursor is not None
-        assert isinstance(self.db.connection, sqlite3.Connection)
+        assert result is None
 
     def test_get_link_by_short_url_not_found(self):
         """Тест поиска несуществующей ссылки."""
@@ -32,7 +52,7 @@ class TestDatabaseClass:
         """Тест добавления клика по ссылке."""
         # Act - просто проверяем что функция не падает
         try:
-            self.db.add_click_on_link(99999, "test metadata")  # Несуществующий ID
+            self.db.add_click_on_link(99999, "Test-Agent/1.0", "127.0.0.1")  # Несуществующий ID
             assert True
         except Exception as e:
             if "FOREIGN KEY" in str(e):
@@ -62,4 +82,888 @@ class TestLinkModel:
 
         assert link.id == 1
         assert link.clicks == 5
-        assert link.short_url_length == 8
\ No newline at end of file
+        assert link.short_url_length == 8
+
+    def test_link_lazy_fields(self):
+        """Тест, что даты разбираются, а URL расшифровывается только при обращении."""
+        from datetime import datetime
+        import utils
+        from database import Link
+
+        link = Link.from_encrypted(1, "abcde", utils.encrypt_aes256_base64("https://example.com"), 0, 5,
+                                   1, None, "2024-01-01 10:00:00", None)
+
+        # Assert
+        assert link._created_at == "2024-01-01 10:00:00"
+        assert link.created_at == datetime(2024, 1, 1, 10)
+        assert link.banned is True
+        assert link.original_url == "https://example.com"
+        assert link.short_url == "abcde"
+        assert not hasattr(link, "__dict__")
+
+class TestConnectionPool:
+    """Тесты для пула соединений с SQLite."""
+
+    def test_connections_opened_per_process(self, tmp_path):
+        """Тест, что соединения открываются при первом обращении и заново в дочернем процессе."""
+        from config import DbConfig
+        from database.pool import ConnectionPool
+        pool = ConnectionPool(str(tmp_path / "test.db"), DbConfig())
+        assert pool._writer is None
+
+        with pool.reader() as cursor:
+            cursor.execute("SELECT 1")
+        inherited = pool._writer
+        # Имитация процесса-воркера, унаследовавшего пул после fork
+        pool._pid = -1
+
+        # Act
+        with pool.writer() as cursor:
+            cursor.execute("CREATE TABLE t(x INTEGER)")
+
+        # Assert
+        assert pool._writer is not inherited
+        pool.close()
+
+
+class TestAsyncDatabaseClass:
+    """Тесты для класса AsyncDatabase."""
+
+    def test_queries_run_outside_event_loop_thread(self):
+        """Тест, что запрос к SQLite выполняется не в потоке event loop."""
+        import asyncio
+        import threading
+        from database import AsyncDatabase
+
+        class FakeDatabase:
+            class pool:
+                readers_count = 1
+
+            shards = [pool]
+
+            def get_link_by_short_url(self, short_url):
+                return threading.current_thread().name
+
+        async_db = AsyncDatabase(FakeDatabase())
+
+        # Act
+        thread_name = asyncio.run(async_db.get_link_by_short_url("abc123"))
+
+        # Assert
+        assert thread_name != threading.current_thread().name
+        assert thread_name.startswith("sqlite")
+
+
+class TestClickBuffer:
+    """Тесты для буфера кликов."""
+
+    class FakeAsyncDatabase:
+        def __init__(self):
+            self.batches = []
+
+        async def add_clicks(self, clicks):
+            self.batches.append(list(clicks))
+
+    def _make_buffer(self, tmp_path, **kwargs):
+        from config import ClicksConfig
+        from database import ClickBuffer
+
+        config = ClicksConfig(click_spill_filename=str(tmp_path / "clicks.spill"), **kwargs)
+        db = self.FakeAsyncDatabase()
+        return ClickBuffer(db, config), db
+
+    def test_clicks_written_in_batches(self, tmp_path):
+        """Тест, что клики пишутся в базу пачками, а не по одному."""
+        import asyncio
+        buffer, db = self._make_buffer(tmp_path, click_flush_batch_size=10, click_flush_interval_ms=50)
+
+        async def scenario():
+            buffer.start()
+            for i in range(25):
+                await buffer.push(i, "Test-Agent/1.0", "127.0.0.1")
+            await asyncio.sleep(0.2)
+            await buffer.stop()
+
+        # Act
+        asyncio.run(scenario())
+
+        # Assert
+        assert sum(len(batch) for batch in db.batches) == 25
+        assert max(len(batch) for batch in db.batches) == 10
+        assert db.batches[0][0][:4] == (0, "Test-Agent/1.0", "127.0.0.1", None)
+
+    def test_stop_drains_queue(self, tmp_path):
+        """Тест, что при остановке все накопленные клики записываются в базу."""
+        import asyncio
+        buffer, db = self._make_buffer(tmp_path, click_flush_interval_ms=60000)
+
+        async def scenario():
+            buffer.start()
+            for i in range(5):
+                await buffer.push(i, "Test-Agent/1.0", "127.0.0.1")
+            await buffer.stop()
+
+        # Act
+        asyncio.run(scenario())
+
+        # Assert
+        assert sum(len(batch) for batch in db.batches) == 5
+
+    def test_stop_during_flush_keeps_batch(self, tmp_path):
+        """Тест, что остановка во время записи пачки дожидается её, а не теряет клики."""
+        import asyncio
+        buffer, db = self._make_buffer(tmp_path, click_flush_batch_size=3, click_flush_interval_ms=10)
+        original_add_clicks = db.add_clicks
+
+        async def slow_add_clicks(clicks):
+            await asyncio.sleep(0.05)
+            await original_add_clicks(clicks)
+
+        db.add_clicks = slow_add_clicks
+
+        async def scenario():
+            buffer.start()
+            for i in range(3):
+                await buffer.push(i, "Test-Agent/1.0", "127.0.0.1")
+            await asyncio.sleep(0.02)
+            await asyncio.wait_for(buffer.stop(), 1)
+
+        # Act
+        asyncio.run(scenario())
+
+        # Assert
+        assert sum(len(batch) for batch in db.batches) == 3
+
+    def test_drop_backpressure(self, tmp_path):
+        """Тест, что в режиме drop клики сверх размера очереди отбрасываются."""
+        import asyncio
+        buffer, db = self._make_buffer(tmp_path, click_queue_size=2, click_backpressure="drop")
+
+        async def scenario():
+            buffer._queue = asyncio.Queue(maxsize=2)
+            for i in range(5):
+                await buffer.push(i, "Test-Agent/1.0", "127.0.0.1")
+
+        # Act
+        asyncio.run(scenario())
+
+        # Assert
+        assert buffer.size == 2
+        assert buffer.dropped == 3
+
+    def test_spill_backpressure(self, tmp_path):
+        """Тест, что в режиме spill лишние клики попадают на диск и потом дописываются в базу."""
+        import asyncio
+        import os
+        buffer, db = self._make_buffer(tmp_path, click_queue_size=2, click_backpressure="spill")
+
+        async def scenario():
+            buffer._queue = asyncio.Queue(maxsize=2)
+            for i in range(5):
+                await buffer.push(i, "Test-Agent/1.0", "127.0.0.1")
+            assert (tmp_path / f"clicks.spill.{os.getpid()}").exists()
+            await buffer.stop()
+
+        # Act
+        asyncio.run(scenario())
+
+        # Assert
+        assert buffer.spilled == 3
+        assert sum(len(batch) for batch in db.batches) == 5
+        assert not list(tmp_path.iterdir())
+
+    def test_flusher_survives_spill_errors(self, tmp_path):
+        """Тест, что ошибка записи файла spill не останавливает фоновую запись кликов."""
+        import asyncio
+        from config import ClicksConfig
+        from database import ClickBuffer
+        db = self.FakeAsyncDatabase()
+        config = ClicksConfig(
+            click_spill_filename=str(tmp_path / "missing" / "clicks.spill"), click_flush_batch_size=1,
+            click_flush_interval_ms=10, click_queue_size=1
+        )
+        buffer = ClickBuffer(db, config)
+        original_add_clicks = db.add_clicks
+        failures = [RuntimeError("database is locked")]
+
+        async def flaky_add_clicks(clicks):
+            if failures:
+                raise failures.pop()
+            await original_add_clicks(clicks)
+
+        db.add_clicks = flaky_add_clicks
+
+        async def scenario():
+            buffer.start()
+            for i in range(3):
+                await asyncio.wait_for(buffer.push(i, "Test-Agent/1.0", "127.0.0.1"), 1)
+            await asyncio.sleep(0.1)
+            await buffer.stop()
+
+        # Act
+        asyncio.run(scenario())
+
+        # Assert
+        assert buffer.dropped == 1
+        assert [batch[0][0] for batch in db.batches] == [1, 2]
+
+    def test_spill_files_of_dead_workers_recovered(self, tmp_path):
+        """Тест, что файлы кликов завершившихся воркеров дописываются в базу, а файлы работающих не трогаются."""
+        import asyncio
+        import json
+        import os
+        import subprocess
+        import sys
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        buffer, db = self._make_buffer(tmp_path)
+        click = json.dumps([1, "curl", "10.0.0.1", None, "2024-01-01 10:00:00"]) + "\n"
+        (tmp_path / f"clicks.spill.{dead.pid}").write_text(click)
+        (tmp_path / f"clicks.spill.{dead.pid}.processing").write_text(click)
+        (tmp_path / f"clicks.spill.{os.getppid()}").write_text(click)
+
+        # Act
+        asyncio.run(buffer.stop())
+
+        # Assert
+        assert sum(len(batch) for batch in db.batches) == 2
+        assert [path.name for path in tmp_path.iterdir()] == [f"clicks.spill.{os.getppid()}"]
+
+    def test_legacy_spill_format(self, tmp_path):
+        """Тест, что клики из файла прежнего формата с текстовыми метаданными дописываются в базу."""
+        import asyncio
+        import json
+        buffer, db = self._make_buffer(tmp_path)
+        (tmp_path / "clicks.spill").write_text(
+            json.dumps([1, "User-Agent: curl\nIP: 10.0.0.1", "2024-01-01 10:00:00"]) + "\n"
+        )
+
+        # Act
+        asyncio.run(buffer.stop())
+
+        # Assert
+        assert db.batches == [[(1, "curl", "10.0.0.1", None, "2024-01-01 10:00:00")]]
+
+
+class TestDatabaseMigrator:
+    """Тесты для DatabaseMigrator."""
+
+    def test_short_url_hash_backfill(self, tmp_path, monkeypatch):
+        """Тест, что миграция 3 заполняет short_url_hash для существующих ссылок."""
+        import utils
+        from database import Database, DatabaseMigrator
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        migrator = DatabaseMigrator(db)
+        migrator.upgrade(2)
+        with db.pool.writer() as cursor:
+            cursor.execute(
+                "INSERT INTO links(short_url, original_url, short_url_length) VALUES(?,?,?)",
+                (utils.encrypt_aes256_base64("abcde"), utils.encrypt_aes256_base64("https://example.com"), 5)
+            )
+
+        # Act
+        migrator.upgrade(3)
+
+        # Assert
+        link = db.get_link_by_short_url("abcde")
+        assert link is not None
+        assert link.original_url == "https://example.com"
+
+    def test_structured_clicks_conversion(self, tmp_path, monkeypatch):
+        """Тест, что миграция 7 переносит текстовые метаданные кликов в колонки и откат собирает их обратно."""
+        from database import Database, DatabaseMigrator
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        migrator = DatabaseMigrator(db)
+        migrator.upgrade(6)
+        with db.pool.writer() as cursor:
+            cursor.execute("INSERT INTO links(short_url, original_url, short_url_length) VALUES('abcde', 'https://example.com', 5)")
+            link_id = cursor.lastrowid
+            cursor.executemany("INSERT INTO clicks(link_id, metadata) VALUES(?,?)", [
+                (link_id, "User-Agent: curl/8.0\nIP: 10.0.0.1"),
+                (link_id, "User-Agent: curl/8.0\nIP: ::1"),
+                (link_id, "User-Agent: \nIP: testclient"),
+            ])
+
+        # Act
+        migrator.upgrade(7)
+        with db.pool.reader() as cursor:
+            upgraded = cursor.execute("SELECT user_agent_id, ip FROM clicks ORDER BY id").fetchall()
+            user_agents = cursor.execute("SELECT value FROM user_agents").fetchall()
+        migrator.downgrade(6)
+        with db.pool.reader() as cursor:
+            downgraded = cursor.execute("SELECT metadata FROM clicks ORDER BY id").fetchall()
+
+        # Assert
+        assert user_agents == [("curl/8.0",)]
+        assert upgraded[0][0] == upgraded[1][0]
+        assert [ip for _, ip in upgraded] == [bytes([10, 0, 0, 1]), bytes(15) + b"\x01", None]
+        assert upgraded[2] == (None, None)
+        assert downgraded[0] == ("User-Agent: curl/8.0\nIP: 10.0.0.1",)
+
+    def test_user_agents_interned(self, tmp_path, monkeypatch):
+        """Тест, что одинаковый User-Agent хранится в партиции один раз, а клик без User-Agent записывается."""
+        from database import Database, DatabaseMigrator
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+        link_id, _ = db.create_link("https://example.com", 5)
+
+        # Act
+        db.add_clicks([(link_id, "curl/8.0", "10.0.0.1", None, "2024-01-01 10:00:00")] * 3)
+        partition = db.click_partitions.get("clicks_2024_01")
+        partition._user_agent_ids.clear()
+        db.add_clicks([(link_id, "curl/8.0", None, "https://ref.example", "2024-01-01 10:00:00")])
+        db.add_clicks([(link_id, None, "10.0.0.2", None, "2024-01-01 10:00:00")])
+
+        # Assert
+        with partition.pool.reader() as cursor:
+            assert cursor.execute("SELECT COUNT(*) FROM user_agents").fetchone()[0] == 1
+            rows = cursor.execute("SELECT user_agent_id, ip, referer FROM clicks ORDER BY id").fetchall()
+        assert len({row[0] for row in rows[:4]}) == 1
+        assert rows[3][1:] == (None, "https://ref.example")
+        assert rows[4][0] is None
+
+    def test_click_partitions_migration(self, tmp_path, monkeypatch):
+        """Тест, что миграция 8 переносит клики в партиции по месяцам с сохранением отметки агрегации."""
+        import os
+        from database import Database, DatabaseMigrator
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        migrator = DatabaseMigrator(db)
+        migrator.upgrade(7)
+        with db.pool.writer() as cursor:
+            cursor.execute("INSERT INTO links(short_url, original_url, short_url_length) VALUES('abcde', 'https://example.com', 5)")
+            link_id = cursor.lastrowid
+            cursor.executemany("INSERT INTO clicks(link_id, created_at) VALUES(?,?)", [
+                (link_id, "2024-01-31 23:00:00"), (link_id, "2024-02-01 00:00:00"), (link_id, "2024-02-02 00:00:00"),
+            ])
+            cursor.execute("UPDATE click_rollup_state SET last_click_id = 1")
+
+        # Act
+        migrator.upgrade(8)
+        rolled_up = db.rollup_clicks(100, 10)
+
+        # Assert
+        assert os.path.isdir(tmp_path / "test_clicks")
+        assert db.click_partitions.names() == ["clicks_2024_01", "clicks_2024_02"]
+        assert rolled_up == 2
+        assert db.click_partitions.get("clicks_2024_02").get_last_click_id() == 3
+        with db.pool.reader() as cursor:
+            assert cursor.execute("SELECT name FROM sqlite_master WHERE name IN ('clicks', 'user_agents')").fetchall() == []
+
+        # Act
+        migrator.downgrade(7)
+
+        # Assert
+        with db.pool.reader() as cursor:
+            assert cursor.execute("SELECT COUNT(*) FROM clicks").fetchone()[0] == 3
+            assert cursor.execute("SELECT * FROM click_rollup_state").fetchall() == [("clicks", 3)]
+        assert db.click_partitions.names() == []
+
+    def test_drop_expired_click_partitions(self, tmp_path, monkeypatch):
+        """Тест удаления устаревших партиций кликов с выгрузкой в архив."""
+        import csv
+        import gzip
+        from datetime import datetime, timezone
+        from database import Database, DatabaseMigrator
+        from utils import to_db_timestamp
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+        link_id, _ = db.create_link("https://example.com", 5)
+        now = datetime.now(timezone.utc)
+        db.add_clicks([
+            (link_id, "curl/8.0", "10.0.0.1", None, "2000-01-15 10:00:00"),
+            (link_id, None, None, None, "2000-02-15 10:00:00"),
+            (link_id, "curl/8.0", "10.0.0.1", None, to_db_timestamp(now)),
+        ])
+        db.rollup_clicks(100, 10)
+        db.add_clicks([(link_id, None, None, None, "2000-02-16 10:00:00")])
+
+        # Act
+        dropped = db.drop_expired_click_partitions(2, str(tmp_path / "archive"))
+
+        # Assert
+        assert dropped == ["clicks_2000_01"]
+        assert db.click_partitions.names() == ["clicks_2000_02", db.click_partitions.name_for(to_db_timestamp(now))]
+        with gzip.open(tmp_path / "archive" / "clicks_2000_01.csv.gz", "rt") as f:
+            assert list(csv.reader(f))[1] == ["1", str(link_id), "curl/8.0", "10.0.0.1", "", "2000-01-15 10:00:00"]
+
+        # Act
+        db.rollup_clicks(100, 10)
+        dropped = db.drop_expired_click_partitions(2, None)
+
+        # Assert
+        assert dropped == ["clicks_2000_02"]
+        assert db.drop_expired_click_partitions(2, None) == []
+        with db.pool.reader() as cursor:
+            assert [row[0] for row in cursor.execute("SELECT name FROM click_rollup_state")] == \
+                [db.click_partitions.name_for(to_db_timestamp(now))]
+
+    def test_split_queries_keeps_triggers(self):
+        """Тест, что ';' внутри триггера не разбивает его на отдельные запросы."""
+        from database import DatabaseMigrator
+        code = """CREATE TABLE a(x INTEGER);
+CREATE TRIGGER t AFTER INSERT ON a
+BEGIN
+    UPDATE a SET x = 1;
+END;
+"""
+
+        # Act
+        queries = DatabaseMigrator._split_queries(code)
+
+        # Assert
+        assert len(queries) == 2
+        assert queries[1].endswith("END;")
+
+    def test_short_url_pool_stats_maintained(self, tmp_path, monkeypatch):
+        """Тест, что счётчики занятых коротких кодов обновляются при вставке и удалении ссылок."""
+        from database import Database, DatabaseMigrator
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+
+        # Act
+        db.create_link("https://example.com/1", 5)
+        db.create_link("https://example.com/2", 5)
+        link_id, _ = db.create_link("https://example.com/3", 6)
+        with db.pool.writer() as cursor:
+            cursor.execute("DELETE FROM links WHERE id = ?", (link_id,))
+
+        # Assert
+        stats = {row["length"]: row for row in db.get_short_url_pool_stats()}
+        assert stats[5]["used"] == 2
+        assert stats[5]["capacity"] == 62 ** 5
+        assert stats[6]["used"] == 0
+
+
+    def test_create_links_batch(self, tmp_path, monkeypatch):
+        """Тест пакетного создания ссылок с ошибками для уже существующих URL."""
+        import utils
+        from database import Database, DatabaseMigrator, ShortLinkWithThatUrlAlreadyExists
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+        db.create_link("https://example.com/existing", 5)
+
+        # Act
+        results = db.create_links([
+            ("https://example.com/1", 5, None),
+            ("https://example.com/existing", 5, None),
+            ("https://example.com/2", 6, None),
+            ("https://example.com/1", 5, None),
+        ])
+
+        # Assert
+        assert isinstance(results[1], ShortLinkWithThatUrlAlreadyExists)
+        assert isinstance(results[3], ShortLinkWithThatUrlAlreadyExists)
+        link_id, short_url, original_url_encoded = results[2]
+        link = db.get_link_by_short_url(short_url)
+        assert link.id == link_id
+        assert link.original_url == "https://example.com/2"
+        assert original_url_encoded == utils.encrypt_aes256_base64("https://example.com/2")
+        assert len(short_url) == 6
+
+    def test_get_links_by_original_urls(self, tmp_path, monkeypatch):
+        """Тест поиска существующих ссылок по каноническому URL без попытки записи."""
+        from database import Database, DatabaseMigrator, ShortLinkWithThatUrlAlreadyExists
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+        link_id, short_url = db.create_link("https://example.com/page", 5)
+
+        # Act
+        found = db.get_links_by_original_urls(["https://EXAMPLE.com:443/page", "https://example.com/other"])
+
+        # Assert
+        assert found == {"https://EXAMPLE.com:443/page": (link_id, short_url, None)}
+        with pytest.raises(ShortLinkWithThatUrlAlreadyExists):
+            db.create_link("HTTPS://example.com/page", 5)
+        assert isinstance(db.create_links([("https://example.com:443/page", 5, None)])[0], ShortLinkWithThatUrlAlreadyExists)
+
+    def test_original_url_hash_backfill(self, tmp_path, monkeypatch):
+        """Тест, что миграция 9 заполняет хеш оригинального URL для уже созданных ссылок."""
+        from database import Database, DatabaseMigrator
+        from utils import encrypt_aes256_base64
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        migrator = DatabaseMigrator(db)
+        migrator.upgrade(8)
+        with db.pool.writer() as cursor:
+            cursor.execute(
+                "INSERT INTO links(short_url, original_url, short_url_length) VALUES(?,?,?)",
+                (encrypt_aes256_base64("abcde"), encrypt_aes256_base64("https://example.com/page"), 5)
+            )
+
+        # Act
+        migrator.upgrade(9)
+
+        # Assert
+        found = db.get_links_by_original_urls(["https://example.com/page"])
+        assert found["https://example.com/page"][1] == "abcde"
+
+    def test_host_hash_backfill(self, tmp_path, monkeypatch):
+        """Тест, что миграция 10 заполняет host_hash для уже созданных ссылок."""
+        from database import Database, DatabaseMigrator
+        from utils import encrypt_aes256_base64
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        migrator = DatabaseMigrator(db)
+        migrator.upgrade(9)
+        with db.pool.writer() as cursor:
+            cursor.execute(
+                "INSERT INTO links(short_url, original_url, short_url_length) VALUES(?,?,?)",
+                (encrypt_aes256_base64("abcde"), encrypt_aes256_base64("https://Evil.example/page"), 5)
+            )
+
+        # Act
+        migrator.upgrade(10)
+
+        # Assert
+        assert len(db.set_links_banned(True, [], ["evil.example"])) == 1
+        assert db.get_redirect_target("abcde") is None
+
+    def test_set_links_banned(self, tmp_path, monkeypatch):
+        """Тест блокировки ссылок по короткому коду и по хосту и снятия блокировки."""
+        import utils
+        from database import Database, DatabaseMigrator
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+        _, evil1 = db.create_link("https://evil.example/1", 5)
+        _, evil2 = db.create_link("https://EVIL.example:443/2", 5)
+        _, other = db.create_link("https://sub.evil.example/3", 5)
+        _, good = db.create_link("https://good.example/", 5)
+
+        # Act
+        banned = db.set_links_banned(True, [good], ["evil.example"])
+
+        # Assert
+        assert sorted(short_url_hash for short_url_hash, _ in banned) == sorted(
+            utils.short_url_lookup_key(short_url) for short_url in (evil1, evil2, good)
+        )
+        assert (utils.short_url_lookup_key(good), utils.original_url_lookup_key("https://good.example/")) in banned
+        assert db.get_redirect_target(evil1) is None
+        assert db.get_redirect_target(good) is None
+        assert db.get_redirect_target(other) is not None
+        assert db.get_links_by_original_urls(["https://evil.example/1"]) == {}
+
+        # Act
+        db.set_links_banned(False, [], ["evil.example"])
+
+        # Assert
+        assert db.get_redirect_target(evil2).original_url == "https://EVIL.example:443/2"
+        assert db.get_redirect_target(good) is None
+        assert sorted(link[1] for link in db.get_active_links_by_hashes(
+            [utils.short_url_lookup_key(short_url) for short_url in (evil1, evil2, good)]
+        )) == sorted(utils.short_url_lookup_key(short_url) for short_url in (evil1, evil2))
+
+    def test_sharded_links(self, tmp_path, monkeypatch):
+        """Тест, что ссылки распределяются по шардам по хешу кода и находятся во всех операциях."""
+        import os
+        import utils
+        from database import Database, DatabaseMigrator, ShortLinkWithThatUrlAlreadyExists
+        from database.shards import SHARD_ID_RANGE, shard_index
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        monkeypatch.setenv("DB_SHARDS", "3")
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+
+        # Act
+        created = [db.create_link(f"https://example.com/{i}", 5) for i in range(10)]
+        created += [result[:2] for result in db.create_links([(f"https://example.com/batch/{i}", 6, None) for i in range(20)])]
+
+        # Assert
+        assert os.path.exists(tmp_path / "test_shard1.db") and os.path.exists(tmp_path / "test_shard2.db")
+        for link_id, short_url in created:
+            shard = shard_index(utils.short_url_lookup_key(short_url), 3)
+            assert shard * SHARD_ID_RANGE < link_id < (shard + 1) * SHARD_ID_RANGE
+            assert db.get_link_by_short_url(short_url).id == link_id
+        assert [link[0] for link in db.get_active_links_chunk(0, 100)] == sorted(link_id for link_id, _ in created)
+        assert len(db.get_active_links_chunk(0, 7)) == 7
+        assert sum(stats["used"] for stats in db.get_short_url_pool_stats()) == 30
+        with pytest.raises(ShortLinkWithThatUrlAlreadyExists):
+            db.create_link("https://example.com/3", 6)
+        assert isinstance(db.create_links([("https://example.com/batch/1", 5, None)])[0], ShortLinkWithThatUrlAlreadyExists)
+        assert len(db.get_links_by_original_urls([f"https://example.com/{i}" for i in range(10)])) == 10
+        with db.shards[1].pool.reader() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            shard_tables = {row[0] for row in cursor.fetchall()}
+            cursor.execute("SELECT MAX(number) FROM migrations")
+            shard_version = cursor.fetchone()[0]
+        assert "links" in shard_tables
+        assert not shard_tables & {"clicks", "user_agents", "click_rollups", "click_rollup_state"}
+        assert shard_version == DatabaseMigrator(db)._get_current_version()
+
+    def test_original_url_claimed_across_shards(self, tmp_path, monkeypatch):
+        """Тест, что ссылка на один URL не создаётся дважды в разных шардах, а заявки снимаются и переходят."""
+        from concurrent.futures import ThreadPoolExecutor
+        from datetime import datetime
+        from database import Database, DatabaseMigrator, ShortLinkWithThatUrlAlreadyExists
+        import utils
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        monkeypatch.setenv("DB_SHARDS", "3")
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+        db.create_link("https://example.com/expired", 5, datetime(2000, 1, 1))
+        abandoned = utils.original_url_lookup_key("https://example.com/abandoned")
+        with db.pool.writer() as cursor:
+            cursor.execute(
+                "INSERT INTO original_url_claims(original_url_hash, claimed_at) VALUES(?, '2000-01-01 00:00:00')",
+                (abandoned,)
+            )
+
+        urls = [(f"https://example.com/same/{i}", 5, None) for i in range(50)]
+        workers = [Database() for _ in range(4)]
+
+        # Act
+        with ThreadPoolExecutor(len(workers)) as executor:
+            batches = list(executor.map(lambda worker: worker.create_links(urls), workers))
+        db.delete_expired_links(10)
+        recreated = db.create_link("https://example.com/expired", 5)
+        abandoned_link = db.create_link("https://example.com/abandoned", 5)
+
+        # Assert
+        for results in zip(*batches):
+            assert sum(not isinstance(result, Exception) for result in results) == 1
+            assert all(isinstance(result, (tuple, ShortLinkWithThatUrlAlreadyExists)) for result in results)
+        assert len(db.get_all_links()) == 52
+        with pytest.raises(ShortLinkWithThatUrlAlreadyExists):
+            db.create_link("https://example.com/same/1", 6)
+        assert db.get_link_by_short_url(recreated[1]).id == recreated[0]
+        assert db.get_link_by_short_url(abandoned_link[1]).id == abandoned_link[0]
+        with db.shards[1].pool.reader() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE name = 'original_url_claims'")
+            assert cursor.fetchone() is None
+
+    def test_rebalance_shards(self, tmp_path, monkeypatch):
+        """Тест переноса ссылок при увеличении и уменьшении количества шардов и выдачи id после переноса."""
+        import os
+        import utils
+        from database import Database, DatabaseMigrator
+        from database.shards import SHARD_ID_RANGE, shard_index
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+        created = [result[:2] for result in db.create_links([(f"https://example.com/{i}", 5, None) for i in range(50)])]
+        db.close()
+
+        # Act
+        monkeypatch.setenv("DB_SHARDS", "4")
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+        moved = db.rebalance_shards(batch_size=7)
+
+        # Assert
+        assert 0 < moved < 50
+        assert all(db.get_redirect_target(short_url).id == link_id for link_id, short_url in created)
+        assert db.rebalance_shards() == 0
+        db.close()
+
+        # Act
+        monkeypatch.setenv("DB_SHARDS", "2")
+        db = Database()
+        db.rebalance_shards()
+
+        # Assert
+        assert not os.path.exists(tmp_path / "test_shard2.db")
+        assert not os.path.exists(tmp_path / "test_shard3.db")
+        assert all(db.get_redirect_target(short_url).id == link_id for link_id, short_url in created)
+        assert len(db.get_all_links()) == 50
+
+        # Act
+        created += [db.create_link(f"https://example.com/two/{i}", 5) for i in range(30)]
+        db.close()
+        monkeypatch.setenv("DB_SHARDS", "3")
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+        db.rebalance_shards()
+        created += [db.create_link(f"https://example.com/new/{i}", 5) for i in range(30)]
+        created += [result[:2] for result in db.create_links([(f"https://example.com/batch/{i}", 6, None) for i in range(40)])]
+
+        # Assert
+        assert len({link_id for link_id, _ in created}) == len(created)
+        for link_id, short_url in created[80:]:
+            shard = shard_index(utils.short_url_lookup_key(short_url), 3)
+            assert shard * SHARD_ID_RANGE < link_id < (shard + 1) * SHARD_ID_RANGE
+
+    def test_delete_expired_links(self, tmp_path, monkeypatch):
+        """Тест удаления ссылок с истёкшим сроком действия пачками."""
+        from datetime import datetime, timedelta, timezone
+        from database import Database, DatabaseMigrator
+        from utils import short_url_lookup_key
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+        expired = [db.create_link(f"https://example.com/{i}", 5, datetime(2000, 1, 1))[1] for i in range(3)]
+        _, active = db.create_link("https://example.com/active", 5, datetime.now(timezone.utc) + timedelta(days=1))
+        _, permanent = db.create_link("https://example.com/permanent", 5)
+
+        # Act
+        first = db.delete_expired_links(2)
+        second = db.delete_expired_links(2)
+
+        # Assert
+        assert len(first) == 2
+        assert set(first + second) == {short_url_lookup_key(short_url) for short_url in expired}
+        assert db.get_link_by_short_url(expired[0]) is None
+        assert db.get_link_by_short_url(active) is not None
+        assert db.get_link_by_short_url(permanent) is not None
+        assert db.delete_expired_links(2) == []
+
+    def test_get_redirect_target(self, tmp_path, monkeypatch):
+        """Тест выборки для редиректа только id и оригинального URL активной ссылки."""
+        from datetime import datetime
+        from database import Database, DatabaseMigrator
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+        link_id, short_url = db.create_link("https://example.com/active", 5)
+        _, expired = db.create_link("https://example.com/expired", 5, datetime(2000, 1, 1))
+
+        # Act
+        target = db.get_redirect_target(short_url)
+
+        # Assert
+        assert (target.id, target.original_url) == (link_id, "https://example.com/active")
+        assert db.get_redirect_target(expired) is None
+        assert db.get_redirect_target("zzzzz") is None
+
+    def test_rollup_clicks_incremental(self, tmp_path, monkeypatch):
+        """Тест инкрементальной агрегации кликов: каждый клик учитывается ровно один раз."""
+        from datetime import datetime, timedelta, timezone
+        from database import Database, DatabaseMigrator
+
+        monkeypatch.setenv("DB_FILENAME", str(tmp_path / "test.db"))
+        db = Database()
+        DatabaseMigrator(db).upgrade()
+        link_id, short_url = db.create_link("https://example.com", 5)
+        db.add_clicks([
+            (link_id, "curl" if i % 3 else "firefox", f"10.0.0.{i % 4}", None, "2024-01-01 10:15:00")
+            for i in range(6)
+        ])
+
+        # Act
+        first = db.rollup_clicks(4, 10)
+        second = db.rollup_clicks(4, 10)
+        db.add_clicks([(link_id, "curl", "10.0.0.9", None, "2024-01-02 23:59:59")])
+        third = db.rollup_clicks(4, 10)
+        since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        daily = db.get_link_click_stats(short_url, "day", since, since + timedelta(days=7), 1)
+        hourly = db.get_link_click_stats(short_url, "hour", since, since + timedelta(hours=11), 10)
+
+        # Assert
+        assert (first, second, third, db.rollup_clicks(4, 10)) == (4, 2, 1, 0)
+        assert daily["clicks"] == 7
+        assert daily["unique_ips"] == 5
+        assert daily["top_user_agents"] == [{"user_agent": "curl", "clicks": 5}]
+        assert [bucket["bucket"] for bucket in daily["buckets"]] == ["2024-01-01 00:00:00", "2024-01-02 00:00:00"]
+        assert hourly["buckets"] == [{"bucket": "2024-01-01 10:00:00", "clicks": 6, "unique_ips": 4}]
+        assert db.get_link_click_stats("zzzzz", "day", since, since + timedelta(days=7), 10) is None
+
+
+class TestClickRollups:
+    """Тесты для агрегатов кликов."""
+
+    def test_hyperloglog_estimate(self):
+        """Тест точности оценки уникальных значений и объединения скетчей."""
+        from database.rollups import HyperLogLog
+
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(20000):
+            first.add(f"10.0.{i // 256}.{i % 256}")
+        for i in range(10000, 30000):
+            second.add(f"10.0.{i // 256}.{i % 256}")
+
+        # Act
+        first.merge(HyperLogLog.from_bytes(second.to_bytes()))
+
+        # Assert
+        assert abs(first.count() - 30000) < 30000 * 0.1
+        with pytest.raises(ValueError):
+            first.merge(HyperLogLog(precision=8))
+
+    def test_aggregate_clicks(self):
+        """Тест разбиения кликов по часовым и суточным корзинам."""
+        from database.rollups import aggregate_clicks
+
+        clicks = [
+            (1, 7, "curl", bytes([1, 1, 1, 1]), None, "2024-01-01 10:15:00"),
+            (2, 7, "curl", bytes([1, 1, 1, 1]), None, "2024-01-01 11:00:00"),
+            (3, 7, None, None, None, "2024-01-01 11:30:00"),
+        ]
+
+        # Act
+        buckets = aggregate_clicks(clicks, 10)
+
+        # Assert
+        assert buckets[(7, "day", "2024-01-01 00:00:00")].clicks == 3
+        assert buckets[(7, "day", "2024-01-01 00:00:00")].unique_ips.count() == 1
+        assert buckets[(7, "hour", "2024-01-01 11:00:00")].clicks == 2
+        assert buckets[(7, "hour", "2024-01-01 10:00:00")].user_agents == {"curl": 1}
+
+
+class TestShortCodeAllocator:
+    """Тесты для пула свободных коротких кодов."""
+
+    def test_take_returns_unique_codes(self):
+        """Тест, что пул выдаёт разные коды нужной длины и пополняется пачкой."""
+        from database.allocator import ShortCodeAllocator
+        calls = []
+        allocator = ShortCodeAllocator(lambda hashes: calls.append(len(hashes)) or set(), pool_size=50)
+
+        # Act
+        codes = [allocator.take(6) for _ in range(50)]
+
+        # Assert
+        assert len(set(codes)) == 50
+        assert all(len(code) == 6 for code in codes)
+        assert len(calls) == 1
+
+    def test_used_codes_skipped(self):
+        """Тест, что занятые коды не выдаются, а их доля учитывается в оценке заполненности."""
+        import utils
+        from database.allocator import ShortCodeAllocator
+        used = set()
+
+        def find_used(hashes):
+            # Занят каждый второй кандидат
+            used.update(hashes[::2])
+            return used.intersection(hashes)
+
+        allocator = ShortCodeAllocator(find_used, pool_size=100)
+
+        # Act
+        code = allocator.take(5)
+
+        # Assert
+        assert utils.short_url_lookup_key(code) not in used
+        assert 0.4 < allocator.fill_ratio(5) < 0.6
+
+    def test_exhausted_length(self):
+        """Тест, что при отсутствии свободных кодов пул сообщает об исчерпании."""
+        from database.allocator import ShortCodeAllocator
+        allocator = ShortCodeAllocator(lambda hashes: set(hashes), pool_size=10)
+
+        # Act & Assert
+        assert allocator.take(5) is None
+        assert allocator.fill_ratio(5) == 1.0
@@ -1,5 +1,7 @@
 import pytest
-from utils import encrypt_aes256_base64, decrypt_aes256_base64_bytes, generate_random_string
+from context import app_context
+from utils import encrypt_aes256_base64, decrypt_aes256_base64_bytes, generate_random_string, AESEngine, \
+    short_url_lookup_key, canonicalize_url, original_url_lookup_key, url_host, host_lookup_key
 
 
 class TestEncryption:
@@ -53,6 +55,86 @@ class TestEncryption:
             decrypt_aes256_base64_bytes(invalid_base64)
 
 
+class TestAESEngine:
+    """Тесты для AESEngine."""
+
+    def test_engine_matches_module_functions(self):
+        """Тест, что движок даёт тот же результат, что и функции модуля."""
+        # Arrange
+        test_string = "https://example.com/test-url"
+
+        # Act
+        encrypted = app_context.aes_engine.encrypt(test_string)
+
+        # Assert
+        assert encrypted == encrypt_aes256_base64(test_string)
+        assert decrypt_aes256_base64_bytes(encrypted) == test_string
+
+    def test_encrypt_decrypt_many(self):
+        """Тест, что пакетное шифрование и дешифрование совпадают с поштучным для строк разной длины."""
+        # Arrange
+        strings = [f"https://example.com/{'x' * i}" for i in range(0, 100, 7)] + ["", "https://пример.рф/путь"]
+
+        # Act
+        encrypted = app_context.aes_engine.encrypt_many(strings)
+        decrypted = app_context.aes_engine.decrypt_many(encrypted)
+
+        # Assert
+        assert encrypted == [app_context.aes_engine.encrypt(s) for s in strings]
+        assert decrypted == strings
+        assert app_context.aes_engine.encrypt_many([]) == []
+
+    def test_decrypt_many_rejects_invalid_ciphertext(self):
+        """Тест, что пакетное дешифрование проверяет длину шифротекста и дополнение."""
+        import base64
+
+        # Act & Assert
+        with pytest.raises(ValueError):
+            app_context.aes_engine.decrypt_many([base64.b64encode(b"short").decode()])
+        with pytest.raises(ValueError):
+            app_context.aes_engine.decrypt_many([base64.b64encode(bytes(16)).decode()])
+
+    def test_short_url_lookup_key(self):
+        """Тест, что ключ поиска детерминирован и различается для разных коротких URL."""
+        # Act
+        key1 = short_url_lookup_key("abcde")
+        key2 = short_url_lookup_key("abcdf")
+
+        # Assert
+        assert key1 == short_url_lookup_key("abcde")
+        assert key1 != key2
+        assert len(key1) == 32
+
+    def test_original_url_lookup_key_canonical(self):
+        """Тест, что ключ поиска оригинального URL совпадает для разных записей одного URL."""
+        # Act & Assert
+        assert canonicalize_url("HTTPS://Example.COM:443") == "https://example.com/"
+        assert canonicalize_url("http://example.com:8080/a?b=1#c") == "http://example.com:8080/a?b=1#c"
+        assert canonicalize_url("https://user:pw@Example.com/Path") == "https://user:pw@example.com/Path"
+        assert original_url_lookup_key("https://EXAMPLE.com") == original_url_lookup_key("https://example.com:443/")
+        assert original_url_lookup_key("https://example.com/A") != original_url_lookup_key("https://example.com/a")
+
+    def test_host_lookup_key(self):
+        """Тест, что ключ хоста не зависит от регистра и записи хоста в URL."""
+        # Act & Assert
+        assert url_host("https://User@EXAMPLE.com.:8443/path") == "example.com"
+        assert url_host("http://[::1]/") == "::1"
+        assert host_lookup_key("Example.COM") == host_lookup_key(url_host("https://example.com/a"))
+        assert host_lookup_key("[::1]") == host_lookup_key(url_host("http://[::1]/"))
+        assert host_lookup_key("sub.example.com") != host_lookup_key("example.com")
+
+    def test_invalid_key_length(self):
+        """Тест, что ключ неверной длины отклоняется при создании движка."""
+        # Arrange
+        import base64
+        from config import AESConfig
+        config = AESConfig(aes_key_b64=base64.b64encode(b"short").decode(), aes_iv_b64=base64.b64encode(b"0" * 16).decode())
+
+        # Act & Assert
+        with pytest.raises(ValueError):
+            AESEngine(config)
+
+
 class TestRandomStringGeneration:
     """Тесты для генерации случайных строк."""
 
@@ -102,4 +184,35 @@ class TestRandomStringGeneration:
 
         # Assert
         assert result == ""
-        assert len(result) == 0
\ No newline at end of file
+        assert len(result) == 0
+
+class TestAppContext:
+    """Тесты для контекста приложения."""
+
+    def test_resources_created_on_first_access(self):
+        """Тест, что ресурс создаётся при первом обращении и переиспользуется."""
+        import asyncio
+        from context import AppContext
+        context = AppContext()
+
+        # Act
+        asyncio.run(context.aclose())
+        engine = context.aes_engine
+
+        # Assert
+        assert set(vars(context)) == {"aes_engine"}
+        assert context.aes_engine is engine
+
+    def test_import_creates_no_resources(self):
+        """Тест, что импорт приложения не читает конфигурацию и не создаёт соединения."""
+        import os
+        import subprocess
+        import sys
+        code = "import api; from context import app_context; print(sorted(vars(app_context)))"
+
+        # Act
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+        # Assert
+        assert result.stdout.strip() == "[]"
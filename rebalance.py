@@ -0,0 +1,15 @@
+import logging
+
+from database import Database, DatabaseMigrator
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    db = Database()
+    try:
+        # Файлы новых шардов создаются и мигрируются до переноса ссылок
+        DatabaseMigrator(db).upgrade()
+    except FileNotFoundError:
+        pass
+    moved = db.rebalance_shards()
+    logging.info(f"Rebalanced to {len(db.shards)} shards, {moved} links moved")
+    db.close()
@@ -1 +1,4 @@
-from .links import *
\ No newline at end of file
+from .links import *
+from .tasks import *
+from .dates import *
+from .clicks import *
@@ -0,0 +1,44 @@
+import ipaddress
+
+__all__ = ["pack_ip", "unpack_ip", "parse_click_metadata"]
+
+
+def pack_ip(host: str | None) -> bytes | None:
+    """
+    Упаковывает IP-адрес клиента для хранения в SQLite: 4 байта для IPv4, 16 байт для IPv6.
+
+    :param host: IP-адрес в текстовом виде
+    :return: Упакованный адрес или None, если host пустой или не является IP-адресом
+    """
+    if not host:
+        return None
+    try:
+        return ipaddress.ip_address(host).packed
+    except ValueError:
+        return None
+
+
+def unpack_ip(packed: bytes | None) -> str | None:
+    """
+    :param packed: Адрес, упакованный pack_ip
+    :return: IP-адрес в текстовом виде или None
+    """
+    if not packed:
+        return None
+    return str(ipaddress.ip_address(packed))
+
+
+def parse_click_metadata(metadata: str | None) -> tuple[str | None, str | None]:
+    """
+    Разбирает метаданные клика в прежнем текстовом формате "User-Agent: ...\\nIP: ...".
+
+    :param metadata: Метаданные клика
+    :return: Кортеж (User-Agent, IP), отсутствующие поля - None
+    """
+    user_agent = ip = None
+    for line in (metadata or "").splitlines():
+        if line.startswith("User-Agent: "):
+            user_agent = line[len("User-Agent: "):] or None
+        elif line.startswith("IP: "):
+            ip = line[len("IP: "):] or None
+    return user_agent, ip
@@ -0,0 +1,42 @@
+from datetime import datetime, timezone
+
+__all__ = ["DB_TIMESTAMP_FORMAT", "to_utc", "to_db_timestamp", "from_db_timestamp"]
+
+DB_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def to_utc(value: datetime) -> datetime:
+    """
+    Приводит дату к UTC. Дата без часового пояса считается заданной в UTC, как CURRENT_TIMESTAMP в SQLite.
+
+    :param value: Дата
+    :return: Дата с часовым поясом UTC
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def to_db_timestamp(value: datetime | None) -> str | None:
+    """
+    Форматирует дату для хранения в SQLite в том же виде, что и CURRENT_TIMESTAMP (UTC, без долей секунды),
+    чтобы строковые сравнения с CURRENT_TIMESTAMP были корректны.
+
+    :param value: Дата или None
+    :return: Строка в формате DB_TIMESTAMP_FORMAT или None
+    """
+    if value is None:
+        return None
+    return to_utc(value).strftime(DB_TIMESTAMP_FORMAT)
+
+
+def from_db_timestamp(value: str | None) -> datetime | None:
+    """
+    Разбирает дату, сохранённую в SQLite в формате DB_TIMESTAMP_FORMAT.
+
+    :param value: Строка или None
+    :return: Дата с часовым поясом UTC или None
+    """
+    if not value:
+        return None
+    return datetime.strptime(value, DB_TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
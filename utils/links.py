@@ -1,15 +1,144 @@
 import base64
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import padding
-from cryptography.hazmat.backends import default_backend
+import hashlib
 import secrets
 import string
+from urllib.parse import urlsplit, urlunsplit
 
 from config import AESConfig
+from context import app_context
+from metrics import aes_operations
 
 
-aes_config = AESConfig()
 charset_for_string_generate = string.ascii_letters + string.digits
+_default_ports = {"http": 80, "https": 443}
+_aes_encryptions = aes_operations.labels("encrypt")
+_aes_decryptions = aes_operations.labels("decrypt")
+
+
+class AESEngine:
+    """
+    Шифрование AES-256 в режиме CBC с кодированием в base64.
+    Ключ и IV декодируются и проверяются один раз при создании,
+    объект Cipher переиспользуется для всех операций.
+    cryptography импортируется при создании движка, а не при импорте модуля.
+    """
+    def __init__(self, config: AESConfig):
+        """
+        :param config: Конфигурация с ключом и IV в base64
+        :raises ValueError: Если ключ или IV неверной длины
+        """
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        from cryptography.hazmat.primitives import padding
+        from cryptography.hazmat.backends import default_backend
+
+        key = base64.b64decode(config.aes_key_b64.get_secret_value())
+        iv = base64.b64decode(config.aes_iv_b64.get_secret_value())
+        if len(key) != 32:
+            raise ValueError("Ключ должен быть 32 байта для AES-256")
+        if len(iv) != 16:
+            raise ValueError("IV должен быть 16 байт")
+
+        self._cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+        self._padding = padding.PKCS7(algorithms.AES.block_size)
+        hash_key = hashlib.blake2b(key, digest_size=32, person=b"link-lookup-key").digest()
+        self._hasher = hashlib.blake2b(key=hash_key, digest_size=16)
+
+    def encrypt(self, plaintext: str) -> str:
+        """
+        Шифрует строку и кодирует результат в base64.
+
+        :param plaintext: Исходная строка для шифрования
+        :return: Зашифрованная в AES-256 и закодированная в base64 строка
+        """
+        return base64.b64encode(self.encrypt_bytes(plaintext)).decode('utf-8')
+
+    def decrypt(self, encrypted_base64: str) -> str:
+        """
+        Дешифрует строку из base64 + AES-256.
+
+        :param encrypted_base64: Зашифрованная строка в формате base64
+        :return: Расшифрованная исходная строка
+        """
+        return self.decrypt_bytes(base64.b64decode(encrypted_base64))
+
+    def encrypt_bytes(self, plaintext: str) -> bytes:
+        """
+        Шифрует строку без кодирования в base64.
+
+        :param plaintext: Исходная строка для шифрования
+        :return: Шифротекст AES-256
+        """
+        _aes_encryptions.inc()
+        padder = self._padding.padder()
+        padded_data = padder.update(plaintext.encode()) + padder.finalize()
+
+        encryptor = self._cipher.encryptor()
+        return encryptor.update(padded_data) + encryptor.finalize()
+
+    def decrypt_bytes(self, ciphertext: bytes | memoryview) -> str:
+        """
+        Дешифрует шифротекст AES-256 без base64.
+
+        :param ciphertext: Шифротекст
+        :return: Расшифрованная исходная строка
+        """
+        _aes_decryptions.inc()
+        decryptor = self._cipher.decryptor()
+        decrypted_padded = decryptor.update(ciphertext) + decryptor.finalize()
+
+        unpadder = self._padding.unpadder()
+        decrypted_data = unpadder.update(decrypted_padded) + unpadder.finalize()
+
+        return decrypted_data.decode('utf-8')
+
+    def encrypt_many(self, plaintexts: list[str]) -> list[str]:
+        """
+        Шифрует список строк с тем же результатом, что encrypt для каждой строки.
+        Шифр и дополнение PKCS7 берутся из уже созданных объектов, счётчик метрики увеличивается один раз на пачку.
+
+        :param plaintexts: Исходные строки для шифрования
+        :return: Зашифрованные строки в том же порядке
+        """
+        _aes_encryptions.inc(len(plaintexts))
+        cipher, pkcs7, b64encode = self._cipher, self._padding, base64.b64encode
+        results = []
+        for plaintext in plaintexts:
+            padder = pkcs7.padder()
+            encryptor = cipher.encryptor()
+            padded_data = padder.update(plaintext.encode()) + padder.finalize()
+            results.append(b64encode(encryptor.update(padded_data) + encryptor.finalize()).decode('utf-8'))
+        return results
+
+    def decrypt_many(self, encrypted: list[str]) -> list[str]:
+        """
+        Дешифрует список строк с тем же результатом, что decrypt для каждой строки.
+
+        :param encrypted: Зашифрованные строки в формате base64
+        :return: Расшифрованные строки в том же порядке
+        :raises ValueError: Если длина шифротекста или дополнение неверны
+        """
+        _aes_decryptions.inc(len(encrypted))
+        cipher, pkcs7, b64decode = self._cipher, self._padding, base64.b64decode
+        results = []
+        for value in encrypted:
+            decryptor = cipher.decryptor()
+            unpadder = pkcs7.unpadder()
+            decrypted_padded = decryptor.update(b64decode(value)) + decryptor.finalize()
+            results.append((unpadder.update(decrypted_padded) + unpadder.finalize()).decode('utf-8'))
+        return results
+
+    def keyed_hash(self, value: str) -> str:
+        """
+        Детерминированный ключевой хеш строки (BLAKE2b с ключом, производным от ключа AES).
+        Используется как ключ поиска вместо шифротекста: значительно дешевле AES и не раскрывает исходную строку.
+
+        :param value: Исходная строка
+        :return: Хеш в hex (32 символа)
+        """
+        hasher = self._hasher.copy()
+        hasher.update(value.encode())
+        return hasher.hexdigest()
+
 
 def encrypt_aes256_base64(plaintext: str) -> str:
     """
@@ -17,58 +146,87 @@ def encrypt_aes256_base64(plaintext: str) -> str:
 
     :param plaintext: Исходная строка для шифрования
     :return: Зашифрованная в AES-256 и закодированная в base64 строка
-    :raises ValueError: Если ключ или IV неверной длины
     """
-    key_b64 = aes_config.aes_key_b64.get_secret_value()
-    iv_b64 = aes_config.aes_iv_b64.get_secret_value()
+    return app_context.aes_engine.encrypt(plaintext)
 
-    key = base64.b64decode(key_b64)
-    iv = base64.b64decode(iv_b64)
-    if len(key) != 32:
-        raise ValueError("Ключ должен быть 32 байта для AES-256")
-    if len(iv) != 16:
-        raise ValueError("IV должен быть 16 байт")
 
-    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+def decrypt_aes256_base64_bytes(encrypted_base64: str) -> str:
+    """
+    Дешифрует строку из base64 + AES-256 в режиме CBC.
 
-    padded_data = padder.update(plaintext.encode()) + padder.finalize()
+    :param encrypted_base64: Зашифрованная строка в формате base64
+    :return: Расшифрованная исходная строка
+    """
+    return app_context.aes_engine.decrypt(encrypted_base64)
 
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
-    ciphertext = encryptor.update(padded_data) + encryptor.finalize()
 
-    return base64.b64encode(ciphertext).decode('utf-8')
+def encrypt_aes256_bytes(plaintext: str) -> bytes:
+    """
+    Шифрует строку с использованием AES-256 в режиме CBC без кодирования в base64.
 
+    :param plaintext: Исходная строка для шифрования
+    :return: Шифротекст
+    """
+    return app_context.aes_engine.encrypt_bytes(plaintext)
 
-def decrypt_aes256_base64_bytes(encrypted_base64: str) -> str:
+
+def decrypt_aes256_bytes(ciphertext: bytes | memoryview) -> str:
     """
-    Дешифрует строку из base64 + AES-256 в режиме CBC.
+    Дешифрует шифротекст AES-256 в режиме CBC без base64.
 
-    :param encrypted_base64: Зашифрованная строка в формате base64
+    :param ciphertext: Шифротекст
     :return: Расшифрованная исходная строка
-    :raises ValueError: Если ключ или IV неверной длины
     """
-    key_b64 = aes_config.aes_key_b64.get_secret_value()
-    iv_b64 = aes_config.aes_iv_b64.get_secret_value()
+    return app_context.aes_engine.decrypt_bytes(ciphertext)
 
-    key = base64.b64decode(key_b64)
-    iv = base64.b64decode(iv_b64)
 
-    if len(key) != 32:
-        raise ValueError("Ключ должен быть 32 байта для AES-256")
-    if len(iv) != 16:
-        raise ValueError("IV должен быть 16 байт")
+def short_url_lookup_key(short_url: str) -> str:
+    """
+    Ключ поиска короткой ссылки: используется в колонке links.short_url_hash и как ключ в Redis.
 
-    ciphertext = base64.b64decode(encrypted_base64)
+    :param short_url: Короткий URL
+    :return: Ключевой хеш короткого URL
+    """
+    return app_context.aes_engine.keyed_hash(short_url)
 
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    decryptor = cipher.decryptor()
-    decrypted_padded = decryptor.update(ciphertext) + decryptor.finalize()
 
-    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
-    decrypted_data = unpadder.update(decrypted_padded) + unpadder.finalize()
+def canonicalize_url(url: str) -> str:
+    """
+    Приводит URL к каноническому виду для поиска уже сокращённых ссылок: схема и хост в нижнем регистре,
+    порт по умолчанию для схемы убирается, пустой путь заменяется на "/".
+    Путь, параметры и фрагмент не меняются, так как от них может зависеть ответ сервера.
 
-    return decrypted_data.decode('utf-8')
+    :param url: URL
+    :return: Канонический URL
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    if ":" in host:
+        host = f"[{host}]"
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port is None or port == _default_ports.get(scheme) else f"{host}:{port}"
+    if parts.username is not None or parts.password is not None:
+        credentials = parts.username or ""
+        if parts.password is not None:
+            credentials += ":" + parts.password
+        netloc = credentials + "@" + netloc
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def original_url_lookup_key(original_url: str) -> str:
+    """
+    Ключ поиска ссылки по оригинальному URL: используется в колонке links.original_url_hash
+    и в обратном индексе в Redis. URL с одинаковым каноническим видом получают один ключ.
+
+    :param original_url: Оригинальный URL
+    :return: Ключевой хеш канонического URL
+    """
+    # Префикс разделяет пространства ключей оригинальных URL и коротких кодов
+    return app_context.aes_engine.keyed_hash("url:" + canonicalize_url(original_url))
 
 
 def generate_random_string(length: int) -> str:
@@ -80,3 +238,22 @@ def generate_random_string(length: int) -> str:
     :returns: Случайная строка из букв и цифр
     """
     return ''.join(secrets.choice(charset_for_string_generate) for _ in range(length))
+
+
+def url_host(url: str) -> str:
+    """
+    :param url: URL
+    :return: Хост URL в нижнем регистре без завершающей точки, для IPv6 - без квадратных скобок
+    """
+    return (urlsplit(url).hostname or "").rstrip(".")
+
+
+def host_lookup_key(host: str) -> str:
+    """
+    Ключ поиска ссылок по хосту оригинального URL. Оригинальный URL хранится зашифрованным,
+    поэтому ссылки ищутся по отдельно хранимому ключу хоста.
+
+    :param host: Хост, например example.com
+    :return: Ключ поиска (keyed hash хоста)
+    """
+    return app_context.aes_engine.keyed_hash("host:" + host.lower().strip("[]").rstrip("."))
@@ -0,0 +1,23 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+__all__ = ["run_periodically"]
+
+logger = logging.getLogger(__name__)
+
+
+async def run_periodically(func: Callable[[], Awaitable], interval_seconds: float):
+    """
+    Бесконечно вызывает асинхронную функцию с заданным периодом.
+    Ошибки логируются и не прерывают цикл. Используется для фоновых задач из FastAPI lifespan.
+
+    :param func: Асинхронная функция без аргументов
+    :param interval_seconds: Пауза между вызовами в секундах
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await func()
+        except Exception as e:
+            logger.error(f"Periodic task {getattr(func, '__name__', func)} failed: {e}")